@@ -6,6 +6,48 @@ VERSION = "0.49"
 DB_NAME = "outline.db"  # default db it will look for or create
 PASSWORD_MIN_LENGTH = 3
 
+# Batch encryption (decrypt_many / encrypt_many)
+CRYPTO_WORKERS = 0                 # worker processes for large batches, 0 = one per CPU core
+PARALLEL_CRYPTO_MIN_ITEMS = 2000   # smaller batches run in-process; pool start-up isn't free
+
+# Decrypted content cache (tree, editor, search, exports)
+PLAINTEXT_CACHE_MAX_BYTES = 32 * 1024 * 1024   # memory budget for cached plaintext
+PLAINTEXT_CACHE_TTL_SECONDS = 600              # entries older than this are decrypted again
+
+# Note payloads
+NOTE_COMPRESS_MIN_BYTES = 512      # notes smaller than this are stored uncompressed
+NOTE_CHUNKED_MIN_BYTES = 16 * 1024 # larger notes are stored as chunks (section_chunks)
+NOTE_CHUNK_MIN_BYTES = 4 * 1024    # no chunk boundary before this many bytes
+NOTE_CHUNK_MAX_BYTES = 64 * 1024   # forced boundary, e.g. inside one very long line
+NOTE_CHUNK_BOUNDARY_MODULUS = 16   # past the minimum, ~1 line in this many ends a chunk
+
+# Password KDF for key slots, calibrated per database on first use
+KDF_ALGORITHM = "pbkdf2-sha256"    # or "scrypt"
+KDF_TARGET_UNLOCK_MS = 300         # target time for one unlock on the machine that set it
+
+# Re-encryption jobs (key rotation, key slot and ciphertext format upgrades)
+REENCRYPT_CHUNK_SIZE = 2000        # rows per committed chunk; large enough to use the worker pool
+REENCRYPT_INTERVAL_MS = 50         # pause between chunks so the UI stays responsive
+
+# Sibling order: placements are spaced this far apart so an insert or move
+# takes the midpoint of its neighbours; siblings are respaced only when two
+# neighbours end up adjacent
+PLACEMENT_GAP = 1024
+
+# Editor saves (write-behind): held this long, then written in one commit
+WRITE_BEHIND_DELAY_MS = 500        # delay between the first pending save and its flush
+WRITE_BEHIND_MAX_PENDING = 50      # flush early once this many sections are waiting
+WRITE_BEHIND_RETRY_MAX_MS = 30000  # a failed flush is retried after doubling delays, up to this
+
+# Read-only connections for exports, search indexing and prefetching (WAL snapshots)
+READ_POOL_SIZE = 4                 # idle read connections kept open for reuse
+
+# Whole-database backups (online backup API / VACUUM INTO)
+BACKUP_DIR = "backups"             # timestamped backups go here, next to the database file
+BACKUP_KEEP = 10                   # newest backups kept; older ones are deleted after each backup
+BACKUP_PAGES_PER_STEP = 256        # pages copied per backup step
+BACKUP_POLL_MS = 100               # how often the UI checks on a running backup
+
 # WARNING FOR DECRYPTION TIMES
 WARNING_LIMIT_ITEM_COUNT = 20   # decrypt/encrypt more than this amount, will give warning
 WARNING_DISPLAY_TIME_MS = 3000  # How long warning shows (3 seconds)
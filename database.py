@@ -1,55 +1,433 @@
+import codecs
+import os
+import queue
 import sqlite3
 import json
 import hashlib
+import threading
 
-from typing import Dict, Set, Tuple
-import time
+from contextlib import contextmanager
+from typing import Set, Tuple
+from urllib.request import pathname2url
 
-from manager_encryption import EncryptionManager
-from config import DB_NAME, PASSWORD_MIN_LENGTH
+from manager_encryption import (
+    EncryptionManager,
+    FORMAT_V2,
+    calibrate_kdf,
+    create_key_slot,
+    generate_data_key,
+    kdf_params,
+)
+from manager_backup import BackupService
+from manager_cache import PlaintextCache
+from manager_migrations import migrate
+from manager_numbering import NumberingService
+from manager_writes import WriteBehindQueue
+from manager_notes import (
+    decode_note,
+    encode_manifest,
+    encode_note,
+    is_chunked,
+    manifest_digests,
+    pack_bytes,
+    split_note,
+    unpack_bytes,
+)
+from config import (
+    DB_NAME,
+    PASSWORD_MIN_LENGTH,
+    REENCRYPT_CHUNK_SIZE,
+    KDF_ALGORITHM,
+    KDF_TARGET_UNLOCK_MS,
+    NOTE_CHUNKED_MIN_BYTES,
+    PLACEMENT_GAP,
+    READ_POOL_SIZE,
+)
 from utility import timer
 
+# Settings rows for envelope encryption. Each "keyslot:<id>" row holds the data
+# key wrapped under one password; "password" only marks that a password is set.
+KEY_SLOT_PREFIX = "keyslot:"
+PASSWORD_KEYSLOT_MARKER = "keyslots"
+REENCRYPT_JOB_KEY = "reencrypt_job"
+KDF_PARAMS_KEY = "kdf_params"
+# Startup integrity gate: the full tree check runs only when the stored layout
+# version is older than TREE_LAYOUT_VERSION (2 = gap-spaced placements with
+# the path index) or the last session didn't close cleanly
+TREE_LAYOUT_KEY = "tree_layout_version"
+TREE_LAYOUT_VERSION = 2
+SESSION_OPEN_KEY = "session_open"
+
 class DatabaseHandler:
     def __init__(self, db_name=DB_NAME, encryption_manager=None):
-        self.encryption_manager = encryption_manager
+        self._encryption_manager = encryption_manager
         self.db_name = db_name
-        self.conn = sqlite3.connect(self.db_name)
+        # Autocommit: every write that spans statements runs in transaction().
+        # This writer connection belongs to the Tk thread; other threads read
+        # through reading()
+        self.conn = sqlite3.connect(self.db_name, isolation_level=None)
         self.cursor = self.conn.cursor()
-        self._numbering_cache = {}
-        self._children_cache = {}
+        self._readers = queue.LifoQueue()  # idle read-only connections
+        self._reader_epoch = 0  # bumped when the pool is closed; stale borrows aren't returned
+        self._local = threading.local()  # the read cursor a thread is using, if any
+        # Last structure version read, and the (data_version, total_changes)
+        # it was read at; see structure_version
+        self._structure_version = None
+        self._structure_marker = None
+        # Incremental outline numbers for the tree view
+        self.numbering = NumberingService(self)
+        # Editor saves waiting for a group commit
+        self.writes = WriteBehindQueue(self)
+        # Whole-database copies: hot backups and compacted copies
+        self.backups = BackupService(self)
         self.setup_database()
+        self._bind_data_key()
 
-        # search cache
-        self._search_cache: Dict[str, Dict[str, str]] = {}
-        self._last_cache_update = 0
-        self._cache_lifetime = 300  # 5 minutes cache lifetime
-        
-        # Add indices for common queries
+        # Decrypted titles/notes shared by the tree, editor, search and exports
+        self.plaintext_cache = PlaintextCache()
+
+    @property
+    def encryption_manager(self):
+        return self._encryption_manager
+
+    @encryption_manager.setter
+    def encryption_manager(self, manager):
+        self._encryption_manager = manager
+        self._bind_data_key()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Run a block as one transaction: BEGIN IMMEDIATE on entry, COMMIT when
+        it completes, ROLLBACK if it raises. The connection is in autocommit
+        mode, so single statements commit on their own and a block opened
+        inside another joins the outer one; callers can group several writing
+        methods (add_section, update_section, move_section...) into one commit.
+        """
+        if self.conn.in_transaction:
+            yield self.cursor
+            return
+        self.cursor.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.cursor
+        except BaseException:
+            self.conn.rollback()
+            raise
+        self.conn.commit()
+
+    # READ CONNECTIONS
+
+    def _read_only_uri(self):
+        return f"file:{pathname2url(os.path.abspath(self.db_name))}?mode=ro"
+
+    def _open_reader(self):
+        conn = sqlite3.connect(self._read_only_uri(), uri=True, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA query_only = ON")
+        return conn
+
+    @contextmanager
+    def reading(self):
+        """
+        Borrow a read-only connection from the pool for the current thread and
+        read one WAL snapshot through it: the block sees the database as of its
+        first query, whatever the writer commits meanwhile. Inside the block the
+        read paths used by exports, search and prefetching (subtree_bounds,
+        decrypt_column, refresh_search_cache...) go through this connection, so
+        they can run on a worker thread. Nested blocks share the snapshot.
+        """
+        cursor = getattr(self._local, "cursor", None)
+        if cursor is not None:
+            yield cursor
+            return
+        epoch = self._reader_epoch
+        try:
+            conn = self._readers.get_nowait()
+        except queue.Empty:
+            conn = self._open_reader()
+        cursor = conn.cursor()
+        self._local.cursor = cursor
+        try:
+            cursor.execute("BEGIN")
+            yield cursor
+        finally:
+            self._local.cursor = None
+            conn.rollback()
+            if epoch == self._reader_epoch and self._readers.qsize() < READ_POOL_SIZE:
+                self._readers.put(conn)
+            else:
+                conn.close()
+
+    def _read_cursor(self):
+        """The thread's read cursor inside reading(), otherwise the writer's."""
+        return getattr(self._local, "cursor", None) or self.cursor
+
+    def _close_readers(self):
+        self._reader_epoch += 1
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def _get_kdf_salt(self):
+        """Return the master salt of a database that predates key slots, if any."""
+        self.cursor.execute("SELECT value FROM settings WHERE key = ?", ("kdf_salt",))
+        result = self.cursor.fetchone()
+        return bytes.fromhex(result[0]) if result and result[0] else None
+
+    def _load_key_slots(self):
+        """Return {settings key: slot dict} for every stored key slot."""
+        self.cursor.execute(
+            "SELECT key, value FROM settings WHERE key LIKE ?", (KEY_SLOT_PREFIX + "%",)
+        )
+        return {key: json.loads(value) for key, value in self.cursor.fetchall()}
+
+    def _bind_data_key(self):
+        """
+        Give the encryption manager this database's data key. Reassigning a
+        manager that already holds it costs nothing; otherwise one slot is opened.
+        """
+        manager = self._encryption_manager
+        if manager is None:
+            return
+        self._open_key_slots(manager)
+
+    def _open_key_slots(self, manager):
+        """
+        Load every data key manager's password opens, then make the key a
+        pending re-encryption is moving rows to the active one. Old keys stay
+        loaded so rows not reached yet remain readable. Returns False if the
+        password opens no slot.
+        """
+        salt = self._get_kdf_salt()
+        if salt:
+            # v1 rows stay readable until the key slot migration reaches them
+            manager.bind_master_salt(salt)
+        slots = self._load_key_slots()
+        if not slots:
+            return bool(salt)
+        opened = set()
+        for slot in slots.values():
+            if slot["key_id"] in opened:
+                continue
+            if manager.open_key_slot(slot):
+                opened.add(slot["key_id"])
+        if not opened:
+            return False
+        job = self._load_reencrypt_job()
+        if job and job["target_key_id"] in opened:
+            manager.use_key(bytes.fromhex(job["target_key_id"]))
+        return True
+
+    def _write_key_slots(self, slots):
+        """Replace all key slots and mark the password as set. Caller commits."""
+        self.cursor.execute("DELETE FROM settings WHERE key LIKE ?", (KEY_SLOT_PREFIX + "%",))
+        for name, slot in slots.items():
+            self.cursor.execute(
+                "INSERT INTO settings (key, value) VALUES (?, ?)", (name, json.dumps(slot))
+            )
+        self.cursor.execute(
+            "INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
+            ("password", PASSWORD_KEYSLOT_MARKER),
+        )
+
+    def _current_data_key(self, slots):
+        """Return (key_id, data_key) for this database from the unlocked manager."""
+        key_id = bytes.fromhex(next(iter(slots.values()))["key_id"])
+        if self._encryption_manager is None:
+            raise ValueError("Unlock the database before changing its key slots.")
+        return key_id, self._encryption_manager.data_key(key_id)
+
+    @staticmethod
+    def _new_slot_name():
+        return f"{KEY_SLOT_PREFIX}{os.urandom(4).hex()}"
+
+    def get_kdf_params(self):
+        """
+        KDF parameters for new key slots. Chosen by calibration the first time
+        a slot is written on this database, then stored in settings.
+        """
+        self.cursor.execute("SELECT value FROM settings WHERE key = ?", (KDF_PARAMS_KEY,))
+        result = self.cursor.fetchone()
+        if result and result[0]:
+            try:
+                return kdf_params(json.loads(result[0]))
+            except (KeyError, ValueError) as e:
+                print(f"Ignoring stored KDF parameters: {e}")
+        return self.save_kdf_params(calibrate_kdf(KDF_ALGORITHM, KDF_TARGET_UNLOCK_MS))
+
+    def save_kdf_params(self, params):
+        """Store KDF parameters for new key slots; existing slots keep theirs."""
+        params = kdf_params(params)
+        self.cursor.execute(
+            "INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
+            (KDF_PARAMS_KEY, json.dumps(params)),
+        )
+        return params
+
+    @timer
+    def retune_kdf(self, password, target_ms=KDF_TARGET_UNLOCK_MS, kdf=KDF_ALGORITHM):
+        """
+        Recalibrate the KDF for this machine and rewrap password's key slots
+        with the new parameters. Only the slots change; rows are not touched.
+        """
+        if not self.validate_password(password):
+            raise ValueError("Password is incorrect.")
+        self.run_reencryption()
+        params = self.save_kdf_params(calibrate_kdf(kdf, target_ms))
+        slots = self._load_key_slots()
+        manager = self._encryption_manager
+        with self.transaction():
+            for name, slot in list(slots.items()):
+                unwrapped = manager.unwrap_key_slot(slot)
+                if unwrapped:
+                    slots[name] = create_key_slot(password, *unwrapped, params)
+            self._write_key_slots(slots)
+        return params
+
+    @timer
+    def _migrate_to_key_slots(self, password):
+        """
+        One-time upgrade of a database without key slots: create a random data
+        key, store it wrapped under password and queue a re-encryption job that
+        moves every row to it. The old password-derived keys stay loaded (and
+        kdf_salt stays stored) until the job finishes, so nothing is unreadable
+        in between.
+        """
+        manager = self._encryption_manager
+        if manager is None or manager.password != password.encode('utf-8'):
+            manager = EncryptionManager(password)
+        salt = self._get_kdf_salt()
+        if salt:
+            manager.bind_master_salt(salt)
+        params = self.get_kdf_params()
+        key_id, data_key = generate_data_key()
+        manager.load_data_key(key_id, data_key)
+        with self.transaction():
+            self._write_key_slots(
+                {self._new_slot_name(): create_key_slot(password, key_id, data_key, params)}
+            )
+            self.cursor.execute("SELECT EXISTS (SELECT 1 FROM sections)")
+            if self.cursor.fetchone()[0]:
+                self._save_reencrypt_job("key slots", key_id, 0)
+            else:
+                self.cursor.execute("DELETE FROM settings WHERE key = ?", ("kdf_salt",))
+        self._encryption_manager = manager
+
+    # RE-ENCRYPTION ENGINE
+
+    def _load_reencrypt_job(self):
+        """Return the pending re-encryption job (kind, target key, checkpoint), if any."""
+        self.cursor.execute("SELECT value FROM settings WHERE key = ?", (REENCRYPT_JOB_KEY,))
+        result = self.cursor.fetchone()
+        return json.loads(result[0]) if result and result[0] else None
+
+    def _save_reencrypt_job(self, kind, key_id, after_id):
+        """Record a job and its checkpoint. Caller commits."""
+        self.cursor.execute(
+            "INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
+            (REENCRYPT_JOB_KEY, json.dumps({
+                "kind": kind,
+                "target_key_id": key_id.hex(),
+                "after_id": after_id,
+            })),
+        )
+
+    def has_pending_reencryption(self):
+        return self._load_reencrypt_job() is not None
+
+    def queue_format_upgrade(self):
+        """Start a job if any row still holds text-format (pre-v2) ciphertext."""
+        if self.has_pending_reencryption() or self._encryption_manager is None:
+            return False
         self.cursor.execute("""
-            CREATE INDEX IF NOT EXISTS idx_sections_parent 
-            ON sections(parent_id, placement)
+            SELECT EXISTS (
+                SELECT 1 FROM sections WHERE typeof(title) = 'text'
+            ) OR EXISTS (
+                SELECT 1 FROM section_content WHERE typeof(questions) = 'text'
+            )
         """)
+        if not self.cursor.fetchone()[0]:
+            return False
+        self._save_reencrypt_job("format", self._encryption_manager.key_id, 0)
+        return True
+
+    @timer
+    def reencrypt_step(self, chunk_size=REENCRYPT_CHUNK_SIZE):
+        """
+        Move one id-ordered chunk of rows to the current format under the active
+        key and commit it together with the job's checkpoint, so a crash or a
+        cancel resumes from the last committed chunk. Readers keep working
+        throughout because the manager holds both the old and the new keys.
+        Returns True while work remains.
+        """
+        job = self._load_reencrypt_job()
+        if job is None:
+            return False
+        manager = self._encryption_manager
+        target_key_id = bytes.fromhex(job["target_key_id"])
+        manager.use_key(target_key_id)
+
         self.cursor.execute("""
-            CREATE INDEX IF NOT EXISTS idx_sections_type 
-            ON sections(type)
-        """)
+            SELECT s.id, s.title, c.questions
+            FROM sections s
+            LEFT JOIN section_content c ON c.section_id = s.id
+            WHERE s.id > ?
+            ORDER BY s.id
+            LIMIT ?
+        """, (job["after_id"], chunk_size))
+        rows = self.cursor.fetchall()
+        if not rows:
+            self._finish_reencryption(target_key_id)
+            return False
+
+        # Crypto for the whole chunk goes through the worker pool when large
+        titles = manager.upgrade_ciphertext(row[1] for row in rows)
+        notes = manager.upgrade_ciphertext(row[2] for row in rows)
+        self.cursor.execute(
+            "SELECT rowid, data FROM section_chunks WHERE section_id > ? AND section_id <= ?",
+            (job["after_id"], rows[-1][0])
+        )
+        chunk_rows = self.cursor.fetchall()
+        chunks = manager.upgrade_ciphertext(row[1] for row in chunk_rows)
+        with self.transaction():
+            self.cursor.executemany(
+                "UPDATE sections SET title = ? WHERE id = ?",
+                [(title, row[0]) for row, title in zip(rows, titles) if title is not None]
+            )
+            self.cursor.executemany(
+                "UPDATE section_content SET questions = ? WHERE section_id = ?",
+                [(note, row[0]) for row, note in zip(rows, notes) if note is not None]
+            )
+            self.cursor.executemany(
+                "UPDATE section_chunks SET data = ? WHERE rowid = ?",
+                [(data, row[0]) for row, data in zip(chunk_rows, chunks) if data is not None]
+            )
+            self._save_reencrypt_job(job["kind"], target_key_id, rows[-1][0])
+        return True
+
+    def run_reencryption(self, chunk_size=REENCRYPT_CHUNK_SIZE):
+        """Run the pending job to completion in the foreground."""
+        while self.reencrypt_step(chunk_size):
+            pass
+
+    def _finish_reencryption(self, key_id):
+        """Retire everything the finished job replaced: old key slots and kdf_salt."""
+        with self.transaction():
+            slots = self._load_key_slots()
+            self._write_key_slots({
+                name: slot for name, slot in slots.items()
+                if slot["key_id"] == key_id.hex()
+            })
+            self.cursor.execute("DELETE FROM settings WHERE key = ?", ("kdf_salt",))
+            self.cursor.execute("DELETE FROM settings WHERE key = ?", (REENCRYPT_JOB_KEY,))
 
     @timer
     def get_section_level(self, section_id):
-        """Get level by counting parents up to root."""
-        level = 1
-        current_id = section_id
-        
-        while current_id is not None:
-            self.cursor.execute("SELECT parent_id FROM sections WHERE id = ?", (current_id,))
-            result = self.cursor.fetchone()
-            if result:
-                current_id = result[0]
-                level += 1
-            else:
-                break
-                
-        return level
+        """Get level from the tree index: one more than the section's depth."""
+        self.cursor.execute("SELECT depth FROM sections WHERE id = ?", (section_id,))
+        result = self.cursor.fetchone()
+        return result[0] + 1 if result and result[0] else 1
 
     def get_section_title(self, section_id):
         """
@@ -58,76 +436,117 @@ class DatabaseHandler:
         self.cursor.execute("SELECT title FROM sections WHERE id = ?", (section_id,))
         result = self.cursor.fetchone()
         if result and result[0]:
-            return self.decrypt_safely(result[0])
+            return self.decrypt_column([section_id], [result[0]], "title")[0]
         return ""
 
-    @timer
+    def get_section_content(self, section_id):
+        """Return the decrypted (title, questions) of a section, or None if it doesn't exist."""
+        self.cursor.execute("""
+            SELECT s.title, c.questions
+            FROM sections s
+            LEFT JOIN section_content c ON c.section_id = s.id
+            WHERE s.id = ?
+        """, (section_id,))
+        row = self.cursor.fetchone()
+        if not row:
+            return None
+        title = self.decrypt_column([section_id], [row[0]], "title")[0]
+        questions = self.decrypt_column([section_id], [row[1]], "questions")[0]
+        return title, questions
+
     def setup_database(self):
-        """Initialize database schema with core optimizations."""
-        
-        # Set PRAGMA settings before any other operations
-        self.cursor.execute("PRAGMA journal_mode=WAL")
+        """
+        Bring the schema up to date (see manager_migrations). A current
+        database costs one PRAGMA user_version read.
+        """
+        # Per connection, so it is set on every open
         self.cursor.execute("PRAGMA synchronous=NORMAL")
-        
-        # Begin transaction for schema changes
-        self.cursor.execute("BEGIN")
-        
-        # Create sections table
-        self.cursor.execute("""
-            CREATE TABLE IF NOT EXISTS sections (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                parent_id INTEGER,
-                title TEXT DEFAULT '',
-                type TEXT,
-                questions TEXT DEFAULT '[]',
-                placement INTEGER NOT NULL CHECK(placement > 0)
-            )
-        """)
-        
-        # Create settings table
+        migrate(self)
+
+    def _rebuild_tree_index(self):
+        """Recompute every path and depth from parent_id; the caller commits."""
+        self.cursor.execute("UPDATE sections SET path = NULL, depth = NULL")
         self.cursor.execute("""
-            CREATE TABLE IF NOT EXISTS settings (
-                key TEXT PRIMARY KEY,
-                value TEXT
+            WITH RECURSIVE tree(id, path, depth) AS (
+                SELECT id, '/' || id || '/', 1
+                FROM sections
+                WHERE parent_id IS NULL
+                UNION ALL
+                SELECT s.id, t.path || s.id || '/', t.depth + 1
+                FROM sections s
+                INNER JOIN tree t ON s.parent_id = t.id
             )
+            UPDATE sections
+            SET path = tree.path, depth = tree.depth
+            FROM tree
+            WHERE sections.id = tree.id
         """)
-        
-        # Create optimized indices
-        self.cursor.execute("""
-            CREATE INDEX IF NOT EXISTS idx_sections_tree 
-            ON sections(parent_id, placement, type)
-            WHERE parent_id IS NOT NULL
-        """)
-        
-        self.cursor.execute("""
-            CREATE INDEX IF NOT EXISTS idx_sections_root
-            ON sections(placement, type)
-            WHERE parent_id IS NULL
-        """)
-        
-        # Add deletion trigger
-        self.cursor.execute("""
-            CREATE TRIGGER IF NOT EXISTS maintain_placement_delete
-            BEFORE DELETE ON sections
-            FOR EACH ROW
-            BEGIN
-                UPDATE sections 
-                SET placement = placement - 1 
-                WHERE parent_id IS OLD.parent_id 
-                AND placement > OLD.placement;
-            END;
-        """)
-        
-        self.cursor.execute("COMMIT")
+
+    @timer
+    def rebuild_tree_index(self):
+        """
+        Rebuild the path/depth tree index, e.g. after rows were edited by a
+        tool that bypasses the triggers. Returns the number of indexed rows.
+        """
+        with self.transaction():
+            self._rebuild_tree_index()
+        self.cursor.execute("SELECT COUNT(*) FROM sections WHERE path IS NOT NULL")
+        return self.cursor.fetchone()[0]
+
+    def subtree_bounds(self, section_id=None):
+        """
+        Return (low, high) such that "path >= low AND path < high" selects a
+        section and all its descendants, or the whole tree for None. A missing
+        section gives an empty range.
+        """
+        if section_id is None:
+            return "/", "0"
+        cursor = self._read_cursor()
+        cursor.execute("SELECT path FROM sections WHERE id = ?", (section_id,))
+        row = cursor.fetchone()
+        if not row or not row[0]:
+            return "", ""
+        # "0" sorts right after "/", so this bounds every path with the prefix
+        return row[0], row[0][:-1] + "0"
+
+    def get_ancestors(self, section_id):
+        """Return the ids from the root down to the section's parent."""
+        self.cursor.execute("SELECT path FROM sections WHERE id = ?", (section_id,))
+        row = self.cursor.fetchone()
+        if not row or not row[0]:
+            return []
+        return [int(part) for part in row[0].strip("/").split("/")[:-1]]
 
     @timer
     def set_password(self, password):
-        hashed_password = hashlib.sha256(password.encode()).hexdigest()
-        self.cursor.execute(
-            "INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
-            ("password", hashed_password),
-        )
-        self.conn.commit()
+        """
+        Make password the only one that opens this database. Creates the data key
+        on first use; afterwards only the 32-byte key is rewrapped.
+        """
+        slots = self._load_key_slots()
+        if not slots:
+            self._migrate_to_key_slots(password)
+            return
+        # Old keys are only dropped once no row needs them
+        self.run_reencryption()
+        params = self.get_kdf_params()
+        key_id, data_key = self._current_data_key(self._load_key_slots())
+        with self.transaction():
+            self._write_key_slots({self._new_slot_name(): create_key_slot(password, key_id, data_key, params)})
+
+    @timer
+    def add_password(self, password):
+        """Add another password that unlocks the same data key."""
+        slots = self._load_key_slots()
+        if not slots:
+            raise ValueError("Set a password before adding another one.")
+        self.run_reencryption()
+        params = self.get_kdf_params()
+        slots = self._load_key_slots()
+        key_id, data_key = self._current_data_key(slots)
+        slots[self._new_slot_name()] = create_key_slot(password, key_id, data_key, params)
+        with self.transaction():
+            self._write_key_slots(slots)
 
     @timer
     def batch_has_children(self, section_ids):
@@ -147,52 +566,25 @@ class DatabaseHandler:
             has_children[parent_id] = True
         return has_children
 
-    @timer
-    def invalidate_caches(self):
-        """Clear caches when structure changes."""
-        self._numbering_cache.clear()
-        self._children_cache.clear()
-
-    @timer
-    def _get_structure_hash(self):
-        """Generate a hash representing the current tree structure."""
-        self.cursor.execute("""
-            SELECT id, parent_id, placement 
-            FROM sections 
-            ORDER BY id
-        """)
-        structure = self.cursor.fetchall()
-        return hash(str(structure))
-
-    @timer
-    def generate_numbering(self):
-        """Generate numbering with caching."""
-        cache_key = self._get_structure_hash()  # Hash of current structure
-        if cache_key in self._numbering_cache:
-            return self._numbering_cache[cache_key]
-
-        numbering_dict = {}
-        def recursive_numbering(parent_id=None, prefix=""):
-            if parent_id in self._children_cache:
-                children = self._children_cache[parent_id]
-            else:
-                self.cursor.execute("""
-                    SELECT id, placement 
-                    FROM sections 
-                    WHERE parent_id IS ? 
-                    ORDER BY placement, id
-                """, (parent_id,))
-                children = self.cursor.fetchall()
-                self._children_cache[parent_id] = children
-
-            for idx, (child_id, _) in enumerate(children, start=1):
-                number = f"{prefix}{idx}"
-                numbering_dict[child_id] = number
-                recursive_numbering(child_id, f"{number}.")
-
-        recursive_numbering()
-        self._numbering_cache[cache_key] = numbering_dict
-        return numbering_dict
+    def structure_version(self):
+        """
+        Return a number that changes whenever sections are inserted, deleted,
+        moved or reordered. The counter is only read again when this
+        connection has written rows (total_changes) or another connection has
+        committed (PRAGMA data_version), so a check is normally one pragma.
+        Inside an open transaction it is always read, since a rollback would
+        take it back.
+        """
+        if self.conn.in_transaction:
+            self.cursor.execute("SELECT version FROM structure_version")
+            return self.cursor.fetchone()[0]
+        self.cursor.execute("PRAGMA data_version")
+        marker = (self.cursor.fetchone()[0], self.conn.total_changes)
+        if marker != self._structure_marker:
+            self.cursor.execute("SELECT version FROM structure_version")
+            self._structure_version = self.cursor.fetchone()[0]
+            self._structure_marker = marker
+        return self._structure_version
 
     @timer
     def has_children(self, section_id):
@@ -254,299 +646,764 @@ class DatabaseHandler:
             return []
 
     @timer
-    def add_section(self, title, section_type, parent_id=None, placement=1):
+    def add_section(self, title, section_type, parent_id=None, placement=None):
         """
         Add a new section with encrypted title and default encrypted questions.
+        Without a placement it goes after its last sibling.
         """
+        if placement is None:
+            placement = self.next_placement(parent_id)
         if not isinstance(placement, int) or placement <= 0:
             raise ValueError(f"Invalid placement value: {placement}")
 
         encrypted_title = self.encryption_manager.encrypt_string(title)
-        encrypted_questions = self.encryption_manager.encrypt_string("[]")  # Default to empty JSON array
+        encrypted_questions = self.encryption_manager.encrypt_bytes(encode_note(""))  # Empty note
 
-        self.cursor.execute(
-            "INSERT INTO sections (title, type, parent_id, placement, questions) VALUES (?, ?, ?, ?, ?)",
-            (encrypted_title, section_type, parent_id, placement, encrypted_questions),
-        )
-        self.conn.commit()
-        return self.cursor.lastrowid
+        with self.transaction():
+            self.cursor.execute(
+                "INSERT INTO sections (title, type, parent_id, placement) VALUES (?, ?, ?, ?)",
+                (encrypted_title, section_type, parent_id, placement),
+            )
+            section_id = self.cursor.lastrowid
+            self.cursor.execute(
+                "INSERT INTO section_content (section_id, questions) VALUES (?, ?)",
+                (section_id, encrypted_questions),
+            )
+        # Write-through: the new plaintext is already known
+        self.plaintext_cache.put(section_id, "title", encrypted_title, title)
+        self.plaintext_cache.put(section_id, "questions", encrypted_questions, "")
+        return section_id
+
+    @timer
+    def add_sections_bulk(self, rows):
+        """
+        Add many sections in one transaction, encrypting in batches and writing
+        each table with one executemany. Each row is
+        (title, section_type, parent_id, placement[, questions]); parent_id is
+        an existing id, None for a root, or -n for the n-th row of this batch
+        (counting from 1), so a whole subtree can be added at once as long as
+        parents come before their children. A placement of None appends after
+        the parent's current children. Returns the new ids in row order.
+        """
+        rows = [tuple(row) + (None,) * (5 - len(row)) for row in rows]
+        if not rows:
+            return []
+        manager = self.encryption_manager
+        titles = [row[0] or "" for row in rows]
+        encrypted_titles = manager.encrypt_many(titles)
+        note_data = [(row[4] or "").encode('utf-8') for row in rows]
+        inline = [i for i, data in enumerate(note_data) if len(data) < NOTE_CHUNKED_MIN_BYTES]
+        encrypted_notes = [None] * len(rows)
+        for i, value in zip(inline, manager.encrypt_many(pack_bytes(note_data[i]) for i in inline)):
+            encrypted_notes[i] = value
+
+        with self.transaction():
+            # Ids are assigned here, inside the write lock, so rows can refer to
+            # parents added earlier in the same batch
+            first_id = self._next_section_id()
+            ids = list(range(first_id, first_id + len(rows)))
+
+            parents = []
+            placements = []
+            next_placements = {}
+            for index, row in enumerate(rows):
+                parent_id, placement = row[2], row[3]
+                if parent_id is not None and parent_id < 0:
+                    if -parent_id > index:
+                        raise ValueError(f"Row {index + 1} refers to row {-parent_id}, which doesn't precede it")
+                    parent_id = ids[-parent_id - 1]
+                if placement is None:
+                    if parent_id not in next_placements:
+                        next_placements[parent_id] = self.next_placement(parent_id)
+                    placement = next_placements[parent_id]
+                    next_placements[parent_id] = placement + PLACEMENT_GAP
+                if not isinstance(placement, int) or placement <= 0:
+                    raise ValueError(f"Invalid placement value: {placement}")
+                parents.append(parent_id)
+                placements.append(placement)
+
+            for i, data in enumerate(note_data):
+                if encrypted_notes[i] is None:
+                    encrypted_notes[i] = self._write_note_chunks(ids[i], data)
+
+            self.cursor.executemany(
+                "INSERT INTO sections (id, title, type, parent_id, placement) VALUES (?, ?, ?, ?, ?)",
+                zip(ids, encrypted_titles, (row[1] for row in rows), parents, placements),
+            )
+            self.cursor.executemany(
+                "INSERT INTO section_content (section_id, questions) VALUES (?, ?)",
+                zip(ids, encrypted_notes),
+            )
+
+        for section_id, title, encrypted_title, row, encrypted_note in zip(
+            ids, titles, encrypted_titles, rows, encrypted_notes
+        ):
+            self.plaintext_cache.put(section_id, "title", encrypted_title, title)
+            self.plaintext_cache.put(section_id, "questions", encrypted_note, row[4] or "")
+        return ids
+
+    def _next_section_id(self):
+        """The id AUTOINCREMENT would give the next section; call inside a transaction."""
+        self.cursor.execute("""
+            SELECT MAX(
+                COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'sections'), 0),
+                COALESCE((SELECT MAX(id) FROM sections), 0)
+            )
+        """)
+        return self.cursor.fetchone()[0] + 1
 
     @timer
     def update_section(self, section_id, title, questions):
+        """
+        Save a section's title and note text (stored as a v2 note payload).
+        Notes of NOTE_CHUNKED_MIN_BYTES or more are stored as chunks, and only
+        the chunks that changed are encrypted and written.
+        """
         encrypted_title = (
             self.encryption_manager.encrypt_string(title) if title else None
         )
-        encrypted_questions = (
-            self.encryption_manager.encrypt_string(questions) if questions else None
-        )
-        #print(f"Updating section ID {section_id} with:")
-        #print(f"  Encrypted Title: {encrypted_title}")
-        #print(f"  Encrypted Questions: {encrypted_questions}")
+        note_data = (questions or "").encode('utf-8')
+        with self.transaction():
+            if len(note_data) >= NOTE_CHUNKED_MIN_BYTES:
+                encrypted_questions = self._write_note_chunks(section_id, note_data)
+            else:
+                self.cursor.execute("DELETE FROM section_chunks WHERE section_id = ?", (section_id,))
+                encrypted_questions = (
+                    self.encryption_manager.encrypt_bytes(encode_note(questions)) if questions else None
+                )
+            #print(f"Updating section ID {section_id} with:")
+            #print(f"  Encrypted Title: {encrypted_title}")
+            #print(f"  Encrypted Questions: {encrypted_questions}")
+            self.cursor.execute(
+                "UPDATE sections SET title = ? WHERE id = ?",
+                (encrypted_title, section_id),
+            )
+            self._write_note(section_id, encrypted_questions)
+        self.plaintext_cache.invalidate([section_id])
+        if encrypted_title:
+            self.plaintext_cache.put(section_id, "title", encrypted_title, title)
+        if encrypted_questions:
+            self.plaintext_cache.put(section_id, "questions", encrypted_questions, questions)
+
+    def _write_note(self, section_id, encrypted_questions):
+        """Store a section's encrypted note payload; the caller commits."""
+        self.cursor.execute("""
+            INSERT INTO section_content (section_id, questions) VALUES (?, ?)
+            ON CONFLICT (section_id) DO UPDATE SET questions = excluded.questions
+        """, (section_id, encrypted_questions))
+
+    def _write_note_chunks(self, section_id, note_data):
+        """
+        Store a note's chunks, inserting those whose digest the section doesn't
+        already hold and deleting those no longer referenced. Returns the
+        encrypted manifest for section_content. Runs inside the caller's
+        transaction.
+        """
+        manager = self.encryption_manager
+        chunks = split_note(note_data)
+        digests = [manager.chunk_digest(chunk) for chunk in chunks]
+
+        self.cursor.execute("SELECT digest FROM section_chunks WHERE section_id = ?", (section_id,))
+        stored = {bytes(row[0]) for row in self.cursor.fetchall()}
+        new_chunks = {}
+        for digest, chunk in zip(digests, chunks):
+            if digest not in stored:
+                new_chunks[digest] = chunk
+
+        if new_chunks:
+            sealed = manager.encrypt_many(pack_bytes(chunk) for chunk in new_chunks.values())
+            self.cursor.executemany(
+                "INSERT INTO section_chunks (section_id, digest, data) VALUES (?, ?, ?)",
+                [(section_id, digest, data) for digest, data in zip(new_chunks, sealed)]
+            )
+        unused = stored - set(digests)
+        if unused:
+            self.cursor.executemany(
+                "DELETE FROM section_chunks WHERE section_id = ? AND digest = ?",
+                [(section_id, digest) for digest in unused]
+            )
+        return manager.encrypt_bytes(encode_manifest(digests))
+
+    def _iter_note_chunks(self, section_id, manifest):
+        """Decrypt a chunked note one chunk at a time, yielding text pieces."""
+        cursor = self._read_cursor()
+        cursor.execute("SELECT digest, data FROM section_chunks WHERE section_id = ?", (section_id,))
+        stored = {bytes(digest): data for digest, data in cursor.fetchall()}
+        # A multi-byte character may straddle a forced chunk boundary
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        for digest in manifest_digests(manifest):
+            data = stored.get(digest)
+            payload = self.encryption_manager.decrypt_bytes(data) if data else b""
+            if not payload:
+                raise ValueError(f"Missing or unreadable chunk in note {section_id}")
+            yield decoder.decode(unpack_bytes(payload))
+        tail = decoder.decode(b"", final=True)
+        if tail:
+            yield tail
+
+    def iter_note(self, section_id):
+        """
+        Yield a section's note text in pieces for the editor. A chunked note
+        that isn't cached arrives chunk by chunk, so the start of a long note
+        shows before the rest is decrypted; anything else is one piece.
+        """
+        pending = self.writes.pending(section_id)
+        if pending is not None:
+            if pending[1]:
+                yield pending[1]
+            return
+        self.cursor.execute("SELECT questions FROM section_content WHERE section_id = ?", (section_id,))
+        row = self.cursor.fetchone()
+        if not row or not row[0]:
+            return
+        encrypted_value = row[0]
+        cached = self.plaintext_cache.get(section_id, "questions", encrypted_value)
+        if cached is not None:
+            yield cached
+            return
+        payload = self.encryption_manager.decrypt_bytes(encrypted_value)
+        if not is_chunked(payload):
+            text = decode_note(payload)
+            if text:
+                self.plaintext_cache.put(section_id, "questions", encrypted_value, text)
+            yield text
+            return
+        pieces = []
+        for piece in self._iter_note_chunks(section_id, payload):
+            pieces.append(piece)
+            yield piece
+        self.plaintext_cache.put(section_id, "questions", encrypted_value, "".join(pieces))
+
+    def copy_note(self, source_id, target_id):
+        """Copy a note to another section as stored, chunks included, without decrypting it."""
+        self.writes.flush()
         self.cursor.execute(
-            "UPDATE sections SET title = ?, questions = ? WHERE id = ?",
-            (encrypted_title, encrypted_questions, section_id),
+            "SELECT questions FROM section_content WHERE section_id = ?", (source_id,)
         )
-        self.conn.commit()
+        row = self.cursor.fetchone()
+        with self.transaction():
+            self._write_note(target_id, row[0] if row else None)
+            self.cursor.execute("DELETE FROM section_chunks WHERE section_id = ?", (target_id,))
+            self.cursor.execute("""
+                INSERT INTO section_chunks (section_id, digest, data)
+                SELECT ?, digest, data FROM section_chunks WHERE section_id = ?
+            """, (target_id, source_id))
+        self.plaintext_cache.invalidate([target_id])
+
+    @timer
+    def clone_subtree(self, source_id, target_parent_id, with_content=False):
+        """
+        Copy a section and its descendants under target_parent_id, after its
+        last child, in one transaction. Rows are copied by set-based SQL with
+        an old -> new id map (new ids follow path order, so parents come before
+        their children) and keep their ciphertext as stored; only the copy's
+        root gets a new title, "<title>-Cloned". With with_content notes and
+        their chunks are copied too, otherwise every copy gets an empty note.
+        Returns the new root id.
+        """
+        self.writes.flush()
+        low, high = self.subtree_bounds(source_id)
+        self.cursor.execute("SELECT title FROM sections WHERE id = ?", (source_id,))
+        row = self.cursor.fetchone()
+        if not row:
+            raise ValueError(f"No section with id {source_id}")
+        title = self.decrypt_column([source_id], [row[0]], "title")[0]
+        cloned_title = self.encryption_manager.encrypt_string(f"{title}-Cloned")
+        empty_note = None if with_content else self.encryption_manager.encrypt_bytes(encode_note(""))
+
+        with self.transaction():
+            # The old -> new id map. new_id is its rowid, numbered in path order,
+            # so reading it in rowid order inserts parents before their children
+            # (tree_index_insert reads the parent's path)
+            new_root_id = self._next_section_id()
+            self.cursor.execute("""
+                CREATE TEMP TABLE clone_map (
+                    new_id INTEGER PRIMARY KEY,
+                    old_id INTEGER NOT NULL UNIQUE
+                )
+            """)
+            self.cursor.execute("""
+                INSERT INTO temp.clone_map (new_id, old_id)
+                SELECT ? + ROW_NUMBER() OVER (ORDER BY path) - 1, id
+                FROM sections
+                WHERE path >= ? AND path < ?
+            """, (new_root_id, low, high))
+            self.cursor.execute("""
+                INSERT INTO sections (id, title, type, parent_id, placement)
+                SELECT m.new_id,
+                       CASE WHEN s.id = ? THEN ? ELSE s.title END,
+                       s.type,
+                       CASE WHEN s.id = ? THEN ? ELSE p.new_id END,
+                       CASE WHEN s.id = ? THEN ? ELSE s.placement END
+                FROM temp.clone_map m
+                JOIN sections s ON s.id = m.old_id
+                LEFT JOIN temp.clone_map p ON p.old_id = s.parent_id
+                ORDER BY m.new_id
+            """, (
+                source_id, cloned_title,
+                source_id, target_parent_id,
+                source_id, self.next_placement(target_parent_id),
+            ))
+            if with_content:
+                self.cursor.execute("""
+                    INSERT INTO section_content (section_id, questions)
+                    SELECT m.new_id, c.questions
+                    FROM temp.clone_map m
+                    JOIN section_content c ON c.section_id = m.old_id
+                """)
+                # CROSS JOIN keeps the map as the outer loop: a probe per copied
+                # section, never a scan of every chunk in the database
+                self.cursor.execute("""
+                    INSERT INTO section_chunks (section_id, digest, data)
+                    SELECT m.new_id, k.digest, k.data
+                    FROM temp.clone_map m
+                    CROSS JOIN section_chunks k ON k.section_id = m.old_id
+                """)
+            else:
+                self.cursor.execute("""
+                    INSERT INTO section_content (section_id, questions)
+                    SELECT new_id, ? FROM temp.clone_map
+                """, (empty_note,))
+            self.cursor.execute("DROP TABLE temp.clone_map")
+        self.plaintext_cache.put(new_root_id, "title", cloned_title, f"{title}-Cloned")
+        return new_root_id
+
+    @timer
+    def export_subtree(self, section_id, file_path, password):
+        """
+        Write a section and its descendants to a new database at file_path that
+        password opens, in one transaction (one commit); the export's root
+        becomes a root. If password is the one this database was unlocked with
+        and every exported value is sealed under the current data key, the new
+        database gets a key slot for that same key and the rows are copied as
+        stored: this database is ATTACHed read-only and each table is one
+        INSERT ... SELECT in path (depth-first) order. Otherwise the subtree is
+        decrypted once, in batches, and written with add_sections_bulk under the
+        new database's own key. Returns the number of sections exported.
+        """
+        self.writes.flush()
+        low, high = self.subtree_bounds(section_id)
+        if os.path.abspath(file_path) == os.path.abspath(self.db_name):
+            raise ValueError("Can't export a database into itself.")
+
+        target = DatabaseHandler(file_path, None)
+        try:
+            params = target.save_kdf_params(self.get_kdf_params())
+            if self._can_copy_ciphertext(password, low, high):
+                key_id = self.encryption_manager.key_id
+                slot = create_key_slot(password, key_id, self.encryption_manager.data_key(key_id), params)
+                return target._copy_subtree(self._read_only_uri(), section_id, low, high, slot)
+
+            with self.reading() as cursor:
+                cursor.execute("""
+                    SELECT s.id, s.title, s.type, s.parent_id, s.placement, c.questions
+                    FROM sections s
+                    LEFT JOIN section_content c ON c.section_id = s.id
+                    WHERE s.path >= ? AND s.path < ?
+                    ORDER BY s.path
+                """, (low, high))
+                rows = cursor.fetchall()
+                ids = [row[0] for row in rows]
+                titles = self.decrypt_column(ids, [row[1] for row in rows], "title")
+                notes = self.decrypt_column(ids, [row[5] for row in rows], "questions")
+
+            # Path order puts every parent before its children: refer to them
+            # by batch position (-n, see add_sections_bulk)
+            positions = {row_id: index for index, row_id in enumerate(ids, start=1)}
+            export_rows = [
+                (title, row[2], None if row[0] == section_id else -positions[row[3]], row[4], note)
+                for row, title, note in zip(rows, titles, notes)
+            ]
+            target.encryption_manager = EncryptionManager(password)
+            with target.transaction():
+                target.set_password(password)
+                target.add_sections_bulk(export_rows)
+            return len(export_rows)
+        finally:
+            target.close()
+
+    def _can_copy_ciphertext(self, password, low, high):
+        """True if an export opened by password can reuse the subtree's ciphertext as stored."""
+        manager = self.encryption_manager
+        if manager is None or manager.password != password.encode('utf-8'):
+            return False
+        if self.has_pending_reencryption():
+            return False
+        try:
+            manager.data_key(manager.key_id)
+        except ValueError:
+            return False  # a legacy password-derived key, not a data key
+        header = bytes([FORMAT_V2]) + manager.key_id
+        self.cursor.execute("""
+            SELECT EXISTS (
+                SELECT 1 FROM sections s
+                LEFT JOIN section_content c ON c.section_id = s.id
+                WHERE s.path >= ? AND s.path < ?
+                AND (
+                    substr(s.title, 1, ?) IS NOT ?
+                    OR (c.questions IS NOT NULL AND substr(c.questions, 1, ?) IS NOT ?)
+                    OR EXISTS (
+                        SELECT 1 FROM section_chunks k
+                        WHERE k.section_id = s.id AND substr(k.data, 1, ?) IS NOT ?
+                    )
+                )
+            )
+        """, (low, high) + (len(header), header) * 3)
+        return not self.cursor.fetchone()[0]
+
+    def _copy_subtree(self, source_uri, root_id, low, high, slot):
+        """
+        Fill this (new) database from a subtree of the database at source_uri,
+        copying ciphertext as stored, and store slot as its only key slot.
+        One transaction; returns the number of sections copied.
+        """
+        self.cursor.execute("ATTACH DATABASE ? AS source", (source_uri,))
+        try:
+            with self.transaction():
+                self._write_key_slots({self._new_slot_name(): slot})
+                self.cursor.execute("""
+                    INSERT INTO sections (id, title, type, parent_id, placement)
+                    SELECT id, title, type, CASE WHEN id = ? THEN NULL ELSE parent_id END, placement
+                    FROM source.sections
+                    WHERE path >= ? AND path < ?
+                    ORDER BY path
+                """, (root_id, low, high))
+                count = self.cursor.rowcount
+                self.cursor.execute("""
+                    INSERT INTO section_content (section_id, questions)
+                    SELECT c.section_id, c.questions
+                    FROM source.sections s
+                    JOIN source.section_content c ON c.section_id = s.id
+                    WHERE s.path >= ? AND s.path < ?
+                """, (low, high))
+                self.cursor.execute("""
+                    INSERT INTO section_chunks (section_id, digest, data)
+                    SELECT k.section_id, k.digest, k.data
+                    FROM source.sections s
+                    JOIN source.section_chunks k ON k.section_id = s.id
+                    WHERE s.path >= ? AND s.path < ?
+                """, (low, high))
+        finally:
+            self.cursor.execute("DETACH DATABASE source")
+        return count
 
     @timer
-    def change_password(self, old_password, new_password):
-        """Change the database encryption password with proper re-encryption."""
+    def change_password(self, old_password, new_password, rotate_key=False):
+        """
+        Change a password by rewrapping the data key; rows are not touched.
+        Other passwords added with add_password keep working.
+
+        With rotate_key a new data key is created instead and a re-encryption
+        job is queued to move every row to it (run it with reencrypt_step).
+        Other passwords are dropped, since they only unwrap the retired key.
+        """
         if not self.validate_password(old_password):
             raise ValueError("Current password is incorrect.")
             
         if len(new_password) < PASSWORD_MIN_LENGTH:
             raise ValueError("New password must be at least 14 characters.")
+
+        # Finish any earlier job so every row is under a single key
+        self.run_reencryption()
+        params = self.get_kdf_params()
             
         try:
-            # Store old encryption manager
-            old_encryption_manager = self.encryption_manager
-            
-            # Create new encryption manager
+            slots = self._load_key_slots()
+            old_manager = self.encryption_manager
+
+            # Replace only the slots the old password opens
+            opened = {}
+            for name, slot in slots.items():
+                unwrapped = old_manager.unwrap_key_slot(slot)
+                if unwrapped:
+                    opened[name] = unwrapped
+            if not opened:
+                raise ValueError("No key slot matches the current password.")
+
+            key_id, data_key = next(iter(opened.values()))
+            for name in opened:
+                del slots[name]
+            new_slot = create_key_slot(new_password, key_id, data_key, params)
+            slots[self._new_slot_name()] = new_slot
+
+            # Hand the unwrapped key over instead of deriving it again
             new_encryption_manager = EncryptionManager(new_password)
-            
-            # Start a transaction
-            self.cursor.execute("BEGIN TRANSACTION")
-            
-            # Re-encrypt all data
-            self.cursor.execute("SELECT id, title, questions FROM sections")
-            sections = self.cursor.fetchall()
-            
-            update_query = """
-                UPDATE sections 
-                SET title = ?, questions = ? 
-                WHERE id = ?
-            """
-            
-            for section_id, encrypted_title, encrypted_questions in sections:
-                new_encrypted_title = None
-                new_encrypted_questions = None
-                
-                try:
-                    if encrypted_title:
-                        decrypted_title = old_encryption_manager.decrypt_string(encrypted_title)
-                        new_encrypted_title = new_encryption_manager.encrypt_string(decrypted_title)
-                        
-                    if encrypted_questions:
-                        decrypted_questions = old_encryption_manager.decrypt_string(encrypted_questions)
-                        new_encrypted_questions = new_encryption_manager.encrypt_string(decrypted_questions)
-                        
-                    self.cursor.execute(update_query, (
-                        new_encrypted_title,
-                        new_encrypted_questions,
-                        section_id
-                    ))
-                except Exception as e:
-                    print(f"Error re-encrypting section {section_id}: {e}")
-                    self.conn.rollback()
-                    raise RuntimeError(f"Failed to re-encrypt section {section_id}")
-            
-            # Update password hash in settings
-            new_hash = hashlib.sha256(new_password.encode()).hexdigest()
-            self.cursor.execute(
-                "INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
-                ("password", new_hash)
-            )
-            
-            # Commit transaction
-            self.conn.commit()
-            
-            # Update the encryption manager
-            self.encryption_manager = new_encryption_manager
+            new_encryption_manager.load_data_key(key_id, data_key)
+
+            with self.transaction():
+                if rotate_key:
+                    # Keep only the new password's slot for the old key; until the
+                    # job finishes that password must open both keys
+                    slots = {self._new_slot_name(): new_slot}
+                    new_key_id, new_data_key = generate_data_key()
+                    slots[self._new_slot_name()] = create_key_slot(new_password, new_key_id, new_data_key, params)
+                    new_encryption_manager.load_data_key(new_key_id, new_data_key)
+                    self._save_reencrypt_job("rotate", new_key_id, 0)
+                self._write_key_slots(slots)
+
+            self._encryption_manager = new_encryption_manager
             
         except Exception as e:
-            self.conn.rollback()
             raise RuntimeError(f"Failed to change password: {e}")
 
     @timer
     def count_descendants(self, section_id):
         """Count all descendants of a section."""
-        self.cursor.execute("""
-            WITH RECURSIVE descendants AS (
-                SELECT id FROM sections WHERE parent_id = ?
-                UNION ALL
-                SELECT s.id 
-                FROM sections s
-                INNER JOIN descendants d ON s.parent_id = d.id
-            )
-            SELECT COUNT(*) FROM descendants
-        """, (section_id,))
+        low, high = self.subtree_bounds(section_id)
+        self.cursor.execute(
+            "SELECT COUNT(*) FROM sections WHERE path > ? AND path < ?", (low, high)
+        )
         return self.cursor.fetchone()[0]
 
+    @timer
     def delete_section(self, section_id):
-        """Delete a section and all its descendants."""
-        self.cursor.execute("""
-            WITH RECURSIVE descendants AS (
-                SELECT id FROM sections WHERE id = ?
-                UNION ALL
-                SELECT s.id 
-                FROM sections s
-                INNER JOIN descendants d ON s.parent_id = d.id
+        """
+        Delete a section and all its descendants: one range read and one range
+        delete over the path index. The delete triggers each touch only the deleted row (its
+        note, its chunks, the structure version); gap-spaced placements mean no
+        sibling is rewritten, so the cost is linear in the subtree's size
+        whatever its shape.
+        """
+        low, high = self.subtree_bounds(section_id)
+        # No DELETE ... RETURNING (SQLite 3.35+): read the ids over the same
+        # range first, in the same transaction
+        with self.transaction():
+            self.cursor.execute(
+                "SELECT id FROM sections WHERE path >= ? AND path < ?", (low, high)
             )
-            DELETE FROM sections WHERE id IN descendants
-        """, (section_id,))
-        self.conn.commit()
+            deleted_ids = [row[0] for row in self.cursor.fetchall()]
+            self.cursor.execute(
+                "DELETE FROM sections WHERE path >= ? AND path < ?", (low, high)
+            )
+        self.writes.discard(deleted_ids)
+        self.plaintext_cache.invalidate(deleted_ids)
 
     def reset_database(self, new_db_name):
         """
         Reset the database connection and initialize a new database.
         """
         try:
+            self.writes.flush()
+            self._close_readers()
             self.conn.close()
             self.db_name = new_db_name
-            self.conn = sqlite3.connect(self.db_name)
+            self.conn = sqlite3.connect(self.db_name, isolation_level=None)
             self.cursor = self.conn.cursor()
+            self._structure_marker = None
+            self.numbering = NumberingService(self)
             self.setup_database()
-            self.conn.commit()
+            self._bind_data_key()
+            self.plaintext_cache.clear()
         except Exception as e:
             raise RuntimeError(f"Failed to reset database: {e}")
 
+    # PLACEMENT
+
+    def next_placement(self, parent_id):
+        """Placement for a new last child of parent_id, one gap past the current last."""
+        self.cursor.execute(
+            "SELECT COALESCE(MAX(placement), 0) FROM sections WHERE parent_id IS ?", (parent_id,)
+        )
+        return self.cursor.fetchone()[0] + PLACEMENT_GAP
+
+    def _sibling_placements(self, parent_id, exclude_id=None):
+        self.cursor.execute("""
+            SELECT id, placement FROM sections
+            WHERE parent_id IS ? AND id IS NOT ?
+            ORDER BY placement, id
+        """, (parent_id, exclude_id))
+        return self.cursor.fetchall()
+
+    def sibling_ids(self, parent_id):
+        """Ids of parent_id's children in outline order."""
+        return [row[0] for row in self._sibling_placements(parent_id)]
+
+    def rebalance_placements(self, parent_id):
+        """Respace parent_id's children PLACEMENT_GAP apart, keeping their order; the caller commits."""
+        self.cursor.execute("""
+            WITH ranked AS (
+                SELECT id, ROW_NUMBER() OVER (ORDER BY placement, id) AS position
+                FROM sections
+                WHERE parent_id IS ?
+            )
+            UPDATE sections
+            SET placement = ranked.position * ?
+            FROM ranked
+            WHERE sections.id = ranked.id
+        """, (parent_id, PLACEMENT_GAP))
+
+    def placement_at(self, parent_id, index, exclude_id=None):
+        """
+        Placement that puts a section at position index among parent_id's
+        children, not counting exclude_id (the section being moved). It is the
+        midpoint of the two neighbours; only when they are adjacent are the
+        siblings respaced first.
+        """
+        siblings = self._sibling_placements(parent_id, exclude_id)
+        index = max(0, min(index, len(siblings)))
+        before = siblings[index - 1][1] if index > 0 else 0
+        if index == len(siblings):
+            return before + PLACEMENT_GAP
+        after = siblings[index][1]
+        if after - before < 2:
+            self.rebalance_placements(parent_id)
+            return self.placement_at(parent_id, index, exclude_id)
+        return (before + after) // 2
+
     @timer
-    def fix_all_placements(self):
-        """Fix placement values to ensure they are consecutive within each level."""
-        try:
-            # Start transaction
-            self.cursor.execute("BEGIN")
-            
-            # First fix root level sections to be consecutive
+    def move_section(self, section_id, parent_id, index, section_type=None):
+        """
+        Move a section to position index among parent_id's children; with the
+        same parent this is a reorder. Writes just the moved row unless the
+        siblings had to be respaced. section_type, if given, is set as well.
+        """
+        with self.transaction():
+            placement = self.placement_at(parent_id, index, exclude_id=section_id)
             self.cursor.execute(
-                """
-                WITH RankedSections AS (
-                    SELECT id,
-                           ROW_NUMBER() OVER (ORDER BY placement, id) as new_placement
-                    FROM sections
-                    WHERE parent_id IS NULL
-                )
-                UPDATE sections
-                SET placement = (
-                    SELECT new_placement
-                    FROM RankedSections
-                    WHERE RankedSections.id = sections.id
-                )
-                WHERE parent_id IS NULL
-                """
+                "UPDATE sections SET parent_id = ?, placement = ?, type = COALESCE(?, type) WHERE id = ?",
+                (parent_id, placement, section_type, section_id)
             )
-            
-            # Then fix children for each parent to be consecutive
-            self.cursor.execute(
-                "SELECT DISTINCT parent_id FROM sections WHERE parent_id IS NOT NULL"
+
+    def shift_section(self, section_id, offset):
+        """Move a section offset places among its siblings; False if it is already at the end."""
+        self.cursor.execute("SELECT parent_id FROM sections WHERE id = ?", (section_id,))
+        row = self.cursor.fetchone()
+        if not row:
+            return False
+        siblings = self.sibling_ids(row[0])
+        index = siblings.index(section_id) + offset
+        if not 0 <= index < len(siblings):
+            return False
+        self.move_section(section_id, row[0], index)
+        return True
+
+    def _respace_all_placements(self):
+        self.cursor.execute("""
+            WITH ranked AS (
+                SELECT id,
+                       ROW_NUMBER() OVER (PARTITION BY parent_id ORDER BY placement, id) AS position
+                FROM sections
             )
-            parent_ids = [row[0] for row in self.cursor.fetchall()]
-            
-            for parent_id in parent_ids:
-                self.cursor.execute(
-                    """
-                    WITH RankedChildren AS (
-                        SELECT id,
-                               ROW_NUMBER() OVER (ORDER BY placement, id) as new_placement
-                        FROM sections
-                        WHERE parent_id = ?
-                    )
-                    UPDATE sections
-                    SET placement = (
-                        SELECT new_placement
-                        FROM RankedChildren
-                        WHERE RankedChildren.id = sections.id
-                    )
-                    WHERE parent_id = ?
-                    """,
-                    (parent_id, parent_id)
-                )
-            
-            # Commit the transaction
-            self.conn.commit()
-            
-            # Clear caches since we modified the structure
-            self.invalidate_caches()
-            
+            UPDATE sections
+            SET placement = ranked.position * ?
+            FROM ranked
+            WHERE sections.id = ranked.id
+        """, (PLACEMENT_GAP,))
+
+    @timer
+    def fix_all_placements(self):
+        """Respace the placements of every sibling list PLACEMENT_GAP apart, keeping their order."""
+        try:
+            with self.transaction():
+                self._respace_all_placements()
         except Exception as e:
-            self.conn.rollback()
             print(f"Error in fix_all_placements: {e}")
             raise
 
     @timer
     def fix_placement(self, parent_id):
-        """Fix placement values for children of a specific parent."""
+        """Respace the placements of a specific parent's children."""
         try:
-            self.cursor.execute(
-                """
-                WITH RankedChildren AS (
-                    SELECT id,
-                           ROW_NUMBER() OVER (ORDER BY placement, id) as new_placement
-                    FROM sections
-                    WHERE parent_id = ?
-                )
-                UPDATE sections
-                SET placement = (
-                    SELECT new_placement
-                    FROM RankedChildren
-                    WHERE RankedChildren.id = sections.id
-                )
-                WHERE parent_id = ?
-                """,
-                (parent_id, parent_id)
-            )
-            self.conn.commit()
-            self.invalidate_caches()
+            with self.transaction():
+                self.rebalance_placements(parent_id)
         except Exception as e:
             print(f"Error in fix_placement: {e}")
-            self.conn.rollback()
+
+    def check_tree_integrity(self):
+        """
+        Look for structural damage: orphans (a parent_id that names no section,
+        including the empty strings older versions wrote), siblings sharing a
+        placement, non-positive placements and rows missing from the path index.
+        Returns {problem: row count} for the problems found.
+        """
+        self.cursor.execute("""
+            SELECT
+                (SELECT COUNT(*) FROM sections s
+                 WHERE s.parent_id IS NOT NULL
+                 AND NOT EXISTS (SELECT 1 FROM sections p WHERE p.id = s.parent_id)),
+                (SELECT COUNT(*) FROM (
+                    SELECT 1 FROM sections GROUP BY parent_id, placement HAVING COUNT(*) > 1
+                )),
+                (SELECT COUNT(*) FROM sections WHERE placement IS NULL OR placement <= 0),
+                (SELECT COUNT(*) FROM sections WHERE path IS NULL)
+        """)
+        counts = dict(zip(
+            ("orphans", "duplicate placements", "invalid placements", "unindexed"),
+            self.cursor.fetchone()
+        ))
+        return {problem: count for problem, count in counts.items() if count}
 
     @timer
-    def initialize_placement(self):
-        """Initializes and fixes placement values for the entire database."""
+    def repair_tree(self):
+        """Re-root orphans, respace every sibling list and rebuild the path index."""
         try:
-            # First set initial placements based on hierarchy
-            self.cursor.execute(
-                """
-                WITH RECURSIVE section_hierarchy(id, parent_id, level) AS (
-                    SELECT id, parent_id, 0 FROM sections WHERE parent_id IS NULL
-                    UNION ALL
-                    SELECT s.id, s.parent_id, h.level + 1
-                    FROM sections s
-                    INNER JOIN section_hierarchy h ON s.parent_id = h.id
-                )
-                SELECT id, ROW_NUMBER() OVER (PARTITION BY parent_id ORDER BY id) AS new_placement
-                FROM section_hierarchy
-                """
-            )
-            for row in self.cursor.fetchall():
-                self.cursor.execute(
-                    "UPDATE sections SET placement = ? WHERE id = ?",
-                    (row[1], row[0]),
-                )
-            self.conn.commit()
-            
-            # Then ensure they're consecutive using fix_all_placements
-            self.fix_all_placements()
-            
+            with self.transaction():
+                self.cursor.execute("""
+                    UPDATE sections SET parent_id = NULL
+                    WHERE parent_id IS NOT NULL
+                    AND parent_id NOT IN (SELECT id FROM sections)
+                """)
+                self.cursor.execute("UPDATE sections SET placement = 1 WHERE placement IS NULL OR placement <= 0")
+                self._respace_all_placements()
+                self._rebuild_tree_index()
         except Exception as e:
-            print(f"Error in initialize_placement: {e}")
-            self.conn.rollback()
+            print(f"Error in repair_tree: {e}")
+            raise
+
+    @timer
+    def ensure_tree_integrity(self):
+        """
+        Startup gate replacing the old rewrite-every-placement pass. Normally
+        this is a couple of settings reads; the full check (and a repair if it
+        finds anything) runs only after a layout upgrade or an unclean exit.
+        Returns the problems found, or None when the check was skipped.
+        """
+        self.cursor.execute("SELECT value FROM settings WHERE key = ?", (TREE_LAYOUT_KEY,))
+        row = self.cursor.fetchone()
+        layout_current = row is not None and row[0] == str(TREE_LAYOUT_VERSION)
+        self.cursor.execute("SELECT 1 FROM settings WHERE key = ?", (SESSION_OPEN_KEY,))
+        unclean_exit = self.cursor.fetchone() is not None
+
+        self.cursor.execute(
+            "INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (SESSION_OPEN_KEY, "1")
+        )
+        if layout_current and not unclean_exit:
+            return None
+
+        problems = self.check_tree_integrity()
+        if problems:
+            print(f"Repairing tree: {problems}")
+        if problems or not layout_current:
+            self.repair_tree()
+        self.cursor.execute(
+            "INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
+            (TREE_LAYOUT_KEY, str(TREE_LAYOUT_VERSION))
+        )
+        return problems
 
     @timer
     def swap_placement(self, item_id1, item_id2):
         """Swap the placement of two items in the database."""
         try:
-            # Get current placements
-            self.cursor.execute(
-                "SELECT placement FROM sections WHERE id = ?", (item_id1,)
-            )
-            placement1 = self.cursor.fetchone()[0] or 0  # Handle NULL
-
-            self.cursor.execute(
-                "SELECT placement FROM sections WHERE id = ?", (item_id2,)
-            )
-            placement2 = self.cursor.fetchone()[0] or 0  # Handle NULL
+            with self.transaction():
+                # Get current placements
+                self.cursor.execute(
+                    "SELECT placement FROM sections WHERE id = ?", (item_id1,)
+                )
+                placement1 = self.cursor.fetchone()[0] or 0  # Handle NULL
 
-            # Perform the swap
-            self.cursor.execute(
-                "UPDATE sections SET placement = ? WHERE id = ?", (placement2, item_id1)
-            )
-            self.cursor.execute(
-                "UPDATE sections SET placement = ? WHERE id = ?", (placement1, item_id2)
-            )
+                self.cursor.execute(
+                    "SELECT placement FROM sections WHERE id = ?", (item_id2,)
+                )
+                placement2 = self.cursor.fetchone()[0] or 0  # Handle NULL
 
-            self.conn.commit()
+                # Perform the swap
+                self.cursor.execute(
+                    "UPDATE sections SET placement = ? WHERE id = ?", (placement2, item_id1)
+                )
+                self.cursor.execute(
+                    "UPDATE sections SET placement = ? WHERE id = ?", (placement1, item_id2)
+                )
 
             # Post-commit verification
             self.cursor.execute(
@@ -564,10 +1421,8 @@ class DatabaseHandler:
 
         except sqlite3.OperationalError as e:
             print(f"Database is locked: {e}")
-            self.conn.rollback()
         except Exception as e:
             print(f"Error in swap_placement: {e}")
-            self.conn.rollback()
 
     @timer
     def get_section_type(self, section_id):
@@ -581,80 +1436,53 @@ class DatabaseHandler:
             return None
 
     @timer
-    def search_sections(self, query):
+    def unlock(self, password):
         """
-        Perform a recursive search for sections matching the query in title or questions.
-        Returns a tuple of ids_to_show and parents_to_show.
+        Unlock the database with password: derive the key once, check it against
+        the stored verifier and install the resulting manager on this handler.
+        Returns the EncryptionManager to share with the rest of the app, or None
+        if the password is wrong. Databases that still store a password hash are
+        migrated to key slots the first time the correct password is given.
         """
         try:
-            self.cursor.execute(
-                """
-                WITH RECURSIVE parents AS (
-                    SELECT id, parent_id, title, questions
-                    FROM sections
-                    WHERE title LIKE ? OR questions LIKE ?
-                    UNION
-                    SELECT s.id, s.parent_id, s.title, s.questions
-                    FROM sections s
-                    INNER JOIN parents p ON s.id = p.parent_id
-                )
-                SELECT id, parent_id
-                FROM parents
-                ORDER BY parent_id, id
-                """,
-                (f"%{query}%", f"%{query}%"),
-            )
-            matches = self.cursor.fetchall()
-            ids_to_show = {row[0] for row in matches}
-            parents_to_show = {row[1] for row in matches if row[1] is not None}
-            return ids_to_show, parents_to_show
-        except Exception as e:
-            print(f"Error in search_sections: {e}")
-            return set(), set()
-
-    def clean_parent_ids(self):
-        """Update any parent_id values that are empty strings to NULL."""
-        self.cursor.execute(
-            "UPDATE sections SET parent_id = NULL WHERE parent_id = ''"
-        )
-        self.conn.commit()
-
-    def validate_password(self, password):
-        """
-        Validate the password and verify decryption capability.
-        Returns True only if password hash matches AND test decryption succeeds.
-        """
-        try:
-            # First check the password hash
             self.cursor.execute(
                 "SELECT value FROM settings WHERE key = ?", ("password",)
             )
             result = self.cursor.fetchone()
             if not result:
-                return False  # No password set
-                
-            stored_hashed_password = result[0]
-            if hashlib.sha256(password.encode()).hexdigest() != stored_hashed_password:
-                return False
-                
-            # Create a temporary encryption manager for validation
-            temp_manager = EncryptionManager(password)
-            
-            # Test encryption/decryption
-            test_string = "test_string"
-            encrypted = temp_manager.encrypt_string(test_string)
-            decrypted = temp_manager.decrypt_string(encrypted)
-            
-            if decrypted != test_string:
-                return False
-                
-            # If we get here, both the hash matches and encryption works
-            self.encryption_manager = temp_manager
-            return True
-            
+                return None  # No password set
+
+            slots = self._load_key_slots()
+            current = self._encryption_manager
+            if current is not None and current.password == password.encode('utf-8'):
+                # Same password as the manager already in use: open_key_slot is
+                # free when it holds the key, so no KDF runs at all
+                manager = current
+            else:
+                manager = EncryptionManager(password)
+
+            if slots:
+                # The key wrap's integrity check is the password verifier
+                if not self._open_key_slots(manager):
+                    return None
+            else:
+                stored_hashed_password = result[0]
+                if hashlib.sha256(password.encode()).hexdigest() != stored_hashed_password:
+                    return None
+                self._encryption_manager = manager
+                self._migrate_to_key_slots(password)
+
+            self._encryption_manager = manager
+            self.queue_format_upgrade()
+            return manager
+
         except Exception as e:
             print(f"Password validation error: {e}")
-            return False
+            return None
+
+    def validate_password(self, password):
+        """Check password, unlocking the database with it if it is correct."""
+        return self.unlock(password) is not None
 
     def load_database_from_file(self, db_path):
         """Load an existing database file and verify its schema and password."""
@@ -693,17 +1521,15 @@ class DatabaseHandler:
                     if not password:
                         raise ValueError("Password entry cancelled.")
                         
-                    # Create temporary encryption manager to validate password
-                    temp_encryption_manager = EncryptionManager(password)
-                    
-                    # Try to validate with the new connection
+                    # Try to unlock with the new connection
+                    self.writes.flush()
+                    self._close_readers()
                     self.conn.close()
                     self.db_name = db_path
-                    self.conn = sqlite3.connect(self.db_name)
+                    self.conn = sqlite3.connect(self.db_name, isolation_level=None)
                     self.cursor = self.conn.cursor()
                     
-                    if self.validate_password(password):
-                        self.encryption_manager = temp_encryption_manager
+                    if self.unlock(password):
                         break
                     else:
                         messagebox.showerror(
@@ -741,36 +1567,106 @@ class DatabaseHandler:
             print(f"Decryption error: {e}")
             return default
 
+    def decrypt_many(self, encrypted_values, default=""):
+        """Batch version of decrypt_safely; empty values come back as default."""
+        encrypted_values = list(encrypted_values)
+        try:
+            decrypted = self.encryption_manager.decrypt_many(encrypted_values)
+        except Exception as e:
+            print(f"Decryption error: {e}")
+            decrypted = [""] * len(encrypted_values)
+        return [
+            plain if value else default
+            for value, plain in zip(encrypted_values, decrypted)
+        ]
+
+    def decrypt_column(self, section_ids, encrypted_values, field, default=""):
+        """
+        Decrypt one column for a list of sections, reading through the plaintext
+        cache. Misses are decrypted as one batch and cached.
+        """
+        results = [None] * len(encrypted_values)
+        missing = []
+        pending_field = {"title": 0, "questions": 1}.get(field) if self.writes else None
+        for index, (section_id, value) in enumerate(zip(section_ids, encrypted_values)):
+            # A save still in the write-behind queue is newer than the row
+            pending = self.writes.pending(section_id) if pending_field is not None else None
+            if pending is not None:
+                results[index] = pending[pending_field]
+                continue
+            if not value:
+                results[index] = default
+                continue
+            cached = self.plaintext_cache.get(section_id, field, value)
+            if cached is None:
+                missing.append(index)
+            else:
+                results[index] = cached
+        if missing:
+            if field == "questions":
+                decrypted = self.decrypt_notes(
+                    [encrypted_values[i] for i in missing], default, [section_ids[i] for i in missing]
+                )
+            else:
+                decrypted = self.decrypt_many([encrypted_values[i] for i in missing], default)
+            for index, plain_text in zip(missing, decrypted):
+                results[index] = plain_text
+                if plain_text:
+                    self.plaintext_cache.put(section_ids[index], field, encrypted_values[index], plain_text)
+        return results
+
+    def decrypt_notes(self, encrypted_values, default="", section_ids=None):
+        """
+        Batch-decrypt note payloads of any version to their text. Chunked
+        notes are reassembled from section_chunks, which needs section_ids.
+        """
+        encrypted_values = list(encrypted_values)
+        section_ids = list(section_ids) if section_ids is not None else [None] * len(encrypted_values)
+        try:
+            payloads = self.encryption_manager.decrypt_many(encrypted_values, as_bytes=True)
+        except Exception as e:
+            print(f"Decryption error: {e}")
+            payloads = [b""] * len(encrypted_values)
+        notes = []
+        for section_id, value, payload in zip(section_ids, encrypted_values, payloads):
+            try:
+                if value and is_chunked(payload):
+                    notes.append("".join(self._iter_note_chunks(section_id, payload)))
+                    continue
+                notes.append(decode_note(payload) if value else default)
+            except Exception as e:
+                print(f"Note decoding error: {e}")
+                notes.append(default)
+        return notes
+
+    def cache_stats(self):
+        """Plaintext cache counters: entries, bytes, hits, misses, evictions, hit_rate."""
+        return self.plaintext_cache.stats()
+
     def load_from_database(self):
         """Load and decrypt data from the database with enhanced error handling."""
         try:
-            self.cursor.execute(
-                "SELECT id, title, type, parent_id, questions FROM sections ORDER BY placement, id"
-            )
+            self.cursor.execute("""
+                SELECT s.id, s.title, s.type, s.parent_id, c.questions
+                FROM sections s
+                LEFT JOIN section_content c ON c.section_id = s.id
+                ORDER BY s.parent_id, s.placement, s.id
+            """)
             rows = self.cursor.fetchall()
-            decrypted_rows = []
-            
-            for row in rows:
-                try:
-                    decrypted_title = self.decrypt_safely(row[1], f"[Section {row[0]}]")
-                    decrypted_questions = self.decrypt_safely(row[4], "[]")
-                    
-                    decrypted_rows.append((
-                        row[0],                # id
-                        decrypted_title,       # title
-                        row[2],                # type
-                        row[3],                # parent_id
-                        decrypted_questions    # questions
-                    ))
-                except Exception as e:
-                    print(f"Error processing row {row[0]}: {e}")
-                    decrypted_rows.append((
-                        row[0],
-                        f"[Error: Section {row[0]}]",
-                        row[2],
-                        row[3],
-                        "[]"
-                    ))
+            ids = [row[0] for row in rows]
+            titles = self.decrypt_column(ids, [row[1] for row in rows], "title")
+            questions = self.decrypt_column(ids, [row[4] for row in rows], "questions")
+
+            decrypted_rows = [
+                (
+                    row[0],                               # id
+                    title or f"[Section {row[0]}]",       # title
+                    row[2],                               # type
+                    row[3],                               # parent_id
+                    question                              # questions
+                )
+                for row, title, question in zip(rows, titles, questions)
+            ]
             
             return decrypted_rows
             
@@ -780,48 +1676,56 @@ class DatabaseHandler:
 
 
     # Search related
-    def _should_refresh_cache(self) -> bool:
-        """Check if the cache needs refreshing based on time or modifications."""
-        return time.time() - self._last_cache_update > self._cache_lifetime
-
     @timer
     def refresh_search_cache(self, node_id=None):
-        """Refresh the search cache for specified node or entire database."""
+        """Warm the plaintext cache for a node and its descendants, or the whole database."""
+        with self.reading():
+            self._search_rows(node_id)
+
+    def prefetch(self, node_id=None):
+        """
+        Run refresh_search_cache on a worker thread, so a later search or
+        export finds everything decrypted. Returns the thread.
+        """
+        def work():
+            try:
+                self.refresh_search_cache(node_id)
+            except Exception as e:
+                print(f"Error prefetching: {e}")
+
+        thread = threading.Thread(target=work, name="outliner-prefetch", daemon=True)
+        thread.start()
+        return thread
+
+    def _search_rows(self, node_id=None):
+        """Return [(id, title, questions)] decrypted through the plaintext cache."""
         if node_id:
-            # Load specific node and its children
             sections = self._load_node_and_children(node_id)
         else:
-            # Load all sections
-            self.cursor.execute("SELECT id, title, questions FROM sections")
-            sections = self.cursor.fetchall()
-
-        # Update cache with decrypted values
-        for section_id, title, questions in sections:
-            if str(section_id) not in self._search_cache:
-                self._search_cache[str(section_id)] = {
-                    'title': self.decrypt_safely(title, ''),
-                    'questions': self.decrypt_safely(questions, '[]')
-                }
-
-        self._last_cache_update = time.time()
+            cursor = self._read_cursor()
+            cursor.execute("""
+                SELECT s.id, s.title, c.questions
+                FROM sections s
+                LEFT JOIN section_content c ON c.section_id = s.id
+            """)
+            sections = cursor.fetchall()
+        ids = [row[0] for row in sections]
+        titles = self.decrypt_column(ids, [row[1] for row in sections], "title")
+        questions = self.decrypt_column(ids, [row[2] for row in sections], "questions")
+        return list(zip(ids, titles, questions))
 
     @timer
     def _load_node_and_children(self, node_id) -> list:
-        """Recursively load a node and all its descendants."""
-        result = []
-        self.cursor.execute("""
-            WITH RECURSIVE descendants AS (
-                SELECT id, title, questions, parent_id
-                FROM sections
-                WHERE id = ?
-                UNION ALL
-                SELECT s.id, s.title, s.questions, s.parent_id
-                FROM sections s
-                INNER JOIN descendants d ON s.parent_id = d.id
-            )
-            SELECT id, title, questions FROM descendants
-        """, (node_id,))
-        return self.cursor.fetchall()
+        """Load a node and all its descendants."""
+        low, high = self.subtree_bounds(node_id)
+        cursor = self._read_cursor()
+        cursor.execute("""
+            SELECT s.id, s.title, c.questions
+            FROM sections s
+            LEFT JOIN section_content c ON c.section_id = s.id
+            WHERE s.path >= ? AND s.path < ?
+        """, (low, high))
+        return cursor.fetchall()
 
     @timer
     def search_sections(self, query: str, node_id: int = None, global_search: bool = False) -> Tuple[Set[int], Set[int]]:
@@ -831,64 +1735,45 @@ class DatabaseHandler:
         if not query:
             return set(), set()
 
-        # Always refresh cache for the appropriate scope
-        if global_search:
-            self.refresh_search_cache(None)  # Refresh entire database
-        elif node_id is not None:
-            self.refresh_search_cache(node_id)  # Refresh selected node and children
-        else:
-            # If no node selected and not global, search root level items
-            self.cursor.execute("SELECT id FROM sections WHERE parent_id IS NULL")
-            root_ids = [row[0] for row in self.cursor.fetchall()]
-            for root_id in root_ids:
-                self.refresh_search_cache(root_id)
+        # A node searches its subtree; otherwise every section (all descend from the roots)
+        scope = node_id if node_id is not None and not global_search else None
 
         matching_ids = set()
         parent_ids = set()
-        
-        # Get relevant section IDs based on search scope
-        if global_search:
-            sections_to_search = self._search_cache.keys()
-        elif node_id is not None:
-            sections = self._load_node_and_children(node_id)
-            sections_to_search = [str(s[0]) for s in sections]
-        else:
-            # If no node selected and not global, search all root level items and their children
-            sections_to_search = self._search_cache.keys()
 
-        # Perform search on cached data
         query = query.lower()
-        for section_id in sections_to_search:
-            cached_data = self._search_cache.get(section_id)
-            if not cached_data:
-                continue
+        with self.reading() as cursor:
+            for section_id, title, questions in self._search_rows(scope):
+                if query in title.lower() or query in questions.lower():
+                    matching_ids.add(section_id)
 
-            if (query in cached_data['title'].lower() or 
-                query in cached_data['questions'].lower()):
-                matching_ids.add(int(section_id))
-
-        # Get all parent IDs for matching sections
-        if matching_ids:
-            placeholders = ','.join('?' * len(matching_ids))
-            self.cursor.execute(f"""
-                WITH RECURSIVE ancestors AS (
-                    SELECT id, parent_id
-                    FROM sections
-                    WHERE id IN ({placeholders})
-                    UNION ALL
-                    SELECT s.id, s.parent_id
-                    FROM sections s
-                    INNER JOIN ancestors a ON s.id = a.parent_id
-                    WHERE s.parent_id IS NOT NULL
+            # Get all parent IDs for matching sections; they're in each path
+            if matching_ids:
+                placeholders = ','.join('?' * len(matching_ids))
+                cursor.execute(
+                    f"SELECT path FROM sections WHERE id IN ({placeholders}) AND path IS NOT NULL",
+                    list(matching_ids)
                 )
-                SELECT DISTINCT parent_id
-                FROM ancestors
-                WHERE parent_id IS NOT NULL
-            """, list(matching_ids))
-            parent_ids = {row[0] for row in self.cursor.fetchall()}
+                for (path,) in cursor.fetchall():
+                    parent_ids.update(int(part) for part in path.strip("/").split("/")[:-1])
 
         return matching_ids, parent_ids
 
     def close(self):
+        """
+        Write pending saves, then close the read pool, the encryption worker
+        pool and the connection, recording a clean exit for ensure_tree_integrity.
+        """
+        try:
+            self.writes.flush()
+        except Exception as e:
+            print(f"Error writing pending saves: {e}")
+        try:
+            self.cursor.execute("DELETE FROM settings WHERE key = ?", (SESSION_OPEN_KEY,))
+        except sqlite3.Error as e:
+            print(f"Error recording clean exit: {e}")
+        self._close_readers()
+        if self._encryption_manager is not None:
+            self._encryption_manager.shutdown_pool()
         self.conn.close()
 
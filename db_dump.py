@@ -5,8 +5,13 @@ CREATE TABLE sections (
     parent_id  INTEGER,                              (orange)
     title      TEXT DEFAULT '',                      (yellow)
     type       TEXT, -- 'header', 'category', ...    (green)
-    questions  TEXT DEFAULT '[]', -- JSON array ...  (blue)
-    placement  INTEGER NOT NULL CHECK(placement > 0) -- Ensure ... (magenta)
+    placement  INTEGER NOT NULL CHECK(placement > 0) -- Ensure ... (blue)
+    path       TEXT,                                 (magenta)
+    depth      INTEGER                               (cyan)
+)
+CREATE TABLE section_content (
+    section_id INTEGER PRIMARY KEY,                  (red)
+    questions  BLOB                                  (orange)
 )
 CREATE TABLE sqlite_sequence(name,seq)
 CREATE TABLE settings (
@@ -26,7 +31,12 @@ def truncate_string(s, max_length=20):
     """Truncate a string to a specified length and add ellipsis if needed."""
     if isinstance(s, str):
         return s if len(s) <= max_length else s[:max_length] + "..."
-    return s  # Non-string values are returned as-is
+    if isinstance(s, (bytes, memoryview)):
+        # Notes and v2 ciphertext are BLOBs: show the leading bytes as hex and the size
+        data = bytes(s)
+        shown = data[:max_length // 2].hex()
+        return f"{shown}... ({len(data)} bytes)" if len(data) > max_length // 2 else f"{shown} ({len(data)} bytes)"
+    return s  # Other values are returned as-is
 
 def colorize(text, color):
     """Apply color to the text using colorama."""
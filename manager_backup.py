@@ -0,0 +1,242 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from urllib.request import pathname2url
+
+from config import BACKUP_DIR, BACKUP_KEEP, BACKUP_PAGES_PER_STEP
+from utility import timer
+
+
+def verify_copy(path):
+    """
+    Run PRAGMA integrity_check on a database file, read-only.
+    Returns the problems it reports; an empty list means the copy is sound.
+    """
+    conn = sqlite3.connect(f"file:{pathname2url(os.path.abspath(path))}?mode=ro", uri=True)
+    try:
+        rows = conn.execute("PRAGMA integrity_check").fetchall()
+    finally:
+        conn.close()
+    problems = [row[0] for row in rows]
+    return [] if problems == ["ok"] else problems
+
+
+class BackupJob:
+    """
+    One copy running on a worker thread. The Tk loop polls done() and reads
+    progress; result is the copy's path once it succeeded, error the exception
+    if it didn't.
+    """
+
+    def __init__(self, target_path):
+        self.target_path = target_path
+        self.progress = (0, 0)  # (pages copied, total pages); VACUUM INTO reports none
+        self.result = None
+        self.error = None
+        self.thread = None
+
+    def done(self):
+        return self.thread is not None and not self.thread.is_alive()
+
+
+class BackupService:
+    """
+    Whole-database copies of the open database, taken while it is in use:
+    backup() goes through SQLite's online backup API a few pages per step,
+    vacuum_into() writes a compacted copy with VACUUM INTO. Both read one WAL
+    snapshot through a read-only connection, so the copy is consistent and
+    the writer never waits; pending editor saves are flushed first. Every copy
+    is written next to its target as a .part file, checked with
+    PRAGMA integrity_check and only then renamed into place. The open
+    session's marker is dropped from the copy, so opening it doesn't look
+    like an unclean exit.
+
+    The copy holds the same ciphertext and key slots, so it opens with the
+    same password(s).
+    """
+
+    def __init__(self, db_handler):
+        self.db = db_handler
+        self._running = set()  # target paths of jobs started and not yet finished
+
+    # COPIES
+
+    @timer
+    def backup(self, target_path, progress=None):
+        """
+        Copy the database to target_path with the online backup API,
+        BACKUP_PAGES_PER_STEP pages at a time. progress(copied, total) is
+        called after each step. Returns target_path.
+        """
+        self.db.writes.flush()
+        return self._write_copy(target_path, self._backup_copier(progress))
+
+    @timer
+    def vacuum_into(self, target_path):
+        """
+        Write a compacted copy of the database to target_path with VACUUM INTO:
+        free pages are dropped and tables and indexes are rewritten in order.
+        Returns target_path.
+        """
+        self.db.writes.flush()
+        return self._write_copy(target_path, self._vacuum_copier())
+
+    def start(self, target_path, compact=False):
+        """
+        Run backup() (or vacuum_into() if compact) on a worker thread.
+        Returns the BackupJob for the caller to poll.
+        """
+        target_path = os.path.abspath(target_path)
+        if target_path in self._running:
+            raise ValueError(f"A backup to {target_path} is already running.")
+        self.db.writes.flush()  # the worker reads committed rows only
+        job = BackupJob(target_path)
+
+        def progress(copied, total):
+            job.progress = (copied, total)
+
+        copier = self._vacuum_copier() if compact else self._backup_copier(progress)
+
+        def work():
+            try:
+                job.result = self._write_copy(target_path, copier)
+            except Exception as e:
+                job.error = e
+            finally:
+                self._running.discard(target_path)
+
+        self._running.add(target_path)
+        job.thread = threading.Thread(target=work, name="outliner-backup", daemon=True)
+        job.thread.start()
+        return job
+
+    # The copiers below run on whichever thread calls them: they only read
+    # through read-only connections, never the writer
+
+    def _backup_copier(self, progress=None):
+        def step(status, remaining, total):
+            if progress:
+                progress(total - remaining, total)
+
+        def copy(part_path):
+            target = sqlite3.connect(part_path)
+            try:
+                with self.db.reading() as cursor:
+                    # Start the snapshot before the first step; otherwise each step
+                    # reads on its own and a commit meanwhile restarts the copy
+                    cursor.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+                    cursor.connection.backup(target, pages=BACKUP_PAGES_PER_STEP, progress=step)
+            finally:
+                target.close()
+
+        return copy
+
+    def _vacuum_copier(self):
+        def copy(part_path):
+            # VACUUM can't run inside the snapshot reading() opens, nor on a
+            # query_only connection; mode=ro still keeps it from writing here
+            conn = sqlite3.connect(self.db._read_only_uri(), uri=True, isolation_level=None)
+            try:
+                conn.execute("VACUUM INTO ?", (part_path,))
+            finally:
+                conn.close()
+            # The copy comes out in rollback-journal mode; migrations only set
+            # WAL on databases that still need a migration
+            conn = sqlite3.connect(part_path)
+            try:
+                conn.execute("PRAGMA journal_mode=WAL")
+            finally:
+                conn.close()
+
+        return copy
+
+    def _write_copy(self, target_path, copy):
+        target_path = os.path.abspath(target_path)
+        if os.path.abspath(self.db.db_name) == target_path:
+            raise ValueError("Cannot back up a database onto itself.")
+        part_path = target_path + ".part"
+        _remove_database(part_path)
+        try:
+            copy(part_path)
+            _clear_session_marker(part_path)
+            problems = verify_copy(part_path)
+            if problems:
+                raise sqlite3.DatabaseError(f"Backup failed its integrity check: {problems[0]}")
+        except BaseException:
+            _remove_database(part_path)
+            raise
+        _remove_database(target_path)
+        os.replace(part_path, target_path)
+        return target_path
+
+    # ROTATION
+
+    def backup_dir(self):
+        """The folder timestamped backups go to, next to the database file."""
+        return os.path.join(os.path.dirname(os.path.abspath(self.db.db_name)), BACKUP_DIR)
+
+    def next_backup_path(self):
+        """
+        A new timestamped path in backup_dir(), e.g. outline.2025.01.31_142502.db.
+        A second backup in the same second gets a counter (..._142502-2.db)
+        rather than the path of one on disk or still being written.
+        """
+        stem = os.path.splitext(os.path.basename(self.db.db_name))[0]
+        base = os.path.join(self.backup_dir(), f"{stem}.{time.strftime('%Y.%m.%d_%H%M%S')}")
+        path, counter = f"{base}.db", 1
+        while path in self._running or os.path.exists(path) or os.path.exists(path + ".part"):
+            counter += 1
+            path = f"{base}-{counter}.db"
+        return path
+
+    def list_backups(self):
+        """Timestamped backups of this database, oldest first."""
+        directory = self.backup_dir()
+        if not os.path.isdir(directory):
+            return []
+        stem = os.path.splitext(os.path.basename(self.db.db_name))[0]
+        pattern = re.compile(re.escape(stem) + r"\.(\d{4}\.\d{2}\.\d{2}_\d{6})(?:-(\d+))?\.db")
+        backups = []
+        for name in os.listdir(directory):
+            match = pattern.fullmatch(name)
+            if match:
+                backups.append(((match.group(1), int(match.group(2) or 1)), name))
+        return [os.path.join(directory, name) for _, name in sorted(backups)]
+
+    def rotate(self, keep=BACKUP_KEEP):
+        """Delete all but the newest keep backups; returns the paths removed."""
+        backups = self.list_backups()
+        removed = backups[:-keep] if keep > 0 else backups
+        for path in removed:
+            _remove_database(path)
+        return removed
+
+    def start_rotating_backup(self):
+        """start() a backup to next_backup_path(), creating the folder if needed."""
+        os.makedirs(self.backup_dir(), exist_ok=True)
+        return self.start(self.next_backup_path())
+
+
+def _clear_session_marker(path):
+    """
+    Delete the session_open row the copy took from the live database; left
+    there, every copy would open with the full tree check.
+    """
+    from database import SESSION_OPEN_KEY  # database imports this module
+
+    conn = sqlite3.connect(path)
+    try:
+        with conn:
+            conn.execute("DELETE FROM settings WHERE key = ?", (SESSION_OPEN_KEY,))
+    finally:
+        conn.close()
+
+
+def _remove_database(path):
+    """Remove a database file and any -wal/-shm left beside it."""
+    for suffix in ("", "-wal", "-shm", "-journal"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
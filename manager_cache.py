@@ -0,0 +1,96 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from config import PLAINTEXT_CACHE_MAX_BYTES, PLAINTEXT_CACHE_TTL_SECONDS
+
+
+def ciphertext_version(encrypted_value):
+    """
+    Short stand-in for a stored value. v2 BLOBs are identified by their header
+    and nonce, which are unique per encryption; older text values are hashed.
+    """
+    if isinstance(encrypted_value, (bytes, bytearray, memoryview)):
+        return bytes(encrypted_value[:17])
+    return hash(encrypted_value)
+
+
+class PlaintextCache:
+    """
+    Decrypted titles and notes keyed by (section id, field). Each entry also
+    records the ciphertext it came from, so a row rewritten behind the cache's
+    back (re-encryption, raw copies) is simply a miss. Entries are evicted
+    least recently used first once the byte budget is exceeded, and expire
+    after ttl seconds. Safe to share with reader threads (see
+    DatabaseHandler.reading).
+    """
+
+    def __init__(self, max_bytes=PLAINTEXT_CACHE_MAX_BYTES, ttl=PLAINTEXT_CACHE_TTL_SECONDS):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # (section_id, field) -> (version, plaintext, size, stored_at)
+        self.bytes_used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def get(self, section_id, field, encrypted_value):
+        """Return the cached plaintext for this exact ciphertext, or None."""
+        key = (section_id, field)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                version, plaintext, size, stored_at = entry
+                if version == ciphertext_version(encrypted_value) and time.monotonic() - stored_at < self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return plaintext
+                self._remove(key)
+            self.misses += 1
+            return None
+
+    def put(self, section_id, field, encrypted_value, plaintext):
+        key = (section_id, field)
+        size = sys.getsizeof(plaintext)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (ciphertext_version(encrypted_value), plaintext, size, time.monotonic())
+            self.bytes_used += size
+            while self.bytes_used > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate(self, section_ids):
+        """Drop every field of the given sections."""
+        with self._lock:
+            for section_id in section_ids:
+                for field in ("title", "questions"):
+                    if (section_id, field) in self._entries:
+                        self._remove((section_id, field))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes_used = 0
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self.bytes_used -= entry[2]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes_used,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -1,43 +1,43 @@
 from docx import Document
 from docx.shared import Pt, Inches, RGBColor
-import json
 from config import DOC_FONT, H1_SIZE, H2_SIZE, H3_SIZE, H4_SIZE, P_SIZE, INDENT_SIZE
 from tkinter.filedialog import asksaveasfilename
 from tkinter import messagebox
 
 from database import DatabaseHandler
 from manager_encryption import EncryptionManager
+from manager_notes import note_lines
 
 def load_sections_for_export(db_handler: DatabaseHandler, root_id=None):
     """Load sections from database with optional root filtering."""
-    db_handler.cursor.execute("""
-        WITH RECURSIVE descendants AS (
-            SELECT id, title, type, parent_id, questions, placement
-            FROM sections
-            WHERE id = ? OR (? IS NULL AND parent_id IS NULL)
-            UNION ALL
-            SELECT s.id, s.title, s.type, s.parent_id, s.questions, s.placement
+    # One read snapshot, on a read-only connection (see DatabaseHandler.reading)
+    with db_handler.reading() as cursor:
+        low, high = db_handler.subtree_bounds(root_id)
+        cursor.execute("""
+            SELECT s.id, s.title, s.type, s.parent_id, c.questions, s.placement
             FROM sections s
-            INNER JOIN descendants d ON s.parent_id = d.id
+            LEFT JOIN section_content c ON c.section_id = s.id
+            WHERE s.path >= ? AND s.path < ?
+        """, (low, high))
+        
+        # Rows come back in path order off idx_sections_path. The export only
+        # needs siblings in placement order, so sort here rather than have
+        # SQLite copy every note through a temp B-tree
+        rows = sorted(cursor.fetchall(), key=lambda row: (row[5], row[0]))
+        ids = [row[0] for row in rows]
+        titles = db_handler.decrypt_column(ids, [row[1] for row in rows], "title")
+        questions = db_handler.decrypt_column(ids, [row[4] for row in rows], "questions")
+
+    decrypted_rows = [
+        (
+            row[0],                          # id
+            title or f"[Section {row[0]}]",  # title
+            row[2],                          # type
+            row[3],                          # parent_id
+            question                         # questions
         )
-        SELECT id, title, type, parent_id, questions 
-        FROM descendants
-        ORDER BY parent_id NULLS FIRST, placement, id
-    """, (root_id, root_id))
-    
-    rows = db_handler.cursor.fetchall()
-    decrypted_rows = []
-    
-    for row in rows:
-        decrypted_title = db_handler.decrypt_safely(row[1], f"[Section {row[0]}]")
-        decrypted_questions = db_handler.decrypt_safely(row[4], "[]")
-        decrypted_rows.append((
-            row[0],           # id
-            decrypted_title,  # title
-            row[2],          # type
-            row[3],          # parent_id
-            decrypted_questions  # questions
-        ))
+        for row, title, question in zip(rows, titles, questions)
+    ]
     
     return decrypted_rows
 
@@ -127,10 +127,7 @@ def export_to_docx(db_handler: DatabaseHandler, root_id=None, file_path=None):
 
                 parent_indent = add_custom_heading(doc, title_with_number, current_level)
 
-                try:
-                    questions_list = json.loads(questions) if questions else []
-                except json.JSONDecodeError:
-                    questions_list = []
+                questions_list = note_lines(questions)
 
                 if not questions_list:
                     add_custom_paragraph(
@@ -163,10 +160,7 @@ def export_to_docx(db_handler: DatabaseHandler, root_id=None, file_path=None):
             parent_indent = add_custom_heading(doc, f"1. {title}", get_section_level(section_type))
             
             # Add root section's questions
-            try:
-                questions_list = json.loads(questions) if questions else []
-            except json.JSONDecodeError:
-                questions_list = []
+            questions_list = note_lines(questions)
 
             if not questions_list:
                 add_custom_paragraph(
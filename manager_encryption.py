@@ -1,85 +1,657 @@
 import base64
+import hashlib
+import hmac
+import multiprocessing
 import os
+import threading
+import time
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives.hashes import SHA256
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.keywrap import aes_key_wrap, aes_key_unwrap, InvalidUnwrap
 from cryptography.hazmat.backends import default_backend
-from functools import lru_cache
 
+from config import CRYPTO_WORKERS, PARALLEL_CRYPTO_MIN_ITEMS
 from utility import timer
 
+# Ciphertext format v2 (current) is a BLOB:
+#   version (1 byte) | key_id (4) | nonce (12) | AES-GCM ciphertext and tag
+# The record key is one HKDF expansion of the master key per key id, and the
+# version/key_id header is authenticated data.
+FORMAT_V2 = 2
+V2_HEADER_SIZE = 1 + 4
+NONCE_SIZE = 12
+HKDF_INFO_V2 = b"outliner record key v2"
+# Note chunks are identified by an HMAC under a key of their own, so equal
+# chunks can be matched without storing a plain hash of their content.
+HKDF_INFO_CHUNK_DIGEST = b"outliner chunk digest v1"
+
+# Ciphertext format v1 (read only): "$h1$" + base64(key_id | salt | iv | AES-CBC data).
+# The key for each salt is an HKDF expansion of one master key (the unwrapped
+# data key, or a PBKDF2 key for databases that predate key slots), so opening
+# a database costs a single KDF run no matter how many salts it holds.
+# Anything without the prefix is the original base64(salt | iv | data) format,
+# which still needs a full PBKDF2 run per distinct salt.
+FORMAT_V1_PREFIX = "$h1$"
+KEY_ID_SIZE = 4
+SALT_SIZE = 16
+IV_SIZE = 16
+HKDF_INFO_V1 = b"outliner record key v1"
+
+# Envelope encryption: one random data key encrypts every row, and each key
+# slot holds a copy of it wrapped (RFC 3394) under a password-derived key.
+DATA_KEY_SIZE = 32
+
+# Password KDFs. Each key slot records the parameters it was made with, so
+# slots of different strengths can coexist; the floors stop a tampered slot
+# from downgrading the work factor.
+KDF_NAME = "pbkdf2-sha256"
+KDF_SCRYPT = "scrypt"
+KDF_ITERATIONS = 100_000          # legacy rows, and the PBKDF2 floor
+SCRYPT_MIN_N = 2 ** 14
+SCRYPT_MAX_N = 2 ** 20
+SCRYPT_R = 8
+SCRYPT_P = 1
+DEFAULT_KDF_PARAMS = {"kdf": KDF_NAME, "iterations": KDF_ITERATIONS}
+
+
+def key_id_for_salt(master_salt: bytes) -> bytes:
+    """Short identifier stored in each v1 record naming its master key."""
+    return hashlib.sha256(master_salt).digest()[:KEY_ID_SIZE]
+
+
+def generate_data_key():
+    """Return a new random (key_id, data_key) pair."""
+    return os.urandom(KEY_ID_SIZE), os.urandom(DATA_KEY_SIZE)
+
+
+def kdf_params(source: dict) -> dict:
+    """Pick and check the KDF parameters out of a slot or settings dict."""
+    kdf = source.get("kdf")
+    if kdf == KDF_NAME:
+        params = {"kdf": kdf, "iterations": int(source["iterations"])}
+        if params["iterations"] < KDF_ITERATIONS:
+            raise ValueError("PBKDF2 iteration count is below the minimum.")
+        return params
+    if kdf == KDF_SCRYPT:
+        params = {"kdf": kdf, "n": int(source["n"]), "r": int(source["r"]), "p": int(source["p"])}
+        n = params["n"]
+        if n < SCRYPT_MIN_N or n > SCRYPT_MAX_N or n & (n - 1):
+            raise ValueError("scrypt cost must be a power of two within the allowed range.")
+        if params["r"] < 1 or params["p"] < 1:
+            raise ValueError("scrypt r and p must be positive.")
+        return params
+    raise ValueError(f"Unsupported KDF: {kdf}")
+
+
+def derive_password_key(password: bytes, salt: bytes, params: dict = None) -> bytes:
+    params = kdf_params(params or DEFAULT_KDF_PARAMS)
+    if params["kdf"] == KDF_SCRYPT:
+        n, r, p = params["n"], params["r"], params["p"]
+        return hashlib.scrypt(
+            password, salt=salt, n=n, r=r, p=p, dklen=32, maxmem=256 * r * n
+        )
+    kdf = PBKDF2HMAC(
+        algorithm=SHA256(),
+        length=32,
+        salt=salt,
+        iterations=params["iterations"],
+        backend=default_backend(),
+    )
+    return kdf.derive(password)
+
+
+def calibrate_kdf(kdf: str = KDF_NAME, target_ms: float = 300) -> dict:
+    """
+    Choose KDF parameters that take about target_ms on this machine. Cost is
+    measured with a short trial run and scaled; the result never goes below
+    the floors above.
+    """
+    salt = os.urandom(SALT_SIZE)
+    if kdf == KDF_SCRYPT:
+        n = SCRYPT_MIN_N
+        params = {"kdf": KDF_SCRYPT, "n": n, "r": SCRYPT_R, "p": SCRYPT_P}
+        start = time.perf_counter()
+        derive_password_key(b"calibration", salt, params)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        # scrypt time grows linearly with n; keep n a power of two
+        while n < SCRYPT_MAX_N and elapsed_ms * 2 <= target_ms:
+            n *= 2
+            elapsed_ms *= 2
+        params["n"] = n
+        return params
+    if kdf != KDF_NAME:
+        raise ValueError(f"Unsupported KDF: {kdf}")
+
+    start = time.perf_counter()
+    derive_password_key(b"calibration", salt, DEFAULT_KDF_PARAMS)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    # PBKDF2 time is linear in the iteration count
+    iterations = int(KDF_ITERATIONS * target_ms / max(elapsed_ms, 1e-3))
+    # Round to a tidy number so stored values are easy to read
+    iterations = max(KDF_ITERATIONS, iterations // 10_000 * 10_000)
+    return {"kdf": KDF_NAME, "iterations": iterations}
+
+
+def create_key_slot(password: str, key_id: bytes, data_key: bytes, params: dict = None) -> dict:
+    """Wrap the data key under a key derived from password with params."""
+    params = kdf_params(params or DEFAULT_KDF_PARAMS)
+    salt = os.urandom(SALT_SIZE)
+    wrapping_key = derive_password_key(password.encode('utf-8'), salt, params)
+    return {
+        **params,
+        "salt": salt.hex(),
+        "key_id": key_id.hex(),
+        "wrapped_key": aes_key_wrap(wrapping_key, data_key, backend=default_backend()).hex(),
+    }
+
+
 class EncryptionManager:
-    def __init__(self, password: str):
+    def __init__(self, password: str, master_salt: bytes = None):
         if len(password) < 3:
             raise ValueError("Password must be at least 14 characters.")
         self.password = password.encode('utf-8')
-        # Pre-compute common salt and key
-        self._common_salt = os.urandom(16)
-        self._common_key = self._derive_key(self._common_salt)
-        self._key_cache = {}
+        # Master keys by key id: unwrapped data keys, or PBKDF2 keys derived
+        # lazily from a bound master salt for databases without key slots
+        self._master_keys = {}
+        self._master_salts = {}
+        self.key_id = None
+        self.clear_key_caches()
+        # Worker pool for decrypt_many/encrypt_many, started on demand. Batches
+        # run on the Tk thread and on background readers (prefetch), so the
+        # pool is started, borrowed and shut down under _pool_state
+        self._pool = None
+        self._pool_state = threading.Condition()
+        self._pool_batches = 0  # batches waiting on the current pool
+        self.workers = CRYPTO_WORKERS or os.cpu_count() or 1
+        self.parallel_min_items = PARALLEL_CRYPTO_MIN_ITEMS
+        if master_salt:
+            self.bind_master_salt(master_salt)
+
+    def bind_master_salt(self, master_salt: bytes):
+        """
+        Select the master salt used for new ciphertext. Salts bound earlier stay
+        readable, so switching back and forth never re-runs PBKDF2.
+        """
+        key_id = key_id_for_salt(master_salt)
+        self.shutdown_pool()
+        self._master_salts[key_id] = master_salt
+        self.master_salt = master_salt
+        self.key_id = key_id
+
+    def load_data_key(self, key_id: bytes, data_key: bytes):
+        """Install an unwrapped data key and use it for new ciphertext."""
+        self.shutdown_pool()
+        self._master_keys[key_id] = data_key
+        self.key_id = key_id
+
+    def use_key(self, key_id: bytes):
+        """Switch new ciphertext to another key this manager already holds."""
+        if key_id not in self._master_keys and key_id not in self._master_salts:
+            raise ValueError("Data key is not unlocked.")
+        if key_id != self.key_id:
+            self.shutdown_pool()
+            self.key_id = key_id
+
+    def data_key(self, key_id: bytes) -> bytes:
+        """Return a loaded data key, e.g. to wrap it into another key slot."""
+        if key_id not in self._master_keys or key_id in self._master_salts:
+            raise ValueError("Data key is not unlocked.")
+        return self._master_keys[key_id]
+
+    def unwrap_key_slot(self, slot: dict):
+        """
+        Unwrap a key slot with this manager's password.
+        Returns (key_id, data_key), or None if the password does not open it.
+        """
+        try:
+            params = kdf_params(slot)
+        except (KeyError, ValueError) as e:
+            print(f"Skipping key slot: {e}")
+            return None
+        wrapping_key = self._derive_slot_key(
+            bytes.fromhex(slot["salt"]), tuple(sorted(params.items()))
+        )
+        try:
+            data_key = aes_key_unwrap(
+                wrapping_key, bytes.fromhex(slot["wrapped_key"]), backend=default_backend()
+            )
+        except InvalidUnwrap:
+            return None
+        return bytes.fromhex(slot["key_id"]), data_key
+
+    def open_key_slot(self, slot: dict) -> bool:
+        """Load the data key from a slot; free if this manager already holds it."""
+        key_id = bytes.fromhex(slot["key_id"])
+        if key_id in self._master_keys and key_id not in self._master_salts:
+            self.use_key(key_id)
+            return True
+        unwrapped = self.unwrap_key_slot(slot)
+        if unwrapped is None:
+            return False
+        self.load_data_key(*unwrapped)
+        return True
+
+    def clear_key_caches(self):
+        """
+        Drop every derived key (password keys, slot keys, subkeys, record and
+        digest keys). They are per instance, so a manager that is no longer
+        used takes its keys with it; they are also dropped whenever the pool
+        is shut down, e.g. when a rotation loads a new data key.
+        """
+        self._derived_keys = {}   # salt -> PBKDF2 key (original format)
+        self._slot_keys = {}      # (salt, params) -> key-slot wrapping key
+        self._subkeys = {}        # (key_id, salt) -> v1 AES key
+        self._record_keys = {}    # key_id -> v2 AES-GCM key
+        self._digest_keys = {}    # key_id -> chunk digest key
+
+    @staticmethod
+    def _cached(cache: dict, limit: int, key, compute):
+        """Look key up in cache, computing and storing it on a miss; the oldest entry goes past limit."""
+        value = cache.get(key)
+        if value is None:
+            value = compute()
+            if len(cache) >= limit:
+                # Another thread may have evicted it already
+                cache.pop(next(iter(cache), None), None)
+            cache[key] = value
+        return value
+
+    def lock(self):
+        """Forget the password's keys and every data key; the manager can't encrypt or decrypt afterwards."""
+        self.shutdown_pool()
+        self._master_keys = {}
+        self._master_salts = {}
+        self.key_id = None
+
+    def _master_key(self, key_id: bytes) -> bytes:
+        """Return the PBKDF2 master key for a key id, deriving it on first use."""
+        key = self._master_keys.get(key_id)
+        if key is None:
+            key = self._derive_key(self._master_salts[key_id])
+            self._master_keys[key_id] = key
+        return key
 
-    @lru_cache(maxsize=1000)
     def _derive_key(self, salt: bytes) -> bytes:
-        kdf = PBKDF2HMAC(
-            algorithm=SHA256(),
-            length=32,
-            salt=salt,
-            iterations=100_000,
-            backend=default_backend(),
+        return self._cached(
+            self._derived_keys, 1000, salt, lambda: derive_password_key(self.password, salt)
         )
-        return kdf.derive(self.password)
+
+    def _derive_slot_key(self, salt: bytes, params: tuple) -> bytes:
+        """Key-slot wrapping key; params is the slot's KDF settings as sorted items."""
+        return self._cached(
+            self._slot_keys, 64, (salt, params),
+            lambda: derive_password_key(self.password, salt, dict(params))
+        )
+
+    def _derive_subkey(self, key_id: bytes, salt: bytes) -> bytes:
+        """Expand the master key into the AES key for one salt (microseconds)."""
+        def derive():
+            hkdf = HKDF(
+                algorithm=SHA256(),
+                length=32,
+                salt=salt,
+                info=HKDF_INFO_V1,
+                backend=default_backend(),
+            )
+            return hkdf.derive(self._master_key(key_id))
+
+        return self._cached(self._subkeys, 4096, (key_id, salt), derive)
+
+    def _record_key(self, key_id: bytes) -> bytes:
+        """AES-GCM key for v2 records: one HKDF expansion per master key."""
+        def derive():
+            hkdf = HKDF(
+                algorithm=SHA256(),
+                length=32,
+                salt=None,
+                info=HKDF_INFO_V2,
+                backend=default_backend(),
+            )
+            return hkdf.derive(self._master_key(self._known_key_id(key_id)))
+
+        return self._cached(self._record_keys, 64, key_id, derive)
+
+    def _digest_key(self, key_id: bytes) -> bytes:
+        def derive():
+            hkdf = HKDF(
+                algorithm=SHA256(),
+                length=32,
+                salt=None,
+                info=HKDF_INFO_CHUNK_DIGEST,
+                backend=default_backend(),
+            )
+            return hkdf.derive(self._master_key(self._known_key_id(key_id)))
+
+        return self._cached(self._digest_keys, 64, key_id, derive)
+
+    def chunk_digest(self, data: bytes) -> bytes:
+        """Keyed SHA-256 digest of a note chunk under the active key."""
+        self._require_key()
+        return hmac.new(self._digest_key(self.key_id), data, hashlib.sha256).digest()
+
+    def _known_key_id(self, key_id: bytes) -> bytes:
+        if key_id not in self._master_keys and key_id not in self._master_salts:
+            raise ValueError("Unknown master key id")
+        return key_id
+
+    def _require_key(self):
+        if self.key_id is None:
+            raise ValueError("No encryption key loaded; unlock the database first.")
+
+    def _parse(self, encrypted_text: str):
+        """Split a v1 or original-format value into (key_ref, iv, ciphertext)."""
+        if encrypted_text.startswith(FORMAT_V1_PREFIX):
+            combined_data = base64.b64decode(encrypted_text[len(FORMAT_V1_PREFIX):])
+            key_id = combined_data[:KEY_ID_SIZE]
+            salt = combined_data[KEY_ID_SIZE:KEY_ID_SIZE + SALT_SIZE]
+            iv = combined_data[KEY_ID_SIZE + SALT_SIZE:KEY_ID_SIZE + SALT_SIZE + IV_SIZE]
+            ciphertext = combined_data[KEY_ID_SIZE + SALT_SIZE + IV_SIZE:]
+            return (key_id, salt), iv, ciphertext
+        # Original format: one PBKDF2 run per distinct salt
+        combined_data = base64.b64decode(encrypted_text)
+        salt = combined_data[:SALT_SIZE]
+        iv = combined_data[SALT_SIZE:SALT_SIZE + IV_SIZE]
+        ciphertext = combined_data[SALT_SIZE + IV_SIZE:]
+        return (None, salt), iv, ciphertext
+
+    def _key_for(self, key_ref) -> bytes:
+        key_id, salt = key_ref
+        if key_id is None:
+            return self._derive_key(salt)
+        return self._derive_subkey(self._known_key_id(key_id), salt)
+
+    @staticmethod
+    def _plain_bytes(plain) -> bytes:
+        """Strings are stored as UTF-8; bytes (e.g. note payloads) as given."""
+        if isinstance(plain, (bytes, bytearray, memoryview)):
+            return bytes(plain)
+        return (plain or "").encode('utf-8')
+
+    def _seal(self, aead: AESGCM, plain) -> bytes:
+        header = bytes([FORMAT_V2]) + self.key_id
+        nonce = os.urandom(NONCE_SIZE)
+        # The header is authenticated, so a record can't be relabelled to another key
+        return header + nonce + aead.encrypt(nonce, self._plain_bytes(plain), header)
+
+    def _open_v2(self, value: bytes, aeads: dict) -> bytes:
+        if len(value) < V2_HEADER_SIZE + NONCE_SIZE or value[0] != FORMAT_V2:
+            raise ValueError("Unsupported ciphertext version")
+        header = value[:V2_HEADER_SIZE]
+        key_id = header[1:]
+        aead = aeads.get(key_id)
+        if aead is None:
+            aead = aeads[key_id] = AESGCM(self._record_key(key_id))
+        nonce = value[V2_HEADER_SIZE:V2_HEADER_SIZE + NONCE_SIZE]
+        return aead.decrypt(nonce, value[V2_HEADER_SIZE + NONCE_SIZE:], header)
+
+    @staticmethod
+    def _decrypt_cbc(algorithm, iv: bytes, ciphertext: bytes) -> bytes:
+        cipher = Cipher(algorithm, modes.CBC(iv), backend=default_backend())
+        decryptor = cipher.decryptor()
+
+        decrypted_data = decryptor.update(ciphertext) + decryptor.finalize()
+        padding_length = decrypted_data[-1]
+
+        # Validate padding
+        if padding_length > 16:
+            raise ValueError("Invalid padding")
+
+        return decrypted_data[:-padding_length]
+
+    def _decrypt_value(self, encrypted_text, aeads: dict, algorithms_by_key: dict) -> bytes:
+        """Dispatch on the stored type: BLOBs are v2, text is v1 or the original format."""
+        if isinstance(encrypted_text, (bytes, bytearray, memoryview)):
+            return self._open_v2(bytes(encrypted_text), aeads)
+        key_ref, iv, ciphertext = self._parse(encrypted_text)
+        algorithm = algorithms_by_key.get(key_ref)
+        if algorithm is None:
+            algorithm = algorithms_by_key[key_ref] = algorithms.AES(self._key_for(key_ref))
+        return self._decrypt_cbc(algorithm, iv, ciphertext)
+
+    def is_current_format(self, encrypted_value) -> bool:
+        """True for v2 BLOBs sealed under the active key; anything else is rewritten."""
+        if not isinstance(encrypted_value, (bytes, bytearray, memoryview)):
+            return False
+        header = bytes(encrypted_value[:V2_HEADER_SIZE])
+        return header == bytes([FORMAT_V2]) + (self.key_id or b"")
 
     @timer
-    def encrypt_string(self, plain_text: str, critical: bool = False) -> str:
-        # Handle empty or whitespace strings
-        if not plain_text or plain_text.isspace():
-            plain_text = " "  # Use single space as minimum content
-
-        # Use pre-computed key for non-critical operations
-        if not critical:
-            salt = self._common_salt
-            key = self._common_key
-        else:
-            salt = os.urandom(16)
-            key = self._derive_key(salt)
-
-        iv = os.urandom(16)
-        cipher = Cipher(algorithms.AES(key), modes.CBC(iv), backend=default_backend())
-        encryptor = cipher.encryptor()
-
-        # Convert string to bytes and pad to block size
-        data = plain_text.encode('utf-8')
-        padding_length = 16 - (len(data) % 16)
-        padded_data = data + bytes([padding_length] * padding_length)
-
-        encrypted_data = encryptor.update(padded_data) + encryptor.finalize()
-        combined_data = salt + iv + encrypted_data
-        return base64.b64encode(combined_data).decode('utf-8')
+    def encrypt_string(self, plain_text: str, critical: bool = False) -> bytes:
+        """
+        Encrypt to the v2 binary format. critical is kept for callers written
+        against the salted formats; every v2 value already gets its own nonce.
+        """
+        self._require_key()
+        return self._seal(AESGCM(self._record_key(self.key_id)), plain_text)
 
     @timer
-    def decrypt_string(self, encrypted_text: str) -> str:
-        if not encrypted_text or encrypted_text.isspace():
+    def decrypt_string(self, encrypted_text) -> str:
+        if not encrypted_text or (isinstance(encrypted_text, str) and encrypted_text.isspace()):
             return ""
 
         try:
-            combined_data = base64.b64decode(encrypted_text)
-            salt = combined_data[:16]
-            iv = combined_data[16:32]
-            ciphertext = combined_data[32:]
-
-            key = self._derive_key(salt)
-            cipher = Cipher(algorithms.AES(key), modes.CBC(iv), backend=default_backend())
-            decryptor = cipher.decryptor()
-
-            decrypted_data = decryptor.update(ciphertext) + decryptor.finalize()
-            padding_length = decrypted_data[-1]
-            
-            # Validate padding
-            if padding_length > 16:
-                raise ValueError("Invalid padding")
-                
-            return decrypted_data[:-padding_length].decode('utf-8')
-            
+            return self._decrypt_value(encrypted_text, {}, {}).decode('utf-8')
         except Exception as e:
-            print(f"Decryption error: {str(e)}")
-            return ""  # Return empty string on error
\ No newline at end of file
+            print(f"Decryption error: {str(e) or type(e).__name__}")
+            return ""  # Return empty string on error
+
+    def encrypt_bytes(self, data: bytes) -> bytes:
+        """Encrypt a binary payload to the v2 format."""
+        self._require_key()
+        return self._seal(AESGCM(self._record_key(self.key_id)), data)
+
+    def decrypt_bytes(self, encrypted_value) -> bytes:
+        """Decrypt any stored format to the raw plaintext bytes; b"" on error."""
+        return self._decrypt_batch([encrypted_value], as_bytes=True)[0]
+
+    # BATCH OPERATIONS
+
+    def _encrypt_batch(self, plain_texts, critical=False):
+        """Encrypt in-process with one AES-GCM context for the whole batch."""
+        self._require_key()
+        aead = AESGCM(self._record_key(self.key_id))
+        return [self._seal(aead, text) for text in plain_texts]
+
+    def _upgrade_batch(self, encrypted_values):
+        """Re-encrypt in-process; see upgrade_ciphertext."""
+        self._require_key()
+        aead = AESGCM(self._record_key(self.key_id))
+        aeads = {}
+        algorithms_by_key = {}
+        results = []
+        for value in encrypted_values:
+            if not value or self.is_current_format(value) or (isinstance(value, str) and value.isspace()):
+                results.append(None)
+                continue
+            try:
+                plain = self._decrypt_value(value, aeads, algorithms_by_key)
+            except Exception as e:
+                print(f"Decryption error: {str(e) or type(e).__name__}")
+                results.append(None)
+                continue
+            # Re-sealed byte for byte, so binary payloads survive the upgrade
+            results.append(self._seal(aead, plain))
+        return results
+
+    def _decrypt_batch(self, encrypted_texts, as_bytes=False):
+        """Decrypt in-process, deriving and scheduling each key once."""
+        empty = b"" if as_bytes else ""
+        results = [empty] * len(encrypted_texts)
+        aeads = {}
+        algorithms_by_key = {}
+        for index, encrypted_text in enumerate(encrypted_texts):
+            if not encrypted_text or (isinstance(encrypted_text, str) and encrypted_text.isspace()):
+                continue
+            try:
+                plain = self._decrypt_value(encrypted_text, aeads, algorithms_by_key)
+                results[index] = plain if as_bytes else plain.decode('utf-8')
+            except Exception as e:
+                print(f"Decryption error: {str(e) or type(e).__name__}")
+        return results
+
+    @staticmethod
+    def _salt_group(encrypted_text) -> str:
+        """Cheap grouping key: the bytes or base64 characters naming the key."""
+        if not encrypted_text:
+            return ""
+        if isinstance(encrypted_text, (bytes, bytearray, memoryview)):
+            return bytes(encrypted_text[:V2_HEADER_SIZE]).hex()
+        if encrypted_text.startswith(FORMAT_V1_PREFIX):
+            return encrypted_text[:len(FORMAT_V1_PREFIX) + 24]
+        return encrypted_text[:20]
+
+    @contextmanager
+    def _borrow_pool(self):
+        """
+        Use the worker pool for one batch, starting it on first use seeded with
+        the keys held now. shutdown_pool waits until every borrowed batch is done.
+        """
+        with self._pool_state:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(
+                        self.password,
+                        dict(self._master_keys),
+                        dict(self._master_salts),
+                        self.key_id,
+                    ),
+                )
+            self._pool_batches += 1
+            pool = self._pool
+        try:
+            yield pool
+        finally:
+            with self._pool_state:
+                self._pool_batches -= 1
+                self._pool_state.notify_all()
+
+    def shutdown_pool(self):
+        """
+        Stop worker processes and drop derived keys, once batches running on
+        other threads have their results; the next large batch starts a fresh pool.
+        """
+        with self._pool_state:
+            self._pool_state.wait_for(lambda: self._pool_batches == 0)
+            pool, self._pool = self._pool, None
+            self.clear_key_caches()
+        if pool is not None:
+            pool.shutdown(wait=False)
+
+    def _use_pool(self, count: int) -> bool:
+        return self.workers > 1 and count >= self.parallel_min_items
+
+    def _chunks(self, indices):
+        chunk_count = self.workers * 4
+        size = max(1, -(-len(indices) // chunk_count))
+        return [indices[i:i + size] for i in range(0, len(indices), size)]
+
+    @timer
+    def encrypt_many(self, plain_texts, critical: bool = False):
+        """Encrypt a list of strings or bytes; large batches are spread over worker processes."""
+        plain_texts = list(plain_texts)
+        if not self._use_pool(len(plain_texts)):
+            return self._encrypt_batch(plain_texts, critical)
+
+        self._require_key()  # fail early when locked
+        chunks = self._chunks(list(range(len(plain_texts))))
+        with self._borrow_pool() as pool:
+            futures = [
+                pool.submit(_worker_encrypt, [plain_texts[i] for i in chunk], critical)
+                for chunk in chunks
+            ]
+            results = []
+            for future in futures:
+                results.extend(future.result())
+        return results
+
+    @timer
+    def upgrade_ciphertext(self, encrypted_values):
+        """
+        Re-encrypt values as v2 under the active key: older formats, and v2 values
+        sealed under a retired key. Returns a list holding the new value, or None
+        where the value is empty, already current, or can't be decrypted (those
+        are left alone rather than overwritten).
+        """
+        encrypted_values = list(encrypted_values)
+        if not self._use_pool(len(encrypted_values)):
+            return self._upgrade_batch(encrypted_values)
+
+        self._require_key()
+        order = sorted(range(len(encrypted_values)), key=lambda i: self._salt_group(encrypted_values[i]))
+        chunks = self._chunks(order)
+        results = [None] * len(encrypted_values)
+        with self._borrow_pool() as pool:
+            futures = [
+                pool.submit(_worker_upgrade, [encrypted_values[i] for i in chunk])
+                for chunk in chunks
+            ]
+            for chunk, future in zip(chunks, futures):
+                for index, value in zip(chunk, future.result()):
+                    results[index] = value
+        return results
+
+    @timer
+    def decrypt_many(self, encrypted_texts, as_bytes=False):
+        """
+        Decrypt a list of stored values. Values are grouped by salt so each key
+        is derived once per process, and large batches use worker processes.
+        Undecryptable values come back as "" like decrypt_string (b"" with
+        as_bytes, which returns the raw plaintext bytes instead of text).
+        """
+        encrypted_texts = list(encrypted_texts)
+        if not self._use_pool(len(encrypted_texts)):
+            return self._decrypt_batch(encrypted_texts, as_bytes)
+
+        order = sorted(range(len(encrypted_texts)), key=lambda i: self._salt_group(encrypted_texts[i]))
+        chunks = self._chunks(order)
+        results = [b"" if as_bytes else ""] * len(encrypted_texts)
+        with self._borrow_pool() as pool:
+            futures = [
+                pool.submit(_worker_decrypt, [encrypted_texts[i] for i in chunk], as_bytes)
+                for chunk in chunks
+            ]
+            for chunk, future in zip(chunks, futures):
+                for index, plain_text in zip(chunk, future.result()):
+                    results[index] = plain_text
+        return results
+
+
+# Worker process state: one manager per worker, so its key caches persist
+# across every chunk that worker handles.
+_worker_manager = None
+
+
+def _init_worker(password, master_keys, master_salts, key_id):
+    global _worker_manager
+    manager = EncryptionManager.__new__(EncryptionManager)
+    manager.password = password
+    manager._master_keys = master_keys
+    manager._master_salts = master_salts
+    manager.key_id = key_id
+    manager.clear_key_caches()
+    manager._pool = None
+    manager._pool_state = threading.Condition()
+    manager._pool_batches = 0
+    manager.workers = 1
+    manager.parallel_min_items = PARALLEL_CRYPTO_MIN_ITEMS
+    _worker_manager = manager
+
+
+def _worker_encrypt(plain_texts, critical):
+    return _worker_manager._encrypt_batch(plain_texts, critical)
+
+
+def _worker_decrypt(encrypted_texts, as_bytes):
+    return _worker_manager._decrypt_batch(encrypted_texts, as_bytes)
+
+
+def _worker_upgrade(encrypted_values):
+    return _worker_manager._upgrade_batch(encrypted_values)
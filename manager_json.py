@@ -57,8 +57,6 @@ def load_from_json_file(cursor, db_handler, refresh_tree_callback=None):
     if not file_path:
         return
 
-    sections_added = 0
-    
     try:
         confirm = messagebox.askyesno(
             "Preload Warning",
@@ -73,9 +71,6 @@ def load_from_json_file(cursor, db_handler, refresh_tree_callback=None):
         # Validate schema
         validate_json_schema(data)
 
-        # Start transaction
-        cursor.execute("BEGIN")
-        
         def get_section_type(level):
             if level == 1:
                 return "header"
@@ -86,39 +81,32 @@ def load_from_json_file(cursor, db_handler, refresh_tree_callback=None):
             else:
                 return "subheader"
 
-        def process_node(node, parent_id=None, level=1, placement=1):
-            try:
-                title = node.get("name", "")
-                if not title:
-                    return
-                    
-                section_type = get_section_type(level)
-                nonlocal sections_added
-                try:
-                    section_id = db_handler.add_section(title, section_type, parent_id, placement)
-                    sections_added += 1
-                except Exception as e:
-                    print(f"Error adding section '{title}': {e}")
-                    raise ValueError(f"Failed to add section '{title}': {e}")
+        # Flatten the outline parents-first; a child refers to its parent's
+        # row as -n (see add_sections_bulk) and is appended after existing siblings
+        rows = []
 
-                # Process next level
-                next_level_key = f"h{level+1}"
-                children_key = "children"
-                children = node.get(next_level_key, node.get(children_key, []))
-                
-                for idx, child in enumerate(children, start=1):
-                    if isinstance(child, dict):
-                        process_node(child, section_id, level+1, idx)
-                        
-            except Exception as e:
-                print(f"Error processing node: {e}")
-                raise
+        def process_node(node, parent_ref=None, level=1):
+            title = node.get("name", "")
+            if not title:
+                return
+            rows.append((title, get_section_type(level), parent_ref, None))
+            row_ref = -len(rows)
+
+            # Process next level
+            next_level_key = f"h{level+1}"
+            children_key = "children"
+            children = node.get(next_level_key, node.get(children_key, []))
+            
+            for child in children:
+                if isinstance(child, dict):
+                    process_node(child, row_ref, level+1)
 
         # Process root level
-        for idx, h1_item in enumerate(data.get("h1", []), start=1):
-            process_node(h1_item, None, 1, idx)
+        for h1_item in data.get("h1", []):
+            process_node(h1_item, None, 1)
 
-        db_handler.conn.commit()
+        # One transaction for the whole import
+        sections_added = len(db_handler.add_sections_bulk(rows))
         messagebox.showinfo("Success", f"Successfully imported {sections_added} sections from {file_path}")
         
         if refresh_tree_callback:
@@ -129,9 +117,7 @@ def load_from_json_file(cursor, db_handler, refresh_tree_callback=None):
     except ValueError as ve:
         messagebox.showerror("Error", f"Schema validation error: {str(ve)}")
     except Exception as e:
-        if db_handler and db_handler.conn:
-            db_handler.conn.rollback()
-        messagebox.showerror("Error", f"Failed to import JSON: {str(e)}.\nSuccessfully imported {sections_added} sections before error.")
+        messagebox.showerror("Error", f"Failed to import JSON: {str(e)}.\nThe import was rolled back; no sections were added.")
         print(f"Detailed error: {e}")
 
 if __name__ == "__main__":
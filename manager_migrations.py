@@ -0,0 +1,221 @@
+import sqlite3
+
+from utility import timer
+
+# Schema migrations, applied in order and recorded in PRAGMA user_version.
+# A database at SCHEMA_VERSION is opened with that one pragma read; anything
+# older runs the missing steps in one transaction. Databases made before
+# user_version was kept start at 0 and may already have any part of the
+# schema, so every step is written to be safe to run again. Append new steps;
+# never edit or reorder one that has shipped.
+
+
+def _core_tables(db):
+    """Sections (the tree only; notes are in section_content) and settings."""
+    db.cursor.execute("""
+        CREATE TABLE IF NOT EXISTS sections (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            parent_id INTEGER,
+            title TEXT DEFAULT '',
+            type TEXT,
+            placement INTEGER NOT NULL CHECK(placement > 0),
+            path TEXT,
+            depth INTEGER
+        )
+    """)
+    db.cursor.execute("""
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    """)
+
+
+def _tree_index(db):
+    """
+    Materialized path index: path is "/<root id>/.../<id>/" and depth counts
+    its ids, so a subtree is one range scan on idx_sections_path and the
+    ancestors are in the path itself. Triggers keep both current for every
+    insert and move, whichever code path makes it.
+    """
+    db.cursor.execute("PRAGMA table_info(sections)")
+    if "path" not in {row[1] for row in db.cursor.fetchall()}:
+        db.cursor.execute("ALTER TABLE sections ADD COLUMN path TEXT")
+        db.cursor.execute("ALTER TABLE sections ADD COLUMN depth INTEGER")
+        db._rebuild_tree_index()
+
+    db.cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_sections_path
+        ON sections(path)
+    """)
+
+    db.cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS tree_index_insert
+        AFTER INSERT ON sections
+        FOR EACH ROW
+        BEGIN
+            UPDATE sections
+            SET path = COALESCE((SELECT path FROM sections WHERE id = NEW.parent_id), '/') || NEW.id || '/',
+                depth = COALESCE((SELECT depth FROM sections WHERE id = NEW.parent_id), 0) + 1
+            WHERE id = NEW.id;
+        END;
+    """)
+
+    db.cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS tree_index_move
+        AFTER UPDATE OF parent_id ON sections
+        FOR EACH ROW
+        WHEN NEW.parent_id IS NOT OLD.parent_id
+        BEGIN
+            UPDATE sections
+            SET path = COALESCE((SELECT path FROM sections WHERE id = NEW.parent_id), '/')
+                       || NEW.id || '/' || substr(path, length(OLD.path) + 1),
+                depth = depth - OLD.depth
+                        + COALESCE((SELECT depth FROM sections WHERE id = NEW.parent_id), 0) + 1
+            WHERE path >= OLD.path AND path < substr(OLD.path, 1, length(OLD.path) - 1) || '0';
+        END;
+    """)
+
+
+def _note_table(db):
+    """
+    Notes, 1:1 with sections and read only by the editor, search and exports,
+    so structural scans read small rows. Databases that kept notes inline in
+    sections move them out.
+    """
+    db.cursor.execute("""
+        CREATE TABLE IF NOT EXISTS section_content (
+            section_id INTEGER PRIMARY KEY,
+            questions BLOB
+        )
+    """)
+
+    db.cursor.execute("PRAGMA table_info(sections)")
+    if "questions" in {row[1] for row in db.cursor.fetchall()}:
+        db.cursor.execute("""
+            INSERT OR IGNORE INTO section_content (section_id, questions)
+            SELECT id, questions FROM sections
+        """)
+        if sqlite3.sqlite_version_info >= (3, 35, 0):
+            db.cursor.execute("ALTER TABLE sections DROP COLUMN questions")
+        else:
+            # No DROP COLUMN before SQLite 3.35; empty it so the blobs' pages are freed
+            db.cursor.execute("UPDATE sections SET questions = NULL WHERE questions IS NOT NULL")
+
+    db.cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS delete_section_content
+        AFTER DELETE ON sections
+        FOR EACH ROW
+        BEGIN
+            DELETE FROM section_content WHERE section_id = OLD.id;
+        END;
+    """)
+
+
+def _structure_version(db):
+    """
+    Structure version: bumped by triggers whenever a section is inserted,
+    deleted, moved or reordered; keys the numbering cache.
+    """
+    db.cursor.execute("""
+        CREATE TABLE IF NOT EXISTS structure_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+    """)
+    db.cursor.execute("INSERT OR IGNORE INTO structure_version (id, version) VALUES (1, 0)")
+    for name, event in [
+        ("structure_version_insert", "AFTER INSERT ON sections"),
+        ("structure_version_delete", "AFTER DELETE ON sections"),
+        ("structure_version_move", "AFTER UPDATE OF parent_id, placement ON sections"),
+    ]:
+        db.cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {name}
+            {event}
+            BEGIN
+                UPDATE structure_version SET version = version + 1;
+            END;
+        """)
+
+
+def _note_chunks(db):
+    """
+    Chunks of large notes, shared by digest within a section; the section's
+    section_content row lists them in order (see manager_notes).
+    """
+    db.cursor.execute("""
+        CREATE TABLE IF NOT EXISTS section_chunks (
+            section_id INTEGER NOT NULL,
+            digest BLOB NOT NULL,
+            data BLOB NOT NULL,
+            PRIMARY KEY (section_id, digest)
+        )
+    """)
+    db.cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS delete_section_chunks
+        AFTER DELETE ON sections
+        FOR EACH ROW
+        BEGIN
+            DELETE FROM section_chunks WHERE section_id = OLD.id;
+        END;
+    """)
+
+
+def _sibling_index(db):
+    """
+    Sibling lists in order. One full index serves both roots and children:
+    "parent_id IS ?" with a NULL parameter can't use a partial index (the old
+    idx_sections_tree/idx_sections_root pair), and nothing filters on type
+    alone (idx_sections_type). tests/test_query_plans.py checks every
+    statement's plan against these indexes. Placements are gap-spaced
+    (PLACEMENT_GAP), so a delete leaves a gap instead of shifting every later
+    sibling; the trigger that shifted them goes.
+    """
+    for name in ("idx_sections_tree", "idx_sections_root", "idx_sections_type"):
+        db.cursor.execute(f"DROP INDEX IF EXISTS {name}")
+    db.cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_sections_parent
+        ON sections(parent_id, placement)
+    """)
+    db.cursor.execute("DROP TRIGGER IF EXISTS maintain_placement_delete")
+
+
+# (version, step, changes tables or indexes the planner has statistics for)
+MIGRATIONS = [
+    (1, _core_tables, False),
+    (2, _tree_index, True),
+    (3, _note_table, True),
+    (4, _structure_version, False),
+    (5, _note_chunks, False),
+    (6, _sibling_index, True),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(cursor):
+    cursor.execute("PRAGMA user_version")
+    return cursor.fetchone()[0]
+
+
+@timer
+def migrate(db):
+    """
+    Apply the migrations db is missing, then ANALYZE if any of them changed
+    tables or indexes. Returns the versions applied; [] for a current database
+    (or one written by a newer version, which is left as it is).
+    """
+    version = schema_version(db.cursor)
+    pending = [migration for migration in MIGRATIONS if migration[0] > version]
+    if not pending:
+        return []
+
+    # Persistent in the file, and can't change inside a transaction
+    db.cursor.execute("PRAGMA journal_mode=WAL")
+    with db.transaction():
+        for number, step, _ in pending:
+            step(db)
+        if any(structural for _, _, structural in pending):
+            db.cursor.execute("ANALYZE")
+        # Part of the transaction: a failed step leaves the version where it was
+        db.cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    return [number for number, _, _ in pending]
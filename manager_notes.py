@@ -0,0 +1,116 @@
+import json
+import zlib
+
+from config import (
+    NOTE_COMPRESS_MIN_BYTES,
+    NOTE_CHUNK_MIN_BYTES,
+    NOTE_CHUNK_MAX_BYTES,
+    NOTE_CHUNK_BOUNDARY_MODULUS,
+)
+
+# Note payload v2, the plaintext that gets encrypted for the questions column:
+#   0x00 | UTF-8 text
+#   0x01 | zlib-compressed UTF-8 text
+#   0x02 | chunk digests, 32 bytes each, in note order (see split_note)
+# Notes written before v2 are a JSON list of lines with no marker byte; they
+# start with "[" and are still read.
+NOTE_RAW = 0x00
+NOTE_ZLIB = 0x01
+NOTE_CHUNKED = 0x02
+CHUNK_DIGEST_SIZE = 32
+
+
+def pack_bytes(data: bytes) -> bytes:
+    """Prefix data with NOTE_RAW, or compress it when that saves space."""
+    if len(data) >= NOTE_COMPRESS_MIN_BYTES:
+        compressed = zlib.compress(data, 6)
+        # Only worth the decompression cost if it saves a real fraction
+        if len(compressed) < len(data) * 0.9:
+            return bytes([NOTE_ZLIB]) + compressed
+    return bytes([NOTE_RAW]) + data
+
+
+def unpack_bytes(payload: bytes) -> bytes:
+    """Inverse of pack_bytes."""
+    marker = payload[0]
+    if marker == NOTE_RAW:
+        return payload[1:]
+    if marker == NOTE_ZLIB:
+        return zlib.decompress(payload[1:])
+    raise ValueError(f"Unknown payload marker: {marker}")
+
+
+def encode_note(text: str) -> bytes:
+    """Build the payload for a note, compressing it when that saves space."""
+    return pack_bytes((text or "").encode('utf-8'))
+
+
+def decode_note(payload: bytes) -> str:
+    """Return the note text from any single-value payload version."""
+    if not payload:
+        return ""
+    marker = payload[0]
+    if marker in (NOTE_RAW, NOTE_ZLIB):
+        return unpack_bytes(payload).decode('utf-8')
+    if marker == NOTE_CHUNKED:
+        raise ValueError("Chunked note: its text is in section_chunks")
+
+    # Pre-v2: JSON list of lines
+    text = payload.decode('utf-8')
+    try:
+        lines = json.loads(text)
+    except json.JSONDecodeError:
+        return text
+    if isinstance(lines, list):
+        return "\n".join(str(line) for line in lines)
+    return text
+
+
+def is_chunked(payload: bytes) -> bool:
+    return bool(payload) and payload[0] == NOTE_CHUNKED
+
+
+def encode_manifest(digests) -> bytes:
+    """Payload for a chunked note: the ordered list of its chunk digests."""
+    return bytes([NOTE_CHUNKED]) + b"".join(digests)
+
+
+def manifest_digests(payload: bytes) -> list:
+    body = payload[1:]
+    if len(body) % CHUNK_DIGEST_SIZE:
+        raise ValueError("Truncated chunk manifest")
+    return [body[i:i + CHUNK_DIGEST_SIZE] for i in range(0, len(body), CHUNK_DIGEST_SIZE)]
+
+
+def split_note(data: bytes) -> list:
+    """
+    Split UTF-8 note bytes into content-defined chunks. Once a chunk holds
+    NOTE_CHUNK_MIN_BYTES it ends after the next line whose CRC is a multiple of
+    NOTE_CHUNK_BOUNDARY_MODULUS, so boundaries depend only on nearby lines and
+    an edit changes one or two chunks while the rest keep their digests.
+    Runs longer than NOTE_CHUNK_MAX_BYTES are cut where they reach it.
+    """
+    chunks = []
+    current = []
+    size = 0
+    for line in data.splitlines(keepends=True):
+        while size + len(line) > NOTE_CHUNK_MAX_BYTES:
+            take = NOTE_CHUNK_MAX_BYTES - size
+            current.append(line[:take])
+            chunks.append(b"".join(current))
+            current, size, line = [], 0, line[take:]
+        current.append(line)
+        size += len(line)
+        if size >= NOTE_CHUNK_MIN_BYTES and zlib.crc32(line) % NOTE_CHUNK_BOUNDARY_MODULUS == 0:
+            chunks.append(b"".join(current))
+            current, size = [], 0
+    if size:
+        chunks.append(b"".join(current))
+    return chunks
+
+
+def note_lines(text: str) -> list:
+    """Split note text into lines for the exporters; an empty note has none."""
+    if not text or not text.strip():
+        return []
+    return text.split("\n")
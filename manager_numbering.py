@@ -0,0 +1,128 @@
+from utility import timer
+
+
+class NumberingService:
+    """
+    Outline numbers ("1", "1.2", "1.2.3") kept current incrementally. Each
+    mutation re-reads only the sibling list it touched and renumbers the
+    subtrees of siblings whose number changed; it returns a diff
+    {section_id: new number, or None once removed} for the tree view to apply.
+    """
+
+    def __init__(self, db_handler):
+        self.db = db_handler
+        self.numbers = {}
+        self._children = {}  # parent id (None for roots) -> child ids in order
+        self._parents = {}
+        self.version = None  # structure version the numbers were computed at
+
+    def _read_children(self, parent_id):
+        self.db.cursor.execute(
+            "SELECT id FROM sections WHERE parent_id IS ? ORDER BY placement, id",
+            (parent_id,)
+        )
+        return [row[0] for row in self.db.cursor.fetchall()]
+
+    def _renumber(self, parent_id, diff):
+        """Number parent_id's children, descending only where a number changed."""
+        stack = [parent_id]
+        while stack:
+            current_id = stack.pop()
+            prefix = f"{self.numbers[current_id]}." if current_id is not None else ""
+            for index, child_id in enumerate(self._children.get(current_id, ()), start=1):
+                number = f"{prefix}{index}"
+                if self.numbers.get(child_id) != number:
+                    self.numbers[child_id] = number
+                    diff[child_id] = number
+                    stack.append(child_id)
+
+    def _reload_siblings(self, parent_id):
+        child_ids = self._read_children(parent_id)
+        for child_id in child_ids:
+            self._parents[child_id] = parent_id
+        self._children[parent_id] = child_ids
+
+    def _forget_subtree(self, section_id, diff):
+        stack = [section_id]
+        while stack:
+            current_id = stack.pop()
+            stack.extend(self._children.pop(current_id, ()))
+            self._parents.pop(current_id, None)
+            if self.numbers.pop(current_id, None) is not None:
+                diff[current_id] = None
+
+    def _is_known(self, *parent_ids):
+        return self.version is not None and all(
+            parent_id is None or parent_id in self.numbers for parent_id in parent_ids
+        )
+
+    def _finish(self, diff):
+        self.version = self.db.structure_version()
+        return diff
+
+    def children(self, parent_id):
+        """Child ids of parent_id in outline order, as last read."""
+        return list(self._children.get(parent_id, ()))
+
+    @timer
+    def rebuild(self):
+        """Number the whole tree from one query; returns the diff against the old numbers."""
+        # Sibling order is all that matters; (parent_id, placement, id) is index order
+        self.db.cursor.execute("SELECT id, parent_id FROM sections ORDER BY parent_id, placement, id")
+        children = {}
+        parents = {}
+        for section_id, parent_id in self.db.cursor.fetchall():
+            children.setdefault(parent_id, []).append(section_id)
+            parents[section_id] = parent_id
+
+        old_numbers = self.numbers
+        self.numbers, self._children, self._parents = {}, children, parents
+        self._renumber(None, {})
+
+        diff = {
+            section_id: number for section_id, number in self.numbers.items()
+            if old_numbers.get(section_id) != number
+        }
+        diff.update({section_id: None for section_id in old_numbers if section_id not in self.numbers})
+        return self._finish(diff)
+
+    def sync(self):
+        """Catch up with changes the service wasn't told about; free if there were none."""
+        if self.version is not None and self.db.structure_version() == self.version:
+            return {}
+        return self.rebuild()
+
+    def inserted(self, section_id, parent_id):
+        """A section was added under parent_id."""
+        return self.reordered(parent_id)
+
+    def reordered(self, parent_id):
+        """The children of parent_id changed order (or gained a member)."""
+        if not self._is_known(parent_id):
+            return self.rebuild()
+        diff = {}
+        self._reload_siblings(parent_id)
+        self._renumber(parent_id, diff)
+        return self._finish(diff)
+
+    def deleted(self, section_id):
+        """A section and its descendants were deleted."""
+        if section_id not in self._parents or not self._is_known():
+            return self.rebuild()
+        parent_id = self._parents[section_id]
+        diff = {}
+        self._forget_subtree(section_id, diff)
+        if self._is_known(parent_id):
+            self._reload_siblings(parent_id)
+            self._renumber(parent_id, diff)
+        return self._finish(diff)
+
+    def reparented(self, section_id, old_parent_id, new_parent_id):
+        """A section moved from old_parent_id to new_parent_id, keeping its subtree."""
+        if not self._is_known(old_parent_id, new_parent_id):
+            return self.rebuild()
+        diff = {}
+        for parent_id in (old_parent_id, new_parent_id):
+            self._reload_siblings(parent_id)
+            self._renumber(parent_id, diff)
+        return self._finish(diff)
@@ -96,17 +96,15 @@ class SettingsTab:
 
             if missing_settings:
                 print(f"Adding missing settings: {', '.join(missing_settings.keys())}")
-                self.db.cursor.execute("BEGIN")
                 try:
-                    for key, value in missing_settings.items():
-                        self.db.cursor.execute(
-                            "INSERT INTO settings (key, value) VALUES (?, ?)",
-                            (key, str(value))
-                        )
-                    self.db.conn.commit()
+                    with self.db.transaction():
+                        for key, value in missing_settings.items():
+                            self.db.cursor.execute(
+                                "INSERT INTO settings (key, value) VALUES (?, ?)",
+                                (key, str(value))
+                            )
                     print("Successfully added missing settings")
                 except Exception as e:
-                    self.db.conn.rollback()
                     print(f"Error adding settings: {e}")
                     raise
 
@@ -116,25 +114,21 @@ class SettingsTab:
             
             if empty_settings:
                 print(f"Updating empty settings: {', '.join(empty_settings)}")
-                self.db.cursor.execute("BEGIN")
                 try:
-                    for key in empty_settings:
-                        if key in required_settings:
-                            self.db.cursor.execute(
-                                "UPDATE settings SET value = ? WHERE key = ?",
-                                (str(required_settings[key]), key)
-                            )
-                    self.db.conn.commit()
+                    with self.db.transaction():
+                        for key in empty_settings:
+                            if key in required_settings:
+                                self.db.cursor.execute(
+                                    "UPDATE settings SET value = ? WHERE key = ?",
+                                    (str(required_settings[key]), key)
+                                )
                     print("Successfully updated empty settings")
                 except Exception as e:
-                    self.db.conn.rollback()
                     print(f"Error updating settings: {e}")
                     raise
 
         except Exception as e:
             print(f"Error verifying settings: {e}")
-            if self.db:
-                self.db.conn.rollback()
 
     def _on_mousewheel(self, event):
         self.canvas.yview_scroll(int(-1*(event.delta/120)), "units")
@@ -423,16 +417,14 @@ class SettingsTab:
                 # If there are new defaults not in the database, save them
                 if not db_settings:  # First time setup
                     try:
-                        self.db.cursor.execute("BEGIN")
-                        for key, value in default_settings.items():
-                            self.db.cursor.execute(
-                                "INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
-                                (key, str(value))
-                            )
-                        self.db.conn.commit()
+                        with self.db.transaction():
+                            for key, value in default_settings.items():
+                                self.db.cursor.execute(
+                                    "INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
+                                    (key, str(value))
+                                )
                         print("Default settings initialized in database")
                     except Exception as e:
-                        self.db.conn.rollback()
                         print(f"Error saving default settings: {e}")
 
         except Exception as e:
@@ -494,18 +486,13 @@ class SettingsTab:
             return
             
         try:
-            # Start transaction
-            self.db.cursor.execute("BEGIN")
-            
-            # Update or insert each setting
-            for key, value in values.items():
-                self.db.cursor.execute(
-                    "INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
-                    (key, str(value))
-                )
-            
-            # Commit changes
-            self.db.conn.commit()
+            # Update or insert each setting in one transaction
+            with self.db.transaction():
+                for key, value in values.items():
+                    self.db.cursor.execute(
+                        "INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
+                        (key, str(value))
+                    )
             
             # Get reference to main app instance
             main_app = self.parent.master
@@ -538,7 +525,6 @@ class SettingsTab:
             self.changes_made = False
             
         except Exception as e:
-            self.db.conn.rollback()
             messagebox.showerror("Error", f"Failed to save settings: {str(e)}")
 
     def reset_to_defaults(self):
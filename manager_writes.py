@@ -0,0 +1,94 @@
+import threading
+
+from config import WRITE_BEHIND_DELAY_MS, WRITE_BEHIND_MAX_PENDING, WRITE_BEHIND_RETRY_MAX_MS
+from utility import timer
+
+
+class WriteBehindQueue:
+    """
+    Title/note saves from the editor, held briefly and written in groups.
+    Saving the same section again before a flush replaces its pending values,
+    and a flush writes everything pending in one transaction (one commit).
+    While a save is pending, reads through the DatabaseHandler (decrypt_column,
+    iter_note) return the pending text, so the UI never sees stale values.
+
+    Without a scheduler every save is written at once. The app sets one
+    (e.g. root.after) so flushes run on a short timer instead; anything that
+    reads ciphertext directly, exports, closes or switches databases flushes
+    first. A scheduled flush that fails keeps its saves pending, is tried
+    again after doubling delays (up to WRITE_BEHIND_RETRY_MAX_MS) and is
+    reported to on_error, so the app can tell the user.
+
+    Saves and flushes happen on the Tk thread, but pending() is also called by
+    background readers (prefetch), so the pending map is only touched under
+    _lock, and a save stays visible there until its commit.
+    """
+
+    def __init__(self, db_handler, scheduler=None):
+        self.db = db_handler
+        self.scheduler = scheduler  # scheduler(delay_ms, callback), like Tk's after
+        self.on_error = None  # on_error(exception), called when a scheduled flush fails
+        self._pending = {}  # section id -> (title, questions), in first-save order
+        self._lock = threading.Lock()
+        self._flush_scheduled = False
+        self._retry_delay = WRITE_BEHIND_DELAY_MS
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+
+    def save(self, section_id, title, questions):
+        """Queue a section's title and note; replaces anything already pending for it."""
+        with self._lock:
+            self._pending[section_id] = (title, questions)
+            count = len(self._pending)
+        if self.scheduler is None or count >= WRITE_BEHIND_MAX_PENDING:
+            self.flush()
+        elif not self._flush_scheduled:
+            self._flush_scheduled = True
+            self.scheduler(WRITE_BEHIND_DELAY_MS, self._scheduled_flush)
+
+    def pending(self, section_id):
+        """The (title, questions) waiting to be written for a section, or None."""
+        with self._lock:
+            return self._pending.get(section_id)
+
+    def discard(self, section_ids):
+        """Forget pending saves for sections that no longer exist."""
+        with self._lock:
+            for section_id in section_ids:
+                self._pending.pop(section_id, None)
+
+    @timer
+    def flush(self):
+        """Write every pending save in one transaction; returns the number written."""
+        with self._lock:
+            batch = dict(self._pending)
+        if not batch:
+            return 0
+        with self.db.transaction():
+            for section_id, (title, questions) in batch.items():
+                self.db.update_section(section_id, title, questions)
+        # Committed: drop what was written, keeping anything saved again meanwhile
+        with self._lock:
+            for section_id, values in batch.items():
+                if self._pending.get(section_id) is values:
+                    del self._pending[section_id]
+        return len(batch)
+
+    def _scheduled_flush(self):
+        self._flush_scheduled = False
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"Error writing pending saves: {e}")
+            # Nothing was committed, so the saves are still pending; back off
+            # while the cause (a locked database, a lost key) persists
+            self._retry_delay = min(self._retry_delay * 2, WRITE_BEHIND_RETRY_MAX_MS)
+            if self.scheduler is not None and not self._flush_scheduled and len(self):
+                self._flush_scheduled = True
+                self.scheduler(self._retry_delay, self._scheduled_flush)
+            if self.on_error:
+                self.on_error(e)
+        else:
+            self._retry_delay = WRITE_BEHIND_DELAY_MS
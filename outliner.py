@@ -1,3 +1,4 @@
+import os
 import sys
 import time
 import ttkbootstrap as ttk
@@ -39,6 +40,8 @@ from config import (
     PASSWORD_MIN_LENGTH,
     WARNING_LIMIT_ITEM_COUNT,
     WARNING_DISPLAY_TIME_MS,
+    REENCRYPT_INTERVAL_MS,
+    BACKUP_POLL_MS,
     TIMER_ENABLED,
     MIN_TIME_IN_MS_THRESHOLD,
     MAX_TIME_IN_MS_THRESHOLD
@@ -118,6 +121,7 @@ class OutLineEditorApp:
         self._selection_binding = None  # Store the event binding
         self.last_selected_item_id = None
         self.previous_item_id = None  # Track the previously selected item
+        self.tree_titles = {}  # section id -> title as shown, without its number
 
         # Set global font scaling using tkinter.font
         default_font = tkFont.nametofont("TkDefaultFont")
@@ -193,15 +197,27 @@ class OutLineEditorApp:
         # Assign the encryption manager to the database
         self.db.encryption_manager = self.encryption_manager
 
-        # Ensure the database is initialized properly
+        # Editor saves are queued and written in groups on a short timer
+        self.db.writes.scheduler = self.root.after
+        self.db.writes.on_error = self.handle_write_error
+
+        # Ensure the database is initialized properly; the tree is only
+        # checked (and repaired) after an upgrade or an unclean exit
         self.db.setup_database()
-        self.db.initialize_placement()
+        self.db.ensure_tree_integrity()
         
         # State to track the last selected item
         self.last_selected_item_id = None
 
         # Load initial data into the editor
         self.load_from_database()
+
+        # Decrypt titles and notes on a worker thread so the first search is fast
+        if self.is_authenticated:
+            self.db.prefetch()
+
+        # Finish any pending re-encryption (format upgrades, key rotation) while idle
+        self.schedule_reencryption()
         
         # Update title with database info
         self.update_title()
@@ -292,14 +308,46 @@ class OutLineEditorApp:
         if selected_id:
             self.select_item(f"I{selected_id}")
 
+        self.update_cache_stats()
+
+    def update_cache_stats(self):
+        """Show plaintext cache usage on the Database tab."""
+        stats = self.db.cache_stats()
+        self.cache_stats_label.config(
+            text=(
+                f"Decrypted cache: {stats['entries']} items, "
+                f"{stats['bytes'] / 1024:.0f} of {stats['max_bytes'] / 1024:.0f} KB, "
+                f"hit rate {stats['hit_rate']:.0%} "
+                f"({stats['hits']} hits, {stats['misses']} misses, {stats['evictions']} evicted)"
+            )
+        )
+
     def handle_authentication_failure(self, message="Authentication failed"):
         """Handle failed authentication attempts."""
         self.is_authenticated = False
         self.password_validated = False
+        if self.encryption_manager:
+            self.encryption_manager.lock()  # shared with self.db; its keys go too
         self.encryption_manager = None
         messagebox.showerror("Authentication Error", message)
         self.set_ui_state(False)
 
+    def handle_write_error(self, error):
+        """
+        Report a failed write of queued editor saves. They stay queued and are
+        retried; a failure to encrypt them locks the UI like a bad password.
+        """
+        if not self.is_authenticated:
+            return  # already locked; the retries stay quiet until unlocked
+        if isinstance(error, sqlite3.Error):
+            messagebox.showerror(
+                "Error",
+                f"Failed to save changes: {error}\nThey are kept and will be retried."
+            )
+        else:
+            print(f"Encryption Error: {error}")
+            self.handle_authentication_failure("Encryption failed. Please verify your password.")
+
     @timer
     def set_ui_state(self, enabled):
         """Enable or disable UI elements based on authentication state."""
@@ -352,8 +400,10 @@ class OutLineEditorApp:
                         self.root.destroy()  # Close the main window
                         sys.exit()  # Terminate the application completely
 
-                if self.db.validate_password(password):
-                    self.encryption_manager = EncryptionManager(password=password)
+                manager = self.db.unlock(password)
+                if manager:
+                    # Share the unlocked manager; no further key derivation
+                    self.encryption_manager = manager
                     break
                 else:
                     messagebox.showerror(
@@ -386,7 +436,7 @@ class OutLineEditorApp:
                         
                 password, confirm = result
                 self.db.set_password(password)
-                self.encryption_manager = EncryptionManager(password=password)
+                self.encryption_manager = self.db.encryption_manager
                 messagebox.showinfo("Success", "Password has been set.")
                 break
 
@@ -420,13 +470,21 @@ class OutLineEditorApp:
             return
             
         new_password, _ = result
+
+        rotate_key = messagebox.askyesno(
+            "Re-encrypt Database?",
+            "Also re-encrypt all data under a new key?\n\n"
+            "Do this if the old password may be compromised. It runs in the "
+            "background and removes any other passwords on this database."
+        )
         
         try:
-            self.db.change_password(current_password, new_password)
-            self.encryption_manager = EncryptionManager(new_password)
+            self.db.change_password(current_password, new_password, rotate_key=rotate_key)
+            self.encryption_manager = self.db.encryption_manager
             self.is_authenticated = True
             self.password_validated = True
             self.set_ui_state(True)
+            self.schedule_reencryption()
             messagebox.showinfo("Success", "Password changed successfully.")
         except Exception as e:
             self.handle_authentication_failure(f"Failed to change password: {e}")
@@ -517,10 +575,7 @@ class OutLineEditorApp:
                 parent_id=parent_id,  # Pass parent_id directly
                 title_prefix=title_prefix
             )
-            if section_id:
-                self.refresh_tree()
-                self.select_item(f"I{section_id}")
-            else:
+            if not section_id:
                 raise ValueError("Database operation failed.")
         except Exception as e:
             messagebox.showerror("Error", f"Failed to add the section: {e}")
@@ -545,87 +600,9 @@ class OutLineEditorApp:
         parent_id = self.get_item_id(parent_node) if parent_node else None
         
         try:
-            # Get the source section's type and title
-            self.db.cursor.execute(
-                "SELECT type, title, questions FROM sections WHERE id = ?", 
-                (source_id,)
-            )
-            section_type, encrypted_title, encrypted_questions = self.db.cursor.fetchone()
-            original_title = self.db.decrypt_safely(encrypted_title)
-            
-            # Create the cloned parent section
-            cloned_title = f"{original_title}-Cloned"
-            
-            # Get the placement for the new section
-            self.db.cursor.execute(
-                """
-                SELECT COALESCE(MAX(placement), 0) + 1
-                FROM sections
-                WHERE parent_id IS ?
-                """,
-                (parent_id,)
-            )
-            next_placement = self.db.cursor.fetchone()[0]
-            
-            # Add the cloned parent section
-            new_parent_id = self.db.add_section(
-                cloned_title,
-                section_type,
-                parent_id,
-                next_placement
-            )
-
-            # If cloning content, update the questions for the new section
-            if clone_content and encrypted_questions:
-                self.db.cursor.execute(
-                    "UPDATE sections SET questions = ? WHERE id = ?",
-                    (encrypted_questions, new_parent_id)
-                )
-
-            # Recursively clone children
-            def clone_children(source_parent_id, new_parent_id):
-                """
-                source_parent_id: The ID of the original section whose children we're cloning
-                new_parent_id: The ID of the new cloned parent where children will be attached
-                """
-                self.db.cursor.execute(
-                    """
-                    SELECT id, title, type, placement, questions 
-                    FROM sections 
-                    WHERE parent_id = ? 
-                    ORDER BY placement
-                    """,
-                    (source_parent_id,)
-                )
-                children = self.db.cursor.fetchall()
-                
-                for idx, (child_id, encrypted_title, child_type, _, encrypted_questions) in enumerate(children, 1):
-                    # Decrypt the child's title
-                    child_title = self.db.decrypt_safely(encrypted_title)
-                    
-                    # Add the cloned child with incremental placement
-                    new_child_id = self.db.add_section(
-                        child_title,  # Keep original title for children
-                        child_type,
-                        new_parent_id,
-                        idx  # Use enumerated index for placement
-                    )
-                    
-                    # If cloning content, update the questions for the new child
-                    if clone_content and encrypted_questions:
-                        self.db.cursor.execute(
-                            "UPDATE sections SET questions = ? WHERE id = ?",
-                            (encrypted_questions, new_child_id)
-                        )
-                    
-                    # Recursively clone this child's children
-                    clone_children(child_id, new_child_id)
-
-            # Start the recursive cloning
-            clone_children(source_id, new_parent_id)
-            
-            # Commit all changes
-            self.db.conn.commit()
+            # Copies rows and ciphertext in SQL; only the new root title is encrypted
+            new_parent_id = self.db.clone_subtree(source_id, parent_id, with_content=clone_content)
+            original_title = self.db.get_section_title(source_id)
             
             # Refresh the tree and select the new cloned section
             self.refresh_tree()
@@ -643,21 +620,11 @@ class OutLineEditorApp:
                 "Error",
                 f"Failed to clone section: {str(e)}"
             )
-            self.db.conn.rollback()
 
     def count_all_children(self, node_id):
         """Count total number of children recursively."""
         try:
-            return self.db.cursor.execute("""
-                WITH RECURSIVE descendants AS (
-                    SELECT id FROM sections WHERE parent_id = ?
-                    UNION ALL
-                    SELECT s.id 
-                    FROM sections s
-                    INNER JOIN descendants d ON s.parent_id = d.id
-                )
-                SELECT COUNT(*) FROM descendants
-            """, (node_id,)).fetchone()[0]
+            return self.db.count_descendants(node_id)
         except Exception as e:
             print(f"Error counting children: {e}")
             return 0
@@ -710,8 +677,7 @@ class OutLineEditorApp:
                 self.tree.item(node, open=False)
                 
             # Calculate numbering once at the end
-            numbering_dict = self.db.generate_numbering()
-            self.calculate_numbering(numbering_dict)
+            self.refresh_numbering()
             
             # Force a visual update
             self.tree.update()
@@ -903,6 +869,10 @@ class OutLineEditorApp:
         ttk.Label(self.database_frame, text="Use the buttons below for database actions.", font=GLOBAL_FONT).grid(
             row=1, column=0, sticky="w", padx=label_padx, pady=label_pady
         )
+        self.cache_stats_label = ttk.Label(self.database_frame, text="", font=NOTES_FONT)
+        self.cache_stats_label.grid(row=2, column=0, sticky="w", padx=label_padx, pady=label_pady)
+        self.backup_status_label = ttk.Label(self.database_frame, text="", font=NOTES_FONT)
+        self.backup_status_label.grid(row=3, column=0, sticky="w", padx=label_padx, pady=label_pady)
 
         # Buttons Frame (Bottom)
         self.database_buttons = ttk.Frame(self.database_tab)
@@ -913,6 +883,8 @@ class OutLineEditorApp:
             ("Load DB", self.handle_load_database, "primary"),
             ("Create DB", self.reset_database, "primary"),
             ("Import JSON", lambda: load_from_json_file(self.db.cursor, self.db, self.refresh_tree), "warning"),
+            ("Rebuild Index", self.rebuild_tree_index, "secondary"),
+            ("Backup DB", self.handle_backup_database, "success"),
             
         ]:
             ttk.Button(self.database_buttons, text=text, command=command, bootstyle=style).pack(
@@ -965,6 +937,13 @@ class OutLineEditorApp:
             bootstyle="info"
         ).pack(side=tk.LEFT, padx=button_padx, pady=button_padx)
 
+        ttk.Button(
+            self.exports_buttons, 
+            text="DB", 
+            command=self.handle_export_db,
+            bootstyle="info"
+        ).pack(side=tk.LEFT, padx=button_padx, pady=button_padx)
+
 
     # TREE MANIPULATION
 
@@ -978,42 +957,21 @@ class OutLineEditorApp:
             return
 
         try:
-            # Calculate the next placement value
-            self.db.cursor.execute(
-                """
-                SELECT COALESCE(MAX(placement), 0) + 1
-                FROM sections
-                WHERE parent_id IS ?
-                """,
-                (parent_id,)
-            )
-            next_placement = self.db.cursor.fetchone()[0]
-            if next_placement <= 0:
-                next_placement = 1
-
-            title = f"{title_prefix} {next_placement}"
+            # New sections go last, one placement gap after the current last sibling
+            next_placement = self.db.next_placement(parent_id)
+            title = f"{title_prefix} {len(self.db.sibling_ids(parent_id)) + 1}"
             
             # Add the section to database
             section_id = self.db.add_section(title, section_type, parent_id, next_placement)
+            diff = self.db.numbering.inserted(section_id, parent_id)
             
-            # Force clear any caching
-            self.db.invalidate_caches()
-            
-            # Clear the tree and reload
-            self.tree.delete(*self.tree.get_children())
-            self.load_from_database()
+            # Insert the one node and renumber its sibling list only
+            parent_node = f"I{parent_id}" if parent_id is not None else ""
+            self.place_node(section_id, parent_id, parent_node, title)
+            self.apply_numbering(diff)
             
             # Select and make visible the new item
-            new_item_id = f"I{section_id}"
-            if self.tree.exists(new_item_id):
-                self.tree.selection_set(new_item_id)
-                self.tree.focus(new_item_id)
-                self.tree.see(new_item_id)
-            
-            # Force an immediate update of numbering
-            self.db.conn.commit()
-            numbering_dict = self.db.generate_numbering()
-            self.calculate_numbering(numbering_dict)
+            self.select_item(f"I{section_id}")
             
             return section_id
 
@@ -1038,9 +996,8 @@ class OutLineEditorApp:
             if self._selection_binding:
                 self.tree.unbind("<<TreeviewSelect>>", self._selection_binding)
             
-            # Clear the tree and caches
+            # Clear the tree
             self.tree.delete(*self.tree.get_children())
-            self.db.invalidate_caches()  # Force cache invalidation on refresh
             
             # Reload the tree
             self.load_from_database()
@@ -1049,8 +1006,7 @@ class OutLineEditorApp:
             self.restore_expansion_state(expanded_db_ids)
             
             # Update numbering with fresh numbering
-            numbering_dict = self.db.generate_numbering()
-            self.calculate_numbering(numbering_dict)
+            self.refresh_numbering()
             
             # Restore selection if possible
             if selected_db_id is not None:
@@ -1091,9 +1047,8 @@ class OutLineEditorApp:
                 parent_node=selected_node
             )
 
-            # Update numbering after loading children
-            numbering_dict = self.db.generate_numbering()
-            self.calculate_numbering(numbering_dict)
+            # Number the children just loaded
+            self.calculate_numbering(self.db.numbering.numbers, selected_node)
         except Exception as e:
             print(f"Error in tree expansion: {e}")
 
@@ -1105,14 +1060,11 @@ class OutLineEditorApp:
             for child_id, encrypted_title, _ in children:
                 # Only show items that match the search or are parents of matching items
                 if child_id in ids_to_show or child_id in parents_to_show:
-                    # Decrypt the title using cached value if available
-                    decrypted_title = None
-                    if str(child_id) in self.db._search_cache:
-                        decrypted_title = self.db._search_cache[str(child_id)]['title']
-                    else:
-                        decrypted_title = self.db.decrypt_safely(encrypted_title)
+                    # Search has just decrypted these, so this is a cache hit
+                    decrypted_title = self.db.decrypt_column([child_id], [encrypted_title], "title")[0]
                         
                     node = self.tree.insert(parent_node, "end", f"I{child_id}", text=decrypted_title)
+                    self.tree_titles[child_id] = decrypted_title
                     self.tree.see(node)  # Ensure the node is visible
                     
                     # Recursively populate children
@@ -1122,61 +1074,14 @@ class OutLineEditorApp:
 
     @timer
     def move_up(self):
-        selected = self.tree.selection()
-        if not selected:
-            return
-
-        item_id = self.get_item_id(selected[0])
-        parent_node = self.tree.parent(selected[0])
-        parent_db_id = self.get_item_id(parent_node) if parent_node else None
-
-        try:
-            # Fix consecutive placements first
-            if parent_db_id is None:
-                self.db.fix_all_placements()
-            else:
-                self.db.fix_placement(parent_db_id)
-
-            # Get current placement
-            self.db.cursor.execute(
-                "SELECT placement FROM sections WHERE id = ? AND parent_id IS ?",
-                (item_id, parent_db_id)
-            )
-            current_placement = self.db.cursor.fetchone()
-            
-            if not current_placement:
-                return
-                
-            current_placement = current_placement[0]
-            
-            if current_placement > 1:  # Can only move up if not already at top
-                # Swap with the item above
-                self.db.cursor.execute(
-                    """
-                    UPDATE sections
-                    SET placement = CASE 
-                        WHEN placement = ? THEN ? 
-                        WHEN placement = ? THEN ? 
-                    END
-                    WHERE parent_id IS ? AND placement IN (?, ?)
-                    """,
-                    (current_placement, current_placement - 1,
-                     current_placement - 1, current_placement,
-                     parent_db_id, current_placement, current_placement - 1)
-                )
-                self.db.conn.commit()
-
-            # Force cache invalidation and refresh
-            self.db.invalidate_caches()
-            self.refresh_tree()
-            self.select_item(f"I{item_id}")
-            
-        except Exception as e:
-            print(f"Error in move_up: {e}")
-            self.db.conn.rollback()
+        self._shift_selected(-1)
 
     @timer
     def move_down(self):
+        self._shift_selected(1)
+
+    def _shift_selected(self, offset):
+        """Move the selected item offset places among its siblings."""
         selected = self.tree.selection()
         if not selected:
             return
@@ -1186,57 +1091,15 @@ class OutLineEditorApp:
         parent_db_id = self.get_item_id(parent_node) if parent_node else None
 
         try:
-            # Fix consecutive placements first
-            if parent_db_id is None:
-                self.db.fix_all_placements()
-                self.db.cursor.execute(
-                    "SELECT MAX(placement) FROM sections WHERE parent_id IS NULL"
-                )
-            else:
-                self.db.fix_placement(parent_db_id)
-                self.db.cursor.execute(
-                    "SELECT MAX(placement) FROM sections WHERE parent_id = ?",
-                    (parent_db_id,)
-                )
-            max_placement = self.db.cursor.fetchone()[0]
-
-            # Get current placement
-            self.db.cursor.execute(
-                "SELECT placement FROM sections WHERE id = ? AND parent_id IS ?",
-                (item_id, parent_db_id)
-            )
-            current_placement = self.db.cursor.fetchone()
-            
-            if not current_placement:
-                return
-                
-            current_placement = current_placement[0]
-
-            if current_placement < max_placement:  # Can only move down if not at bottom
-                # Swap with the item below
-                self.db.cursor.execute(
-                    """
-                    UPDATE sections
-                    SET placement = CASE 
-                        WHEN placement = ? THEN ? 
-                        WHEN placement = ? THEN ? 
-                    END
-                    WHERE parent_id IS ? AND placement IN (?, ?)
-                    """,
-                    (current_placement, current_placement + 1,
-                     current_placement + 1, current_placement,
-                     parent_db_id, current_placement, current_placement + 1)
-                )
-                self.db.conn.commit()
-
-            # Force cache invalidation and refresh
-            self.db.invalidate_caches()
-            self.refresh_tree()
+            # One row is written; its new placement falls between its new neighbours
+            if self.db.shift_section(item_id, offset):
+                # Reorder the loaded nodes and renumber this sibling list only
+                self.apply_numbering(self.db.numbering.reordered(parent_db_id))
+                self.reorder_nodes(parent_db_id, parent_node)
             self.select_item(f"I{item_id}")
             
         except Exception as e:
-            print(f"Error in move_down: {e}")
-            self.db.conn.rollback()
+            print(f"Error moving section: {e}")
 
     @timer
     def move_left(self):
@@ -1269,20 +1132,16 @@ class OutLineEditorApp:
             messagebox.showerror("Error", "Unsupported section type for this operation.")
             return
 
-        # Update database with proper ID conversion
+        # Place it right after its old parent
         parent_db_id = self.get_item_id(current_parent_id)
-        self.db.cursor.execute(
-            "UPDATE sections SET parent_id = ?, type = ? WHERE id = ?",
-            (grandparent_id, new_type, item_id)
-        )
-
-        # Fix placements
-        self.db.fix_placement(parent_db_id)
-        if grandparent_id:
-            self.db.fix_placement(grandparent_id)
-
-        self.db.conn.commit()
-        self.refresh_tree()
+        index = self.db.sibling_ids(grandparent_id).index(parent_db_id) + 1
+        self.db.move_section(item_id, grandparent_id, index, new_type)
+        diff = self.db.numbering.reparented(item_id, parent_db_id, grandparent_id)
+
+        # Move the one node and renumber the two sibling lists it left and joined
+        self.place_node(item_id, grandparent_id, grandparent_node)
+        self.reorder_nodes(parent_db_id, current_parent_id)
+        self.apply_numbering(diff)
         self.select_item(f"I{item_id}")
 
     @timer
@@ -1318,33 +1177,89 @@ class OutLineEditorApp:
             messagebox.showerror("Error", "Unsupported section type for this operation.")
             return
 
-        # Update database with proper ID conversion
+        # Becomes the last child of its previous sibling
         parent_db_id = self.get_item_id(current_parent_id) if current_parent_id else None
-        self.db.cursor.execute(
-            "UPDATE sections SET parent_id = ?, type = ? WHERE id = ?",
-            (new_parent_id, new_type, item_id)
-        )
-
-        # Fix placements
-        if parent_db_id:
-            self.db.fix_placement(parent_db_id)
-        self.db.fix_placement(new_parent_id)
-
-        self.db.conn.commit()
-        self.refresh_tree()
+        index = len(self.db.sibling_ids(new_parent_id))
+        self.db.move_section(item_id, new_parent_id, index, new_type)
+        diff = self.db.numbering.reparented(item_id, parent_db_id, new_parent_id)
+
+        # Move the one node and renumber the two sibling lists it left and joined
+        self.place_node(item_id, new_parent_id, new_parent_node)
+        self.reorder_nodes(parent_db_id, current_parent_id)
+        self.apply_numbering(diff)
         self.select_item(f"I{item_id}")
 
     @timer
-    def calculate_numbering(self, numbering_dict):
+    def calculate_numbering(self, numbering_dict, parent_node=""):
         """
-        Assign hierarchical numbering to tree nodes based on the provided numbering dictionary.
+        Assign hierarchical numbering to tree nodes based on the provided numbering
+        dictionary, for the whole tree or the nodes below parent_node.
         """
         try:
-            for node_id in self.tree.get_children():
+            for node_id in self.tree.get_children(parent_node):
                 self._apply_numbering_recursive(node_id, numbering_dict)
         except Exception as e:
             print(f"Error in calculate_numbering: {e}")
 
+    def refresh_numbering(self):
+        """Bring the numbering service up to date and number every loaded node."""
+        self.db.numbering.sync()
+        self.calculate_numbering(self.db.numbering.numbers)
+
+    def apply_numbering(self, diff):
+        """Apply a numbering diff from the numbering service to the loaded nodes it names."""
+        for section_id, number in diff.items():
+            node_id = f"I{section_id}"
+            if number is None:
+                self.tree_titles.pop(section_id, None)
+                continue
+            if self.tree.exists(node_id):
+                self.tree.item(node_id, text=f"{number}. {self.base_title(section_id, node_id)}")
+
+    def place_node(self, section_id, parent_id, parent_node, title=None):
+        """
+        Put a section's node under parent_node in outline order: an existing
+        node is moved, a new one (title given) is inserted. If parent_node's
+        children aren't loaded yet, they are loaded now, this one included,
+        as expanding it would.
+        """
+        node_id = f"I{section_id}"
+        children = self.tree.get_children(parent_node) if parent_node else ()
+        dummies = [child for child in children if "hidden" in self.tree.item(child, "tags")]
+        if dummies:
+            if self.tree.exists(node_id):
+                self.tree.delete(node_id)  # reloaded below, its own children lazily
+            self.tree.delete(*dummies)
+            self.populate_tree(parent_id, parent_node)
+            self.calculate_numbering(self.db.numbering.numbers, parent_node)
+            return
+        if self.tree.exists(node_id):
+            self.tree.move(node_id, parent_node, "end")
+        else:
+            self.tree.insert(parent_node, "end", node_id, text=title)
+            self.tree_titles[section_id] = title
+        self.reorder_nodes(parent_id, parent_node)
+
+    def reorder_nodes(self, parent_id, parent_node):
+        """Put the loaded children of parent_node in the numbering service's order."""
+        index = 0
+        for child_id in self.db.numbering.children(parent_id):
+            node_id = f"I{child_id}"
+            if self.tree.exists(node_id):
+                self.tree.move(node_id, parent_node, index)
+                index += 1
+
+    def base_title(self, section_id, node_id):
+        """A node's title without its number."""
+        title = self.tree_titles.get(section_id)
+        if title is None:
+            # Not loaded through populate_tree; strip a leading "1.2. " if present
+            title = self.tree.item(node_id, "text")
+            number, sep, rest = title.partition('. ')
+            if sep and number.replace('.', '').isdigit():
+                title = rest
+        return title
+
     @timer
     def _apply_numbering_recursive(self, node_id, numbering_dict):
         """
@@ -1357,13 +1272,7 @@ class OutLineEditorApp:
 
             db_id = self.get_item_id(node_id)
             if db_id is not None and db_id in numbering_dict:
-                current_text = self.tree.item(node_id, "text")
-                if '. ' in current_text:
-                    base_text = current_text.split('. ', 1)[1]
-                else:
-                    base_text = current_text
-                
-                new_text = f"{numbering_dict[db_id]}. {base_text}"
+                new_text = f"{numbering_dict[db_id]}. {self.base_title(db_id, node_id)}"
                 self.tree.item(node_id, text=new_text)
 
             # Process children
@@ -1377,7 +1286,9 @@ class OutLineEditorApp:
         """Update a single tree item's text and numbering without full refresh."""
         try:
             # Get the current numbering
-            numbering_dict = self.db.generate_numbering()
+            self.db.numbering.sync()
+            numbering_dict = self.db.numbering.numbers
+            self.tree_titles[item_id] = new_title
             
             # Find and update the item - try both with and without the "I" prefix
             item_iid = f"I{item_id}"  # First try with "I" prefix
@@ -1548,22 +1459,22 @@ class OutLineEditorApp:
                     return False  # User cancelled password entry
 
                 try:
-                    # Create new encryption manager for validation
-                    test_manager = EncryptionManager(password)
-                    
-                    # Create new database handler with the test manager
-                    new_db = DatabaseHandler(file_path, test_manager)
-                    
-                    # Validate the password
-                    if not new_db.validate_password(password):
+                    # Open the file without a key, then unlock it once
+                    new_db = DatabaseHandler(file_path)
+                    manager = new_db.unlock(password)
+                    if manager is None:
+                        new_db.close()
                         messagebox.showerror("Error", "Invalid password. Please try again.")
                         continue
                     
                     # Password validated, update the current database
-                    self.db.close()
+                    self.db.close()  # writes any pending saves first
+                    new_db.ensure_tree_integrity()
+                    new_db.writes.scheduler = self.root.after
+                    new_db.writes.on_error = self.handle_write_error
                     self.db = new_db
-                    self.encryption_manager = test_manager
-                    self.db.encryption_manager = test_manager
+                    self.settings_manager.db = new_db
+                    self.encryption_manager = manager
                     self.is_authenticated = True
                     self.password_validated = True
                     self.update_title() 
@@ -1576,6 +1487,8 @@ class OutLineEditorApp:
                     # Enable UI and refresh tree
                     self.set_ui_state(True)
                     self.refresh_tree()
+                    self.schedule_reencryption()
+                    self.db.prefetch()
                     
                     messagebox.showinfo("Success", f"Database loaded successfully from {file_path}")
                     return True
@@ -1593,6 +1506,25 @@ class OutLineEditorApp:
 
         return False
 
+    def schedule_reencryption(self):
+        """Run the database's pending re-encryption job a chunk at a time from the Tk loop."""
+        if not self.is_authenticated or not self.db.has_pending_reencryption():
+            return
+        db = self.db
+
+        def step():
+            if db is not self.db:
+                return  # another database was loaded; its job resumes when it is opened again
+            try:
+                more = db.reencrypt_step()
+            except Exception as e:
+                print(f"Re-encryption paused: {e}")
+                return
+            if more:
+                self.root.after(REENCRYPT_INTERVAL_MS, step)
+
+        self.root.after_idle(step)
+
     @timer
     def load_from_database(self):
         """
@@ -1602,17 +1534,11 @@ class OutLineEditorApp:
             # Clear the TreeView
             self.tree.delete(*self.tree.get_children())
 
-            # Ensure consistency in the database
-            self.db.clean_parent_ids()
-
             # Populate the root-level nodes
             self.populate_tree(None, "")
 
-            # Generate numbering for all sections
-            numbering_dict = self.db.generate_numbering()
-
             # Apply numbering to the TreeView nodes
-            self.calculate_numbering(numbering_dict)
+            self.refresh_numbering()
 
         except Exception as e:
             print(f"Error in load_from_database: {e}")
@@ -1629,16 +1555,19 @@ class OutLineEditorApp:
             has_children_dict = self.db.batch_has_children(child_ids)
             
             # Process all children in one go
-            for child_id, encrypted_title, parent_id in children:
+            titles = self.db.decrypt_column(
+                [child[0] for child in children], [child[1] for child in children], "title", default="Untitled"
+            )
+            for (child_id, encrypted_title, parent_id), title in zip(children, titles):
                 if not child_id:  # Skip invalid entries
                     continue
                     
-                title = self.db.decrypt_safely(encrypted_title, default="Untitled")
                 node_id = f"I{child_id}"
                 
                 # Check if node already exists
                 if not self.tree.exists(node_id) and title and title.strip():
                     node = self.tree.insert(parent_node, "end", node_id, text=title)
+                    self.tree_titles[child_id] = title
                     
                     # Use pre-fetched has_children info
                     if has_children_dict.get(child_id, False):
@@ -1689,24 +1618,16 @@ class OutLineEditorApp:
                         self.root.destroy()  # Close the main application window
                         sys.exit()  # Ensure the process exits completely
 
-                    # Create a temporary encryption manager to verify the password
-                    temp_encryption_manager = EncryptionManager(password)
-
-                    # Reconnect to verify the password
-                    temp_conn = sqlite3.connect(db_path)
-                    temp_cursor = temp_conn.cursor()
-                    stored_hash = temp_cursor.execute(
-                        "SELECT value FROM settings WHERE key = ?",
-                        ("password",)
-                    ).fetchone()[0]
-                    
-                    if hashlib.sha256(password.encode()).hexdigest() != stored_hash:
-                        temp_conn.close()
+                    # Unlock once; the key slot check is the password verifier
+                    candidate_db = DatabaseHandler(db_path)
+                    manager = candidate_db.unlock(password)
+                    candidate_db.close()
+                    if manager is None:
                         messagebox.showerror("Invalid Password", "The password is incorrect. Try again.")
                         continue
 
                     # Password verified
-                    self.encryption_manager = temp_encryption_manager
+                    self.encryption_manager = manager
                     break
 
             # Replace the current database connection
@@ -1763,13 +1684,9 @@ class OutLineEditorApp:
                 
                 self.save_data(refresh=False)  # Save without immediate refresh
                 
-                # Debug: Check what's in the database after save
-                self.db.cursor.execute(
-                    "SELECT title FROM sections WHERE id = ?", (self.last_selected_item_id,)
-                )
-                row = self.db.cursor.fetchone()
-                if row and row[0]:
-                    decrypted_title = self.encryption_manager.decrypt_string(row[0])
+                # Refresh the tree label from what was saved (written through to the cache)
+                decrypted_title = self.db.get_section_title(self.last_selected_item_id)
+                if decrypted_title:
                     self.update_tree_item(self.last_selected_item_id, decrypted_title)
                 
                 self._suppress_selection_event = False  # Re-enable selection events
@@ -1780,24 +1697,17 @@ class OutLineEditorApp:
 
             # Load the newly selected item's data
             self.db.encryption_manager = self.encryption_manager
-            row = self.db.cursor.execute(
-                "SELECT title, questions FROM sections WHERE id = ?", (current_item_id,)
-            ).fetchone()
-
-            if row:
+            if self.db.get_section_type(current_item_id):
                 self.title_entry.delete(0, tk.END)
                 self.questions_text.delete(1.0, tk.END)
 
-                title, encrypted_questions = row
-                decrypted_title = self.encryption_manager.decrypt_string(title)
+                decrypted_title = self.db.get_section_title(current_item_id)
                 self.title_entry.insert(0, decrypted_title if decrypted_title else "")
 
-                if encrypted_questions:
-                    decrypted_questions = self.encryption_manager.decrypt_string(
-                        encrypted_questions
-                    )
-                    parsed_questions = json.loads(decrypted_questions.strip())
-                    self.questions_text.insert(tk.END, "\n".join(parsed_questions))
+                # Long notes arrive chunk by chunk; show each as it's decrypted
+                for piece in self.db.iter_note(current_item_id):
+                    self.questions_text.insert(tk.END, piece)
+                    self.questions_text.update_idletasks()
 
         except Exception as e:
             print(f"Selection loading error: {e}")
@@ -1816,14 +1726,11 @@ class OutLineEditorApp:
             return
 
         try:
-            # Get raw text content and split by newlines while preserving empty lines
+            # Notes are stored as raw text (see manager_notes); the write is
+            # queued and committed with other saves shortly after
             raw_text = self.questions_text.get(1.0, tk.END).rstrip()
-            questions = raw_text.split("\n")
-            # Keep empty lines by only filtering out lines that are actually None
-            questions = [q if q else "" for q in questions]
-            questions_json = json.dumps(questions)
             
-            self.db.update_section(self.last_selected_item_id, title, questions_json)
+            self.db.writes.save(self.last_selected_item_id, title, raw_text)
 
             if refresh:
                 self.refresh_tree()
@@ -1831,9 +1738,8 @@ class OutLineEditorApp:
             self.update_title() 
 
         except Exception as e:
-            print(f"Encryption Error: {e}")
-            self.handle_authentication_failure("Encryption failed. Please verify your password.")
-            return
+            # Only an early flush (WRITE_BEHIND_MAX_PENDING saves queued) writes here
+            self.handle_write_error(e)
 
     @timer
     def delete_selected(self):
@@ -1871,9 +1777,17 @@ class OutLineEditorApp:
             self.title_entry.delete(0, tk.END)
             self.questions_text.delete(1.0, tk.END)
 
-            # Update numbering 
-            numbering_dict = self.db.generate_numbering()
-            self.calculate_numbering(numbering_dict)
+            # Renumber the remaining siblings only
+            self.apply_numbering(self.db.numbering.deleted(item_id))
+
+    def rebuild_tree_index(self):
+        """Recompute the path/depth tree index of the open database."""
+        try:
+            count = self.db.rebuild_tree_index()
+            messagebox.showinfo("Rebuild Index", f"Tree index rebuilt for {count} sections.")
+        except Exception as e:
+            print(f"Error rebuilding tree index: {e}")
+            messagebox.showerror("Error", f"Failed to rebuild tree index: {e}")
 
     def reset_database(self):
         """Prompt for a new database file and password, then reset the Treeview."""
@@ -1923,6 +1837,7 @@ class OutLineEditorApp:
             
             # Reset the database
             self.db.reset_database(new_db_path)
+            self.db.encryption_manager = self.encryption_manager
             
             # Set the password in the new database
             self.db.set_password(password)
@@ -2026,38 +1941,6 @@ class OutLineEditorApp:
             print(f"Error in get_item_type: {e}")
             return None
 
-    @timer
-    def initialize_placement(self):
-        """Assign default placement for existing rows and ensure they are consecutive."""
-        try:
-            self.cursor.execute(
-                """
-                WITH RECURSIVE section_hierarchy(id, parent_id, level) AS (
-                    SELECT id, parent_id, 0 FROM sections WHERE parent_id IS NULL
-                    UNION ALL
-                    SELECT s.id, s.parent_id, h.level + 1
-                    FROM sections s
-                    INNER JOIN section_hierarchy h ON s.parent_id = h.id
-                )
-                SELECT id, ROW_NUMBER() OVER (PARTITION BY parent_id ORDER BY id) AS new_placement
-                FROM section_hierarchy
-                """
-            )
-            for row in self.cursor.fetchall():
-                self.cursor.execute(
-                    "UPDATE sections SET placement = ? WHERE id = ?",
-                    (row[1], row[0]),
-                )
-            self.conn.commit()
-            
-            # After initializing, fix to ensure they're consecutive
-            self.fix_all_placements()
-            
-        except Exception as e:
-            print(f"Error in initialize_placement: {e}")
-            self.conn.rollback()
-
-
     # SEARCH
 
     @timer
@@ -2100,8 +1983,7 @@ class OutLineEditorApp:
             self.populate_filtered_tree(None, "", ids_to_show, parents_to_show)
 
             # Apply numbering
-            numbering_dict = self.db.generate_numbering()
-            self.calculate_numbering(numbering_dict)
+            self.refresh_numbering()
 
         except Exception as e:
             print(f"Error in execute_search: {e}")
@@ -2122,12 +2004,8 @@ class OutLineEditorApp:
             str: Formatted filename with timestamp
         """
         try:
-            # Get the section title from the tree
-            title = self.tree.item(selected_node)['text']
-            
-            # Remove numbering prefix if present (e.g., "1.2. Title" -> "Title")
-            if '. ' in title:
-                title = title.split('. ', 1)[1]
+            # Get the section title without its number
+            title = self.base_title(self.get_item_id(selected_node), selected_node)
                 
             # Replace invalid filename characters with hyphens
             title = "".join(c if c.isalnum() or c in (' ', '-', '_') else '-' for c in title)
@@ -2195,6 +2073,8 @@ class OutLineEditorApp:
             
             if not file_path:
                 return False
+
+            self.db.writes.flush()  # exports read the rows directly
                 
             # Call the specific export function
             export_func(self.db, root_id, file_path)
@@ -2211,8 +2091,8 @@ class OutLineEditorApp:
         def add_children(parent_id, level):
             children = self.db.load_children(parent_id)
             result = []
-            for child_id, encrypted_title, _ in children:
-                title = self.db.decrypt_safely(encrypted_title)
+            titles = self.db.decrypt_column([child[0] for child in children], [child[1] for child in children], "title")
+            for (child_id, encrypted_title, _), title in zip(children, titles):
                 child_hierarchy = {"name": title}
                 
                 has_children = self.db.has_children(child_id)
@@ -2238,7 +2118,13 @@ class OutLineEditorApp:
         return hierarchy
 
     def handle_export_db(self):
-        """Export selected section and its children to a new database."""
+        """
+        Export selected section and its children to a new database, or with
+        "Export All Sections" on, a compacted copy of the whole database.
+        """
+        if self.export_all.get():
+            return self.handle_export_full_db()
+
         selected = self.tree.selection()
         if not selected:
             messagebox.showerror("Error", "No section selected.")
@@ -2248,6 +2134,7 @@ class OutLineEditorApp:
         default_filename = self.get_standardized_filename(selected[0], "db")
         
         try:
+            self.db.writes.flush()
             file_path = asksaveasfilename(
                 defaultextension=".db",
                 filetypes=[("SQLite Database", "*.db")],
@@ -2271,43 +2158,17 @@ class OutLineEditorApp:
                 
             password, _ = result
 
-            # Create new database and encryption manager
-            new_encryption_manager = EncryptionManager(password)
-            new_db = DatabaseHandler(file_path, new_encryption_manager)
-            new_db.setup_database()
-            new_db.set_password(password)
-
-            def export_section_recursive(section_id, new_parent_id=None):
-                self.db.cursor.execute(
-                    "SELECT title, type, questions, placement FROM sections WHERE id = ?",
-                    (section_id,)
-                )
-                row = self.db.cursor.fetchone()
-                if not row:
-                    return
-
-                title = self.db.decrypt_safely(row[0])
-                questions = self.db.decrypt_safely(row[2])
-                
-                new_section_id = new_db.add_section(
-                    title,
-                    row[1],  # type
-                    new_parent_id,
-                    row[3]   # placement
-                )
-
-                new_db.update_section(new_section_id, title, questions)
+            if os.path.abspath(file_path) == os.path.abspath(self.db.db_name):
+                messagebox.showerror("Error", "Choose a file other than the open database.")
+                return
 
-                self.db.cursor.execute(
-                    "SELECT id FROM sections WHERE parent_id = ? ORDER BY placement",
-                    (section_id,)
-                )
-                for child_row in self.db.cursor.fetchall():
-                    export_section_recursive(child_row[0], new_section_id)
+            # The save dialog already confirmed replacing an existing file
+            for path in (file_path, f"{file_path}-wal", f"{file_path}-shm"):
+                if os.path.exists(path):
+                    os.remove(path)
 
-            export_section_recursive(node_id)
-            new_db.conn.commit()
-            new_db.close()
+            # One transaction; ciphertext is copied as stored when the password is unchanged
+            self.db.export_subtree(node_id, file_path, password)
 
             messagebox.showinfo(
                 "Success", 
@@ -2317,6 +2178,67 @@ class OutLineEditorApp:
         except Exception as e:
             messagebox.showerror("Error", f"Failed to export database: {str(e)}")
 
+    def handle_export_full_db(self):
+        """Write a compacted copy of the whole database (VACUUM INTO) in the background."""
+        timestamp = time.strftime("%Y.%m.%d_%H%M")
+        file_path = asksaveasfilename(
+            defaultextension=".db",
+            filetypes=[("SQLite Database", "*.db")],
+            title="Save DB Export",
+            initialfile=f"complete-outline.{timestamp}.db"
+        )
+        if not file_path:
+            return
+        if os.path.abspath(file_path) == os.path.abspath(self.db.db_name):
+            messagebox.showerror("Error", "Choose a file other than the open database.")
+            return
+
+        def done(path):
+            messagebox.showinfo(
+                "Success",
+                f"Exported the database to {path}\n\nIt opens with the current password."
+            )
+
+        try:
+            job = self.db.backups.start(file_path, compact=True)
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to export database: {e}")
+            return
+        self.watch_backup(job, done)
+
+    def handle_backup_database(self):
+        """Back up the open database to a new timestamped file, keeping the newest few."""
+        backups = self.db.backups  # rotate this database's backups even if another is loaded meanwhile
+
+        def done(path):
+            removed = backups.rotate()
+            note = f", removed {len(removed)} older" if removed else ""
+            self.backup_status_label.config(text=f"Last backup: {path}{note}")
+
+        try:
+            job = backups.start_rotating_backup()
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to back up database: {e}")
+            return
+        self.watch_backup(job, done)
+
+    def watch_backup(self, job, on_success):
+        """Poll a running BackupJob from the Tk loop, showing its progress on the Database tab."""
+        def poll():
+            if not job.done():
+                copied, total = job.progress
+                text = f"Backing up: {copied} of {total} pages" if total else "Writing database copy..."
+                self.backup_status_label.config(text=text)
+                self.root.after(BACKUP_POLL_MS, poll)
+                return
+            self.backup_status_label.config(text="")
+            if job.error is not None:
+                messagebox.showerror("Error", f"Failed to back up database: {job.error}")
+            else:
+                on_success(job.result)
+
+        self.root.after(BACKUP_POLL_MS, poll)
+
     def handle_export_json(self):
         """Handle JSON export with standardized filename."""
         export_type = {
@@ -2373,7 +2295,7 @@ class OutLineEditorApp:
         """Handle window closing event."""
         try:
             self.save_data()  # Save any pending changes
-            self.db.close()  # Close the database connection
+            self.db.close()  # Write queued saves and close the database connection
             self.root.destroy()
         except Exception as e:
             print(f"Error during closing: {e}")
@@ -1,19 +1,50 @@
 import unittest
 import os
 import json
+import base64
+import hashlib
 import tempfile
 import shutil
+import sqlite3
+import sys
+import threading
 import HtmlTestRunner
 from pathlib import Path
 from unittest.mock import MagicMock, patch
 from datetime import datetime
 
 from database import DatabaseHandler
-from manager_encryption import EncryptionManager
+from manager_backup import verify_copy
+from manager_cache import PlaintextCache
+from manager_migrations import MIGRATIONS, SCHEMA_VERSION, migrate, schema_version
+from manager_numbering import NumberingService
+from manager_notes import NOTE_RAW, NOTE_ZLIB, NOTE_CHUNKED, encode_note, note_lines, split_note
+from manager_encryption import EncryptionManager, FORMAT_V1_PREFIX, DEFAULT_KDF_PARAMS, calibrate_kdf
 from manager_json import validate_json_schema, load_from_json_file
 from manager_docx import export_to_docx
 from manager_pdf import export_to_pdf
 
+SECTION_CONTENT_QUERY = """
+    SELECT s.title, c.questions FROM sections s
+    LEFT JOIN section_content c ON c.section_id = s.id
+"""
+
+def make_legacy_ciphertext(password, plain_text):
+    """Build a value in the original base64(salt | iv | AES-CBC) format."""
+    from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+    from cryptography.hazmat.primitives.hashes import SHA256
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+    salt, iv = os.urandom(16), os.urandom(16)
+    key = PBKDF2HMAC(algorithm=SHA256(), length=32, salt=salt, iterations=100_000).derive(
+        password.encode('utf-8')
+    )
+    data = plain_text.encode('utf-8')
+    padding_length = 16 - (len(data) % 16)
+    encryptor = Cipher(algorithms.AES(key), modes.CBC(iv)).encryptor()
+    ciphertext = encryptor.update(data + bytes([padding_length] * padding_length)) + encryptor.finalize()
+    return base64.b64encode(salt + iv + ciphertext).decode('utf-8')
+
 class TestBase(unittest.TestCase):
     """Base test class with common setup and teardown"""
     
@@ -34,6 +65,8 @@ class TestBase(unittest.TestCase):
         """Set up fresh database for each test"""
         self.db = DatabaseHandler(self.test_db_path, self.encryption_manager)
         self.db.setup_database()
+        # Pin the KDF cost so the suite doesn't calibrate for every test
+        self.db.save_kdf_params(DEFAULT_KDF_PARAMS)
         self.db.set_password(self.test_password)
     
     def tearDown(self):
@@ -81,16 +114,19 @@ class TestDatabaseOperations(TestBase):
         section_id = self.db.add_section("Initial Title", "header")
         
         new_title = "Updated Title"
-        new_questions = json.dumps(["Question 1", "Question 2"])
+        new_questions = "Question 1\nQuestion 2"
         self.db.update_section(section_id, new_title, new_questions)
         
-        self.db.cursor.execute("SELECT title, questions FROM sections WHERE id = ?", (section_id,))
+        self.db.cursor.execute("""
+            SELECT s.title, c.questions FROM sections s
+            JOIN section_content c ON c.section_id = s.id WHERE s.id = ?
+        """, (section_id,))
         row = self.db.cursor.fetchone()
         decrypted_title = self.db.decrypt_safely(row[0])
-        decrypted_questions = self.db.decrypt_safely(row[1])
+        decrypted_questions = self.db.decrypt_notes([row[1]])[0]
         
         self.assertEqual(decrypted_title, new_title)
-        self.assertEqual(json.loads(decrypted_questions), json.loads(new_questions))
+        self.assertEqual(decrypted_questions, new_questions)
 
     def test_delete_section_cascade(self):
         """Test cascading delete of sections"""
@@ -111,6 +147,238 @@ class TestDatabaseOperations(TestBase):
         self.assertEqual(final_count, 0)
         self.assertEqual(initial_count - final_count, 7)  # Verify exact number deleted
 
+    def test_delete_cost_is_linear_in_subtree(self):
+        """Test deleting a subtree writes three rows per section whatever its fan-out"""
+        sibling_id = self.db.add_section("Sibling", "header")
+        wide = [("Wide", "header", None, None)] + [(f"W{i}", "category", -1, None) for i in range(400)]
+        deep = [("Deep", "header", None, None)]
+        level = [1]
+        for _ in range(4):
+            next_level = []
+            for parent_row in level:
+                for i in range(4):
+                    deep.append((f"D{len(deep)}", "category", -parent_row, None))
+                    next_level.append(len(deep))
+            level = next_level
+
+        for rows in (wide, deep):
+            ids = self.db.add_sections_bulk(rows)
+            self.db.cursor.execute("SELECT placement FROM sections WHERE id = ?", (sibling_id,))
+            sibling_placement = self.db.cursor.fetchone()[0]
+            changes = self.db.conn.total_changes
+            self.db.delete_section(ids[0])
+            # The section, its section_content row and one structure_version bump
+            self.assertEqual(self.db.conn.total_changes - changes, 3 * len(ids))
+            self.db.cursor.execute("SELECT placement FROM sections WHERE id = ?", (sibling_id,))
+            self.assertEqual(self.db.cursor.fetchone()[0], sibling_placement)
+
+        self.db.cursor.execute("SELECT COUNT(*) FROM sections")
+        self.assertEqual(self.db.cursor.fetchone()[0], 1)
+
+    def test_clone_subtree(self):
+        """Test cloning copies the subtree in order, with or without notes, and renames only its root"""
+        header_id, cat1_id, cat2_id, subcat1_id, *_ = self.create_test_hierarchy()
+        big_note = "".join(f"line {i}\n" for i in range(3000))
+        self.db.update_section(subcat1_id, "Subcategory 1", big_note)
+        self.db.update_section(cat2_id, "Category 2", "cat2 note")
+
+        def outline(section_id):
+            title, note = self.db.get_section_content(section_id)
+            children = [outline(child[0]) for child in self.db.load_children(section_id)]
+            return title, note, children
+
+        clone_id = self.db.clone_subtree(cat1_id, header_id, with_content=True)
+        self.assertEqual(self.db.sibling_ids(header_id), [cat1_id, cat2_id, clone_id])
+        title, note, children = outline(clone_id)
+        self.assertEqual(title, "Category 1-Cloned")
+        self.assertEqual(children, outline(cat1_id)[2])
+        self.assertEqual(children[0][1], big_note)
+        clone_subcat_id = self.db.sibling_ids(clone_id)[0]
+        clone_subheader_id = self.db.sibling_ids(clone_subcat_id)[0]
+        self.assertEqual(self.db.get_ancestors(clone_subheader_id), [header_id, clone_id, clone_subcat_id])
+
+        # Titles only, into the source's own subtree
+        bare_id = self.db.clone_subtree(header_id, subcat1_id)
+        _, note, children = outline(bare_id)
+        self.assertEqual(note, "")
+        self.assertEqual([child[0] for child in children], ["Category 1", "Category 2", "Category 1-Cloned"])
+        self.assertEqual(children[1][1], "")
+        self.assertEqual(self.db.count_descendants(bare_id), 11)
+        self.assertEqual(self.db.check_tree_integrity(), {})
+
+    def test_transaction_commits_or_rolls_back(self):
+        """Test writes inside transaction() commit together, nested blocks join the outer one"""
+        with self.db.transaction():
+            header_id = self.db.add_section("Header", "header")
+            with self.db.transaction():
+                self.db.update_section(header_id, "Header", "note")
+            self.assertTrue(self.db.conn.in_transaction)
+        self.assertFalse(self.db.conn.in_transaction)
+
+        with self.assertRaises(RuntimeError):
+            with self.db.transaction():
+                self.db.add_section("Lost", "category", header_id)
+                self.db.move_section(header_id, None, 0)
+                raise RuntimeError("abort")
+        self.db.cursor.execute("SELECT COUNT(*) FROM sections")
+        self.assertEqual(self.db.cursor.fetchone()[0], 1)
+        self.assertEqual(self.db.get_section_content(header_id), ("Header", "note"))
+
+    def test_add_sections_bulk(self):
+        """Test a subtree is added in one transaction, appended after existing siblings"""
+        header_id = self.db.add_section("Existing", "header")
+        existing_id = self.db.add_section("Existing child", "category", header_id)
+        large_note = "\n".join(f"line {i} " + "x" * 60 for i in range(600))
+
+        statements = []
+        self.db.conn.set_trace_callback(statements.append)
+        ids = self.db.add_sections_bulk([
+            ("Category", "category", header_id, None, "note"),
+            ("Subcategory 1", "subcategory", -1, None),
+            ("Subcategory 2", "subcategory", -1, None, large_note),
+            ("Subheader", "subheader", -2, None),
+        ])
+        self.db.conn.set_trace_callback(None)
+        self.assertEqual(statements.count("COMMIT"), 1)
+
+        self.assertEqual(self.db.sibling_ids(header_id), [existing_id, ids[0]])
+        self.assertEqual(self.db.sibling_ids(ids[0]), [ids[1], ids[2]])
+        self.assertEqual(self.db.get_ancestors(ids[3]), [header_id, ids[0], ids[1]])
+        self.db.plaintext_cache.clear()
+        self.assertEqual(self.db.get_section_content(ids[0]), ("Category", "note"))
+        self.assertEqual(self.db.get_section_content(ids[1]), ("Subcategory 1", ""))
+        self.assertEqual(self.db.get_section_content(ids[2]), ("Subcategory 2", large_note))
+
+        with self.assertRaises(ValueError):
+            self.db.add_sections_bulk([("Orphan", "category", -1, None)])
+        self.assertEqual(self.db.count_descendants(header_id), 5)
+
+    def test_write_behind_queue(self):
+        """Test queued saves coalesce, read back before they're written and commit together"""
+        first_id = self.db.add_section("First", "header")
+        second_id = self.db.add_section("Second", "header")
+        scheduled = []
+        self.db.writes.scheduler = lambda delay, callback: scheduled.append(callback)
+
+        self.db.writes.save(first_id, "First v1", "draft")
+        self.db.writes.save(first_id, "First v2", "final")
+        self.db.writes.save(second_id, "Second v2", "note")
+        self.assertEqual((len(scheduled), len(self.db.writes)), (1, 2))
+        # Pending saves win over the stored rows
+        self.assertEqual(self.db.get_section_title(first_id), "First v2")
+        self.assertEqual("".join(self.db.iter_note(first_id)), "final")
+        self.db.cursor.execute("SELECT title FROM sections WHERE id = ?", (first_id,))
+        self.assertEqual(self.db.decrypt_safely(self.db.cursor.fetchone()[0]), "First")
+
+        statements = []
+        self.db.conn.set_trace_callback(statements.append)
+        scheduled.pop()()
+        self.db.conn.set_trace_callback(None)
+        self.assertEqual(statements.count("COMMIT"), 1)
+        self.assertEqual(len(self.db.writes), 0)
+        self.db.plaintext_cache.clear()
+        self.assertEqual(self.db.get_section_content(first_id), ("First v2", "final"))
+        self.assertEqual(self.db.get_section_content(second_id), ("Second v2", "note"))
+
+        # Deleted sections drop their pending saves; close flushes the rest
+        self.db.writes.save(second_id, "Gone", "")
+        self.db.delete_section(second_id)
+        self.db.writes.save(first_id, "First v3", "closing")
+        self.db.close()
+        self.db = DatabaseHandler(self.test_db_path)
+        self.db.unlock(self.test_password)
+        self.assertEqual(self.db.get_section_content(first_id), ("First v3", "closing"))
+        self.db.cursor.execute("SELECT COUNT(*) FROM section_content")
+        self.assertEqual(self.db.cursor.fetchone()[0], 1)
+
+    def test_write_behind_retries_failed_flush(self):
+        """Test a failed scheduled flush keeps its saves, reports the error and retries later"""
+        section_id = self.db.add_section("Section", "header")
+        scheduled, errors = [], []
+        self.db.writes.scheduler = lambda delay, callback: scheduled.append((delay, callback))
+        self.db.writes.on_error = errors.append
+
+        self.db.writes.save(section_id, "Saved later", "note")
+        failure = sqlite3.OperationalError("database is locked")
+        with patch.object(self.db, "update_section", side_effect=failure):
+            delay, callback = scheduled.pop()
+            callback()
+        self.assertEqual(errors, [failure])
+        self.assertEqual(len(self.db.writes), 1)
+        self.assertEqual(self.db.get_section_title(section_id), "Saved later")
+        retry_delay, retry = scheduled.pop()
+        self.assertGreater(retry_delay, delay)
+
+        retry()
+        self.assertEqual((scheduled, errors, len(self.db.writes)), ([], [failure], 0))
+        self.db.plaintext_cache.clear()
+        self.assertEqual(self.db.get_section_content(section_id), ("Saved later", "note"))
+
+    def test_reading_uses_read_only_snapshot(self):
+        """Test reading() sees one snapshot on a read-only connection while the writer commits"""
+        self.db.add_section("Before", "header")
+        with self.db.reading() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM sections")
+            self.assertEqual(cursor.fetchone()[0], 1)
+            self.db.add_section("During", "header")
+            cursor.execute("SELECT COUNT(*) FROM sections")
+            self.assertEqual(cursor.fetchone()[0], 1)
+            with self.assertRaises(sqlite3.OperationalError):
+                cursor.execute("DELETE FROM sections")
+        with self.db.reading() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM sections")
+            self.assertEqual(cursor.fetchone()[0], 2)
+
+    def test_background_reads(self):
+        """Test prefetching and export loading run on worker threads"""
+        header_id, *_ = self.create_test_hierarchy()
+        self.db.update_section(header_id, "Test Header", "header note")
+        self.db.plaintext_cache.clear()
+
+        self.db.prefetch().join()
+        # Seven titles and the one non-empty note
+        self.assertEqual(self.db.cache_stats()["entries"], 8)
+
+        from manager_docx import load_sections_for_export
+        results = []
+        worker = threading.Thread(target=lambda: results.append(load_sections_for_export(self.db, header_id)))
+        worker.start()
+        worker.join()
+        self.assertEqual(results, [load_sections_for_export(self.db, header_id)])
+        self.assertEqual(results[0][0][4], "header note")
+
+    def test_schema_migrations(self):
+        """Test a current database opens with one pragma read and an old one is migrated once"""
+        header_id, cat1_id, *_ = self.create_test_hierarchy()
+        self.assertEqual(schema_version(self.db.cursor), SCHEMA_VERSION)
+        statements = []
+        self.db.conn.set_trace_callback(statements.append)
+        self.db.setup_database()
+        self.db.conn.set_trace_callback(None)
+        self.assertEqual(statements, ["PRAGMA synchronous=NORMAL", "PRAGMA user_version"])
+
+        # A database from before user_version: old indexes and trigger, no statistics
+        self.db.cursor.execute("DROP INDEX idx_sections_parent")
+        self.db.cursor.execute("CREATE INDEX idx_sections_type ON sections(type)")
+        self.db.cursor.execute("""
+            CREATE TRIGGER maintain_placement_delete AFTER DELETE ON sections
+            BEGIN SELECT 1; END;
+        """)
+        self.db.cursor.execute("DROP TABLE IF EXISTS sqlite_stat1")
+        self.db.cursor.execute("PRAGMA user_version = 0")
+        self.assertEqual(migrate(self.db), [version for version, _, _ in MIGRATIONS])
+        self.assertEqual(migrate(self.db), [])
+
+        self.db.cursor.execute("SELECT type, name FROM sqlite_master WHERE tbl_name = 'sections'")
+        schema = set(self.db.cursor.fetchall())
+        self.assertIn(("index", "idx_sections_parent"), schema)
+        self.assertNotIn(("index", "idx_sections_type"), schema)
+        self.assertNotIn(("trigger", "maintain_placement_delete"), schema)
+        self.db.cursor.execute("SELECT COUNT(*) FROM sqlite_stat1 WHERE idx = 'idx_sections_parent'")
+        self.assertEqual(self.db.cursor.fetchone()[0], 1)
+        self.assertEqual(self.db.count_descendants(header_id), 6)
+        self.assertEqual(self.db.check_tree_integrity(), {})
+
 class TestTreeOperations(TestBase):
     """Test tree manipulation operations"""
     
@@ -123,21 +391,41 @@ class TestTreeOperations(TestBase):
         cat2_id = self.db.add_section("Category 2", "category", header_id)
         cat3_id = self.db.add_section("Category 3", "category", header_id)
         
-        # Test moving up
-        self.db.cursor.execute(
-            """UPDATE sections 
-            SET placement = placement - 1 
-            WHERE id = ? AND parent_id = ?""", 
-            (cat3_id, header_id)
-        )
-        
-        # Verify new positions
-        self.db.cursor.execute(
-            "SELECT placement FROM sections WHERE id = ?", 
-            (cat3_id,)
-        )
-        new_placement = self.db.cursor.fetchone()[0]
-        self.assertEqual(new_placement, 2)
+        # Test moving up: only the moved row gets a new placement
+        self.db.cursor.execute("SELECT id, placement FROM sections")
+        before = dict(self.db.cursor.fetchall())
+        self.assertTrue(self.db.shift_section(cat3_id, -1))
+        self.db.cursor.execute("SELECT id, placement FROM sections")
+        after = dict(self.db.cursor.fetchall())
+        self.assertEqual([i for i in after if after[i] != before[i]], [cat3_id])
+        self.assertEqual(self.db.sibling_ids(header_id), [cat1_id, cat3_id, cat2_id])
+
+        # Test moving down, and the ends of the list
+        self.assertTrue(self.db.shift_section(cat1_id, 1))
+        self.assertEqual(self.db.sibling_ids(header_id), [cat3_id, cat1_id, cat2_id])
+        self.assertFalse(self.db.shift_section(cat3_id, -1))
+        self.assertFalse(self.db.shift_section(cat2_id, 1))
+
+    def test_placement_gaps_rebalance(self):
+        """Test repeated inserts at one spot respace the siblings only when the gap runs out"""
+        header_id = self.db.add_section("Header", "header")
+        first_id = self.db.add_section("First", "category", header_id)
+        last_id = self.db.add_section("Last", "category", header_id)
+        inserted = []
+        for i in range(12):
+            section_id = self.db.add_section(f"Inserted {i}", "category", header_id, 1)
+            self.db.move_section(section_id, header_id, 1)
+            inserted.insert(0, section_id)
+        self.assertEqual(self.db.sibling_ids(header_id), [first_id] + inserted + [last_id])
+        self.db.cursor.execute("SELECT COUNT(DISTINCT placement) FROM sections WHERE parent_id = ?", (header_id,))
+        self.assertEqual(self.db.cursor.fetchone()[0], 14)
+
+        # Deleting leaves a gap rather than shifting the later siblings
+        self.db.cursor.execute("SELECT placement FROM sections WHERE id = ?", (last_id,))
+        placement = self.db.cursor.fetchone()[0]
+        self.db.delete_section(inserted[0])
+        self.db.cursor.execute("SELECT placement FROM sections WHERE id = ?", (last_id,))
+        self.assertEqual(self.db.cursor.fetchone()[0], placement)
 
     def test_move_left_right(self):
         """Test moving sections left and right in hierarchy"""
@@ -159,6 +447,191 @@ class TestTreeOperations(TestBase):
         new_parent = self.db.cursor.fetchone()[0]
         self.assertEqual(new_parent, cat1_id)
 
+    def test_tree_index_follows_moves(self):
+        """Test path and depth stay current through inserts, moves and deletes"""
+        header_id, cat1_id, cat2_id, subcat1_id, subcat2_id = self.create_test_hierarchy()
+        self.assertEqual(self.db.get_ancestors(subcat1_id), [header_id, cat1_id])
+        self.assertEqual(self.db.get_section_level(header_id), 2)
+        self.assertEqual(self.db.count_descendants(cat1_id), 4)
+
+        # Move a subtree under the other category
+        self.db.cursor.execute("UPDATE sections SET parent_id = ? WHERE id = ?", (cat2_id, subcat1_id))
+        self.db.cursor.execute("SELECT id FROM sections WHERE parent_id = ?", (subcat1_id,))
+        subheader_id = self.db.cursor.fetchone()[0]
+        self.assertEqual(self.db.get_ancestors(subheader_id), [header_id, cat2_id, subcat1_id])
+        self.assertEqual(self.db.get_section_level(subheader_id), 5)
+        self.assertEqual(self.db.count_descendants(cat1_id), 1)
+        self.assertEqual(self.db.count_descendants(cat2_id), 3)
+
+        # Delete uses the same range and leaves the sibling subtree alone
+        self.db.delete_section(cat2_id)
+        self.db.cursor.execute("SELECT id FROM sections ORDER BY id")
+        self.assertEqual([row[0] for row in self.db.cursor.fetchall()], [header_id, cat1_id, subcat2_id])
+
+    def test_tree_index_rebuild(self):
+        """Test rebuilding the index restores paths lost to edits that bypass it"""
+        header_id, cat1_id, _, subcat1_id, _ = self.create_test_hierarchy()
+        self.db.cursor.execute("SELECT id, path, depth FROM sections ORDER BY id")
+        indexed = self.db.cursor.fetchall()
+        self.db.cursor.execute("UPDATE sections SET path = NULL, depth = NULL")
+        self.db.conn.commit()
+        self.assertEqual(self.db.rebuild_tree_index(), 7)
+        self.db.cursor.execute("SELECT id, path, depth FROM sections ORDER BY id")
+        self.assertEqual(self.db.cursor.fetchall(), indexed)
+        self.assertEqual(self.db.get_ancestors(subcat1_id), [header_id, cat1_id])
+
+    def test_numbering_sync_uses_structure_version(self):
+        """Test numbering is reused until the structure changes, here or in another connection"""
+        header_id = self.db.add_section("Header", "header")
+        cat1_id = self.db.add_section("Category 1", "category", header_id, 1)
+        cat2_id = self.db.add_section("Category 2", "category", header_id, 2)
+        numbering = self.db.numbering
+        numbering.rebuild()
+        self.assertEqual((numbering.numbers[cat1_id], numbering.numbers[cat2_id]), ("1.1", "1.2"))
+
+        statements = []
+        self.db.conn.set_trace_callback(statements.append)
+        self.assertEqual(numbering.sync(), {})
+        self.db.conn.set_trace_callback(None)
+        self.assertEqual(statements, ["PRAGMA data_version"])
+
+        # Title and note edits don't change the structure
+        version = self.db.structure_version()
+        self.db.update_section(cat1_id, "Renamed", "note")
+        self.assertEqual(self.db.structure_version(), version)
+
+        self.db.swap_placement(cat1_id, cat2_id)
+        self.assertGreater(self.db.structure_version(), version)
+        self.assertEqual(numbering.sync(), {cat1_id: "1.2", cat2_id: "1.1"})
+
+        other = DatabaseHandler(self.test_db_path)
+        other.unlock(self.test_password)
+        second_id = other.add_section("Second Header", "header")
+        other.close()
+        self.assertEqual(numbering.sync(), {second_id: "2"})
+
+    def test_clean_startup_skips_tree_check(self):
+        """Test a cleanly closed, current database opens without scanning or rewriting the tree"""
+        self.create_test_hierarchy()
+        self.assertEqual(self.db.ensure_tree_integrity(), {})
+        self.db.close()
+
+        self.db = DatabaseHandler(self.test_db_path)
+        self.db.unlock(self.test_password)
+        self.db.setup_database()
+        statements = []
+        self.db.conn.set_trace_callback(statements.append)
+        self.assertIsNone(self.db.ensure_tree_integrity())
+        self.db.conn.set_trace_callback(None)
+        self.assertFalse([sql for sql in statements if "sections" in sql])
+
+    def test_unclean_exit_repairs_tree(self):
+        """Test orphans and duplicate placements left by a crash are repaired on the next start"""
+        header_id, cat1_id, cat2_id, _, _ = self.create_test_hierarchy()
+        self.db.ensure_tree_integrity()
+        self.db.cursor.execute("UPDATE sections SET placement = 5 WHERE parent_id = ?", (header_id,))
+        self.db.cursor.execute(
+            "INSERT INTO sections (title, type, parent_id, placement) VALUES ('Lost', 'category', 9999, 1)"
+        )
+        self.db.conn.commit()
+        orphan_id = self.db.cursor.lastrowid
+        self.assertEqual(
+            set(self.db.check_tree_integrity()), {"orphans", "duplicate placements"}
+        )
+        # Simulate a crash: the session flag set by ensure_tree_integrity is never cleared
+        self.db.conn.close()
+
+        self.db = DatabaseHandler(self.test_db_path)
+        self.db.unlock(self.test_password)
+        self.db.setup_database()
+        self.assertIn("orphans", self.db.ensure_tree_integrity())
+        self.assertEqual(self.db.check_tree_integrity(), {})
+        self.db.cursor.execute("SELECT parent_id FROM sections WHERE id = ?", (orphan_id,))
+        self.assertIsNone(self.db.cursor.fetchone()[0])
+        self.assertEqual(self.db.sibling_ids(header_id), [cat1_id, cat2_id])
+
+class TestNumbering(TestBase):
+    """Test the incremental numbering service"""
+
+    def build_outline(self):
+        """Three chapters with three sections each, and one subsection"""
+        chapters = [self.db.add_section(f"Chapter {i}", "header", None, i) for i in range(1, 4)]
+        sections = {
+            chapter_id: [self.db.add_section(f"Section {i}", "category", chapter_id, i) for i in range(1, 4)]
+            for chapter_id in chapters
+        }
+        subsection_id = self.db.add_section("Subsection", "subcategory", sections[chapters[0]][2], 1)
+        return chapters, sections, subsection_id
+
+    def assert_matches_full_build(self, numbering):
+        full_build = NumberingService(self.db)
+        full_build.rebuild()
+        self.assertEqual(numbering.numbers, full_build.numbers)
+
+    def test_reorder_renumbers_one_sibling_list(self):
+        """Test swapping two sections only reports their numbers and their subtrees"""
+        chapters, sections, subsection_id = self.build_outline()
+        numbering = self.db.numbering
+        numbering.rebuild()
+        second, third = sections[chapters[0]][1:]
+        self.db.swap_placement(second, third)
+        diff = numbering.reordered(chapters[0])
+        self.assertEqual(diff, {third: "1.2", second: "1.3", subsection_id: "1.2.1"})
+        self.assertEqual(numbering.sync(), {})
+        self.assert_matches_full_build(numbering)
+
+    def test_insert_delete_and_reparent(self):
+        """Test each mutation leaves the same numbers as a full rebuild"""
+        chapters, sections, subsection_id = self.build_outline()
+        numbering = self.db.numbering
+        numbering.rebuild()
+
+        new_id = self.db.add_section("Appendix", "header", None, 4)
+        self.assertEqual(numbering.inserted(new_id, None), {new_id: "4"})
+
+        self.db.delete_section(chapters[0])
+        diff = numbering.deleted(chapters[0])
+        self.assertIsNone(diff[subsection_id])
+        self.assertEqual(diff[chapters[1]], "1")
+        self.assertEqual(diff[sections[chapters[1]][0]], "1.1")
+        self.assertNotIn(subsection_id, numbering.numbers)
+        self.assert_matches_full_build(numbering)
+
+        moved_id = sections[chapters[2]][0]
+        self.db.cursor.execute("UPDATE sections SET parent_id = ?, placement = 4 WHERE id = ?", (chapters[1], moved_id))
+        self.db.fix_placement(chapters[2])
+        self.db.conn.commit()
+        diff = numbering.reparented(moved_id, chapters[2], chapters[1])
+        self.assertEqual(diff[moved_id], "1.4")
+        self.assertNotIn(chapters[1], diff)
+        self.assert_matches_full_build(numbering)
+
+        # Changes made behind the service's back are caught by sync
+        self.db.cursor.execute("DELETE FROM sections WHERE id = ?", (new_id,))
+        self.db.conn.commit()
+        self.assertEqual(numbering.sync(), {new_id: None})
+
+    def test_editor_edits_never_rebuild(self):
+        """Test adding and indenting/outdenting as the editor does renumber without a full rebuild"""
+        chapters, sections, subsection_id = self.build_outline()
+        numbering = self.db.numbering
+        numbering.rebuild()
+        with patch.object(numbering, 'rebuild', wraps=numbering.rebuild) as rebuild:
+            # add_section: a new last child
+            new_id = self.db.add_section("Section 4", "category", chapters[1], self.db.next_placement(chapters[1]))
+            self.assertEqual(numbering.inserted(new_id, chapters[1]), {new_id: "2.4"})
+            # move_right: under the previous sibling, as its last child
+            moved_id = sections[chapters[1]][1]
+            self.db.move_section(moved_id, sections[chapters[1]][0], 0, "subcategory")
+            diff = numbering.reparented(moved_id, chapters[1], sections[chapters[1]][0])
+            self.assertEqual(diff[moved_id], "2.1.1")
+            # move_left: right after its old parent
+            self.db.move_section(moved_id, chapters[1], 1, "category")
+            self.assertEqual(numbering.reparented(moved_id, sections[chapters[1]][0], chapters[1])[moved_id], "2.2")
+            self.assertEqual(numbering.sync(), {})
+        self.assertEqual(rebuild.call_count, 0)
+        self.assert_matches_full_build(numbering)
+
 class TestEncryption(TestBase):
     """Test encryption operations"""
     
@@ -166,7 +639,7 @@ class TestEncryption(TestBase):
         """Test changing database password"""
         # Add test data
         section_id = self.db.add_section("Test Section", "header")
-        original_questions = json.dumps(["Original Question"])
+        original_questions = "Original Question"
         self.db.update_section(section_id, "Test Section", original_questions)
         
         # Change password
@@ -177,13 +650,16 @@ class TestEncryption(TestBase):
         new_encryption_manager = EncryptionManager(new_password)
         self.db.encryption_manager = new_encryption_manager
         
-        self.db.cursor.execute("SELECT title, questions FROM sections WHERE id = ?", (section_id,))
+        self.db.cursor.execute("""
+            SELECT s.title, c.questions FROM sections s
+            JOIN section_content c ON c.section_id = s.id WHERE s.id = ?
+        """, (section_id,))
         row = self.db.cursor.fetchone()
         decrypted_title = self.db.decrypt_safely(row[0])
-        decrypted_questions = self.db.decrypt_safely(row[1])
+        decrypted_questions = self.db.decrypt_notes([row[1]])[0]
         
         self.assertEqual(decrypted_title, "Test Section")
-        self.assertEqual(json.loads(decrypted_questions), json.loads(original_questions))
+        self.assertEqual(decrypted_questions, original_questions)
 
     def test_encryption_strength(self):
         """Test encryption strength and uniqueness"""
@@ -203,6 +679,449 @@ class TestEncryption(TestBase):
         self.assertEqual(decrypted1, test_title)
         self.assertEqual(decrypted2, test_title)
 
+    def test_legacy_format_still_decrypts(self):
+        """Test rows written before the v1 format remain readable"""
+        legacy = make_legacy_ciphertext(self.test_password, "Old Title")
+        self.assertFalse(legacy.startswith(FORMAT_V1_PREFIX))
+        self.assertEqual(self.encryption_manager.decrypt_string(legacy), "Old Title")
+
+    def test_single_kdf_run_for_many_salts(self):
+        """Test per-record salts are HKDF expansions of one unlocked master key"""
+        from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+
+        with patch("manager_encryption.PBKDF2HMAC", wraps=PBKDF2HMAC) as kdf:
+            manager = EncryptionManager(self.test_password)
+            self.db.encryption_manager = manager
+            encrypted = [manager.encrypt_string(f"Record {i}", critical=True) for i in range(25)]
+            decrypted = [manager.decrypt_string(value) for value in encrypted]
+
+        self.assertEqual(decrypted, [f"Record {i}" for i in range(25)])
+        self.assertEqual(kdf.call_count, 1)
+
+    def test_master_salt_persisted_per_database(self):
+        """Test a new manager for the same database reads earlier records"""
+        section_id = self.db.add_section("Persistent Title", "header")
+
+        self.db.encryption_manager = EncryptionManager(self.test_password)
+
+        self.assertEqual(self.db.get_section_title(section_id), "Persistent Title")
+
+    def test_password_change_rewraps_key_only(self):
+        """Test changing the password leaves row ciphertext untouched"""
+        section_id = self.db.add_section("Wrapped Section", "header")
+        self.db.cursor.execute("SELECT title FROM sections WHERE id = ?", (section_id,))
+        before = self.db.cursor.fetchone()[0]
+
+        self.db.change_password(self.test_password, "AnotherPassword1!")
+
+        self.db.cursor.execute("SELECT title FROM sections WHERE id = ?", (section_id,))
+        self.assertEqual(self.db.cursor.fetchone()[0], before)
+        self.assertFalse(self.db.validate_password(self.test_password))
+        self.assertTrue(self.db.validate_password("AnotherPassword1!"))
+        self.assertEqual(self.db.get_section_title(section_id), "Wrapped Section")
+
+    def test_multiple_passwords_unlock_same_database(self):
+        """Test an added password opens the same data key"""
+        section_id = self.db.add_section("Shared Section", "header")
+        self.db.add_password("SecondPassword1!")
+
+        self.assertTrue(self.db.validate_password("SecondPassword1!"))
+        self.assertEqual(self.db.get_section_title(section_id), "Shared Section")
+        self.assertTrue(self.db.validate_password(self.test_password))
+
+    def test_legacy_database_migrates_to_key_slots(self):
+        """Test a hash-only database is converted once on first unlock"""
+        self.db.cursor.execute("DELETE FROM settings")
+        self.db.cursor.execute(
+            "INSERT INTO settings (key, value) VALUES ('password', ?)",
+            (hashlib.sha256(self.test_password.encode()).hexdigest(),)
+        )
+        self.db.cursor.execute(
+            "INSERT INTO sections (title, type, placement) VALUES (?, 'header', 1)",
+            (make_legacy_ciphertext(self.test_password, "Legacy Header"),)
+        )
+        self.db.cursor.execute(
+            "INSERT INTO section_content (section_id, questions) VALUES (?, ?)",
+            (self.db.cursor.lastrowid, make_legacy_ciphertext(self.test_password, json.dumps(["Legacy note"])))
+        )
+        self.db.conn.commit()
+
+        self.assertTrue(self.db.validate_password(self.test_password))
+
+        self.db.cursor.execute("SELECT value FROM settings WHERE key = 'password'")
+        self.assertNotEqual(self.db.cursor.fetchone()[0], hashlib.sha256(self.test_password.encode()).hexdigest())
+        # Rows move to the data key through the re-encryption job
+        self.assertTrue(self.db.has_pending_reencryption())
+        self.db.run_reencryption()
+        self.assertFalse(self.db.has_pending_reencryption())
+        self.db.cursor.execute(SECTION_CONTENT_QUERY)
+        title, questions = self.db.cursor.fetchone()
+        self.assertTrue(self.db.encryption_manager.is_current_format(title))
+        self.assertEqual(self.db.decrypt_safely(title), "Legacy Header")
+        self.assertEqual(self.db.decrypt_notes([questions])[0], "Legacy note")
+
+    def test_decrypt_many_matches_decrypt_string(self):
+        """Test the batch API agrees with per-value calls, including empty values"""
+        values = self.encryption_manager.encrypt_many(["Alpha", "Beta", "Gamma"], critical=True)
+        values += [make_legacy_ciphertext(self.test_password, "Legacy"), "", None]
+        expected = [self.encryption_manager.decrypt_string(value) for value in values]
+        self.assertEqual(self.encryption_manager.decrypt_many(values), expected)
+        self.assertEqual(expected[:4], ["Alpha", "Beta", "Gamma", "Legacy"])
+
+    def test_decrypt_many_worker_pool(self):
+        """Test large batches round-trip through worker processes in order"""
+        manager = EncryptionManager(self.test_password)
+        self.db.encryption_manager = manager
+        manager.workers = 2
+        manager.parallel_min_items = 10
+        try:
+            plain = [f"Record {i}" for i in range(40)]
+            encrypted = manager.encrypt_many(plain, critical=True)
+            self.assertIsNotNone(manager._pool)
+            self.assertEqual(manager.decrypt_many(encrypted), plain)
+        finally:
+            manager.shutdown_pool()
+
+    def test_worker_pool_shared_across_threads(self):
+        """Test a background batch and a shutdown on another thread neither lose results nor leak a pool"""
+        manager = EncryptionManager(self.test_password)
+        self.db.encryption_manager = manager
+        manager.workers = 2
+        manager.parallel_min_items = 10
+        plain = [f"Record {i}" for i in range(40)]
+        encrypted = manager.encrypt_many(plain)
+        results = []
+
+        def background():
+            for _ in range(3):
+                results.append(manager.decrypt_many(encrypted))
+
+        try:
+            worker = threading.Thread(target=background)
+            worker.start()
+            for _ in range(3):
+                results.append(manager.decrypt_many(encrypted))
+                manager.shutdown_pool()
+            worker.join()
+        finally:
+            manager.shutdown_pool()
+        self.assertEqual(results, [plain] * 6)
+        self.assertIsNone(manager._pool)
+        self.assertEqual(manager._pool_batches, 0)
+
+    def test_key_caches_are_per_manager(self):
+        """Test derived keys live on the manager, so dropping or locking it releases them"""
+        import gc
+        import weakref
+        manager = EncryptionManager(self.test_password)
+        self.db.encryption_manager = manager
+        encrypted = manager.encrypt_string("Title")
+        self.assertEqual(manager.decrypt_string(make_legacy_ciphertext(self.test_password, "Old")), "Old")
+        self.assertTrue(manager._record_keys and manager._derived_keys)
+
+        manager.lock()
+        self.assertFalse(manager._record_keys or manager._derived_keys or manager._master_keys)
+        self.assertEqual(manager.decrypt_string(encrypted), "")
+
+        released = weakref.ref(manager)
+        self.db.encryption_manager = self.encryption_manager
+        del manager
+        gc.collect()
+        self.assertIsNone(released())
+
+    def test_v2_binary_format(self):
+        """Test new values are compact AES-GCM BLOBs that reject tampering"""
+        encrypted = self.encryption_manager.encrypt_string("Title")
+        self.assertIsInstance(encrypted, bytes)
+        self.assertLess(len(encrypted), 40)
+        self.assertEqual(self.encryption_manager.decrypt_string(encrypted), "Title")
+
+        tampered = encrypted[:-1] + bytes([encrypted[-1] ^ 1])
+        self.assertEqual(self.encryption_manager.decrypt_string(tampered), "")
+
+    def test_background_ciphertext_migration(self):
+        """Test text-format rows are rewritten as v2 in committed chunks"""
+        ids = []
+        for i in range(5):
+            section_id = self.db.add_section(f"Section {i}", "header")
+            legacy_title = make_legacy_ciphertext(self.test_password, f"Legacy {i}")
+            self.db.cursor.execute("UPDATE sections SET title = ? WHERE id = ?", (legacy_title, section_id))
+            ids.append(section_id)
+        self.db.conn.commit()
+
+        self.assertTrue(self.db.queue_format_upgrade())
+        self.assertTrue(self.db.reencrypt_step(chunk_size=2))
+        # Mixed databases keep working mid-migration
+        self.assertEqual(self.db.get_section_title(ids[4]), "Legacy 4")
+
+        self.db.run_reencryption(chunk_size=2)
+
+        self.db.cursor.execute(
+            f"SELECT COUNT(*) FROM ({SECTION_CONTENT_QUERY}) WHERE typeof(title) = 'text' OR typeof(questions) = 'text'"
+        )
+        self.assertEqual(self.db.cursor.fetchone()[0], 0)
+        for i, section_id in enumerate(ids):
+            self.assertEqual(self.db.get_section_title(section_id), f"Legacy {i}")
+        self.assertFalse(self.db.queue_format_upgrade())
+
+    def test_key_rotation_resumes_after_restart(self):
+        """Test a rotation job survives reopening the database mid-way"""
+        ids = [self.db.add_section(f"Rotate {i}", "header") for i in range(5)]
+        self.db.add_password("SecondPassword!")
+        old_key_id = self.db.encryption_manager.key_id
+
+        self.db.change_password(self.test_password, "NewPassword123!", rotate_key=True)
+        self.assertTrue(self.db.reencrypt_step(chunk_size=2))
+        self.db.close()
+
+        # Reopen: the new password opens both keys, so every row reads
+        self.db = DatabaseHandler(self.test_db_path)
+        manager = self.db.unlock("NewPassword123!")
+        self.assertIsNotNone(manager)
+        self.assertNotEqual(manager.key_id, old_key_id)
+        for i, section_id in enumerate(ids):
+            self.assertEqual(self.db.get_section_title(section_id), f"Rotate {i}")
+
+        self.db.run_reencryption(chunk_size=2)
+        self.db.cursor.execute(SECTION_CONTENT_QUERY)
+        for title, questions in self.db.cursor.fetchall():
+            self.assertTrue(manager.is_current_format(title))
+            self.assertTrue(manager.is_current_format(questions))
+        # Only the new key's slot is left; the second password went with the old key
+        self.assertEqual(len(self.db._load_key_slots()), 1)
+        self.assertFalse(self.db.validate_password("SecondPassword!"))
+
+    def test_unlock_runs_one_kdf(self):
+        """Test unlocking and sharing the manager derives the key exactly once"""
+        from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+
+        section_id = self.db.add_section("Unlock Me", "header")
+        self.db.close()
+
+        with patch("manager_encryption.PBKDF2HMAC", wraps=PBKDF2HMAC) as kdf:
+            self.db = DatabaseHandler(self.test_db_path)
+            manager = self.db.unlock(self.test_password)
+            self.assertIsNotNone(manager)
+            # Handing the same manager back (as the app does) is free
+            self.db.encryption_manager = manager
+            self.assertTrue(self.db.validate_password(self.test_password))
+            self.assertEqual(self.db.get_section_title(section_id), "Unlock Me")
+
+        self.assertEqual(kdf.call_count, 1)
+        self.assertIsNone(self.db.unlock("wrong password"))
+        self.assertIs(self.db.encryption_manager, manager)
+
+    def test_kdf_calibration(self):
+        """Test calibrated parameters scale with the target and respect the floors"""
+        quick = calibrate_kdf("pbkdf2-sha256", target_ms=1)
+        self.assertEqual(quick, DEFAULT_KDF_PARAMS)
+        slow = calibrate_kdf("pbkdf2-sha256", target_ms=2000)
+        self.assertGreater(slow["iterations"], quick["iterations"])
+        scrypt = calibrate_kdf("scrypt", target_ms=1)
+        self.assertEqual(scrypt["n"], 2 ** 14)
+
+    def test_kdf_params_stored_per_database(self):
+        """Test slots use the database's KDF settings and can be retuned"""
+        self.db.save_kdf_params({"kdf": "scrypt", "n": 2 ** 14, "r": 8, "p": 1})
+        self.db.set_password(self.test_password)
+        slot = next(iter(self.db._load_key_slots().values()))
+        self.assertEqual((slot["kdf"], slot["n"]), ("scrypt", 2 ** 14))
+
+        self.db.close()
+        self.db = DatabaseHandler(self.test_db_path)
+        self.assertIsNotNone(self.db.unlock(self.test_password))
+
+        params = self.db.retune_kdf(self.test_password, target_ms=1, kdf="pbkdf2-sha256")
+        slot = next(iter(self.db._load_key_slots().values()))
+        self.assertEqual((slot["kdf"], slot["iterations"]), ("pbkdf2-sha256", params["iterations"]))
+        self.assertTrue(self.db.validate_password(self.test_password))
+
+    def test_weakened_key_slot_rejected(self):
+        """Test a slot edited down to fewer iterations no longer unlocks"""
+        name, slot = self.db._load_key_slots().popitem()
+        slot["iterations"] = 1000
+        self.db._write_key_slots({name: slot})
+        self.db.conn.commit()
+        other = DatabaseHandler(self.test_db_path)
+        self.assertIsNone(other.unlock(self.test_password))
+        other.close()
+
+
+class TestNotePayload(TestBase):
+    """Test the v2 note payload"""
+
+    def test_large_note_compressed(self):
+        """Test long repetitive notes are stored compressed and read back intact"""
+        runbook = "\n".join(f"step {i}: restart the service and check the logs" for i in range(500))
+        self.assertEqual(encode_note(runbook)[0], NOTE_ZLIB)
+        self.assertLess(len(encode_note(runbook)), len(runbook) // 4)
+        self.assertEqual(encode_note("short")[0], NOTE_RAW)
+
+        section_id = self.db.add_section("Runbook", "header")
+        self.db.update_section(section_id, "Runbook", runbook)
+        self.db.plaintext_cache.clear()
+        self.assertEqual(self.db.get_section_content(section_id), ("Runbook", runbook))
+
+    def test_json_list_notes_still_load(self):
+        """Test notes saved as a JSON list of lines read back as text"""
+        section_id = self.db.add_section("Old", "header")
+        self.db.cursor.execute(
+            "UPDATE section_content SET questions = ? WHERE section_id = ?",
+            (self.db.encryption_manager.encrypt_string(json.dumps(["line 1", "", "line 3"])), section_id)
+        )
+        self.assertEqual(self.db.get_section_content(section_id)[1], "line 1\n\nline 3")
+        self.assertEqual(note_lines("line 1\n\nline 3"), ["line 1", "", "line 3"])
+        self.assertEqual(note_lines(""), [])
+
+    def test_inline_notes_move_to_section_content(self):
+        """Test notes stored in the sections row move to section_content on setup"""
+        section_id = self.db.add_section("Inline", "header")
+        self.db.update_section(section_id, "Inline", "note kept in the row")
+        # Recreate the old layout: the note in sections.questions, no content table
+        self.db.cursor.execute("ALTER TABLE sections ADD COLUMN questions TEXT DEFAULT '[]'")
+        self.db.cursor.execute("""
+            UPDATE sections SET questions = (
+                SELECT questions FROM section_content WHERE section_id = sections.id
+            )
+        """)
+        self.db.cursor.execute("DROP TABLE section_content")
+        # Databases that old predate PRAGMA user_version, so every migration runs again
+        self.db.cursor.execute("PRAGMA user_version = 0")
+        self.db.conn.commit()
+
+        self.db.setup_database()
+        self.db.cursor.execute("PRAGMA table_info(sections)")
+        self.assertNotIn("questions", {row[1] for row in self.db.cursor.fetchall()})
+        self.db.plaintext_cache.clear()
+        self.assertEqual(self.db.get_section_content(section_id), ("Inline", "note kept in the row"))
+
+        self.db.delete_section(section_id)
+        self.db.cursor.execute("SELECT COUNT(*) FROM section_content")
+        self.assertEqual(self.db.cursor.fetchone()[0], 0)
+
+
+class TestChunkedNotes(TestBase):
+    """Test large notes stored as content-defined chunks"""
+
+    def make_note(self, lines=3000):
+        return "\n".join(f"{i}: check the backup of host-{i % 97} and rotate its logs" for i in range(lines))
+
+    def stored_chunks(self, section_id):
+        self.db.cursor.execute("SELECT digest, data FROM section_chunks WHERE section_id = ?", (section_id,))
+        return dict(self.db.cursor.fetchall())
+
+    def test_chunk_boundaries_are_local(self):
+        """Test an insert in the middle only changes the chunks around it"""
+        note = self.make_note().encode('utf-8')
+        edited = note[:len(note) // 2] + b"a new line in the middle\n" + note[len(note) // 2:]
+        before, after = split_note(note), split_note(edited)
+        self.assertEqual(b"".join(after), edited)
+        self.assertGreater(len(before), 10)
+        self.assertLessEqual(len(set(after) - set(before)), 2)
+
+    def test_large_note_round_trip(self):
+        """Test a chunked note reads back whole, streamed or not"""
+        note = self.make_note() + "\n" + "é" * 70000
+        section_id = self.db.add_section("Large", "header")
+        self.db.update_section(section_id, "Large", note)
+        self.assertGreater(len(self.stored_chunks(section_id)), 1)
+        self.db.cursor.execute("SELECT questions FROM section_content WHERE section_id = ?", (section_id,))
+        manifest = self.db.encryption_manager.decrypt_bytes(self.db.cursor.fetchone()[0])
+        self.assertEqual(manifest[0], NOTE_CHUNKED)
+
+        self.db.plaintext_cache.clear()
+        pieces = list(self.db.iter_note(section_id))
+        self.assertGreater(len(pieces), 1)
+        self.assertEqual("".join(pieces), note)
+        self.db.plaintext_cache.clear()
+        self.assertEqual(self.db.get_section_content(section_id), ("Large", note))
+
+    def test_save_rewrites_only_changed_chunks(self):
+        """Test editing one spot of a large note leaves the other chunk rows untouched"""
+        note = self.make_note()
+        section_id = self.db.add_section("Large", "header")
+        self.db.update_section(section_id, "Large", note)
+        before = self.stored_chunks(section_id)
+
+        edited = note.replace("1500: check", "1500: CHECK")
+        self.db.update_section(section_id, "Large", edited)
+        after = self.stored_chunks(section_id)
+        self.assertEqual(len(set(after) - set(before)), 1)
+        kept = set(after) & set(before)
+        self.assertEqual(len(kept), len(after) - 1)
+        self.assertTrue(all(after[digest] == before[digest] for digest in kept))
+        self.db.plaintext_cache.clear()
+        self.assertEqual(self.db.get_section_content(section_id)[1], edited)
+
+        # Shrinking below the threshold goes back to a single value
+        self.db.update_section(section_id, "Large", "short")
+        self.assertEqual(self.stored_chunks(section_id), {})
+
+    def test_chunks_follow_delete_copy_and_rotation(self):
+        """Test chunks are deleted with their section, copied with it, and re-encrypted"""
+        note = self.make_note()
+        section_id = self.db.add_section("Large", "header")
+        copy_id = self.db.add_section("Copy", "header")
+        self.db.update_section(section_id, "Large", note)
+        self.db.copy_note(section_id, copy_id)
+        self.db.delete_section(section_id)
+        self.assertEqual(self.stored_chunks(section_id), {})
+        self.assertEqual(self.db.get_section_content(copy_id)[1], note)
+
+        new_password = "AnotherPassword456!"
+        self.db.change_password(self.test_password, new_password, rotate_key=True)
+        self.db.run_reencryption()
+        self.db.close()
+        self.db = DatabaseHandler(self.test_db_path)
+        self.assertIsNotNone(self.db.unlock(new_password))
+        self.assertEqual(self.db.get_section_content(copy_id)[1], note)
+
+
+class TestPlaintextCache(TestBase):
+    """Test the decrypted-content cache"""
+
+    def test_reads_hit_cache_after_write(self):
+        """Test add/update write through so reads don't decrypt again"""
+        section_id = self.db.add_section("Cached", "header")
+        self.db.update_section(section_id, "Cached Title", json.dumps(["note"]))
+        with patch.object(self.db, "decrypt_many", wraps=self.db.decrypt_many) as decrypt:
+            self.assertEqual(self.db.get_section_content(section_id), ("Cached Title", json.dumps(["note"])))
+            self.assertEqual(self.db.get_section_title(section_id), "Cached Title")
+        decrypt.assert_not_called()
+        self.assertGreater(self.db.cache_stats()["hit_rate"], 0)
+
+    def test_stale_ciphertext_is_a_miss(self):
+        """Test a row rewritten behind the cache is decrypted again"""
+        section_id = self.db.add_section("Before", "header")
+        self.db.cursor.execute(
+            "UPDATE sections SET title = ? WHERE id = ?",
+            (self.db.encryption_manager.encrypt_string("After"), section_id)
+        )
+        self.assertEqual(self.db.get_section_title(section_id), "After")
+
+    def test_delete_invalidates_descendants(self):
+        """Test deleting a subtree drops its cached plaintext"""
+        header_id, cat1_id, *_ = self.create_test_hierarchy()
+        self.db.refresh_search_cache(header_id)
+        entries = self.db.cache_stats()["entries"]
+        self.db.delete_section(cat1_id)
+        self.assertEqual(self.db.cache_stats()["entries"], entries - 10)
+        ids, _ = self.db.search_sections("Subheader")
+        self.assertEqual(ids, set())
+
+    def test_byte_budget_and_ttl(self):
+        """Test least recently used entries go first and old entries expire"""
+        cache = PlaintextCache(max_bytes=3 * sys.getsizeof("x" * 100), ttl=60)
+        for section_id in range(4):
+            cache.put(section_id, "title", f"cipher{section_id}", "x" * 100)
+        self.assertIsNone(cache.get(0, "title", "cipher0"))
+        self.assertEqual(cache.get(3, "title", "cipher3"), "x" * 100)
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+        cache.ttl = 0
+        self.assertIsNone(cache.get(3, "title", "cipher3"))
+
+
 class TestSearch(TestBase):
     """Test search functionality"""
     
@@ -218,8 +1137,7 @@ class TestSearch(TestBase):
     def test_search_questions(self):
         """Test searching question content"""
         header_id = self.db.add_section("Test Header", "header")
-        self.db.update_section(header_id, "Test Header", 
-                             json.dumps(["Sample question about Python"]))
+        self.db.update_section(header_id, "Test Header", "Sample question about Python")
         
         # Search for "Python"
         ids_to_show, parents_to_show = self.db.search_sections("Python")
@@ -261,6 +1179,137 @@ class TestExport(TestBase):
         self.assertTrue(os.path.exists(test_pdf))
         self.assertTrue(os.path.getsize(test_pdf) > 0)
 
+    def test_export_subtree(self):
+        """Test DB export copies ciphertext with the same password and re-encrypts with a new one"""
+        header_id, cat1_id, _, subcat1_id, *_ = self.create_test_hierarchy()
+        big_note = "".join(f"line {i}\n" for i in range(3000))
+        self.db.update_section(subcat1_id, "Subcategory 1", big_note)
+        self.db.cursor.execute("SELECT title FROM sections WHERE id = ?", (cat1_id,))
+        stored_title = self.db.cursor.fetchone()[0]
+
+        for password, copied in [(self.test_password, True), ("ExportPassword!", False)]:
+            export_path = os.path.join(self.test_dir, "export.db")
+            self.assertEqual(self.db.export_subtree(cat1_id, export_path, password), 5)
+
+            exported = DatabaseHandler(export_path, None)
+            try:
+                self.assertIsNotNone(exported.unlock(password))
+                self.assertIsNone(exported.unlock("wrong password"))
+                self.assertEqual(exported.sibling_ids(None), [cat1_id] if copied else [1])
+                root_id = exported.sibling_ids(None)[0]
+                self.assertEqual(exported.get_section_title(root_id), "Category 1")
+                self.assertEqual(exported.count_descendants(root_id), 4)
+                self.assertEqual(exported.check_tree_integrity(), {})
+                self.assertEqual(
+                    [exported.get_section_content(child_id) for child_id in exported.sibling_ids(root_id)],
+                    [("Subcategory 1", big_note), ("Subcategory 2", "")]
+                )
+                exported.cursor.execute("SELECT title FROM sections WHERE id = ?", (root_id,))
+                self.assertEqual(exported.cursor.fetchone()[0] == stored_title, copied)
+            finally:
+                exported.close()
+                os.remove(export_path)
+
+    def test_backup_and_compacted_copy(self):
+        """Test whole-database copies: one consistent snapshot, checked, opening with the same password"""
+        header_id, cat1_id, *_ = self.create_test_hierarchy()
+        self.db.ensure_tree_integrity()  # marks the session open, as the app does
+        self.db.writes.scheduler = lambda delay_ms, callback: None
+        self.db.writes.save(cat1_id, "Renamed", "pending note")  # flushed before copying
+        fillers = [self.db.add_section(f"Filler {i}", "category", header_id) for i in range(200)]
+        for section_id in fillers[::4]:
+            self.db.delete_section(section_id)  # leaves free pages for VACUUM INTO to drop
+
+        self.db.cursor.execute("SELECT COUNT(*) FROM sections")
+        count = self.db.cursor.fetchone()[0]
+        writes_during_backup = []
+
+        def progress(copied, total):
+            # The writer isn't blocked, and what it commits now isn't in the copy
+            if not writes_during_backup:
+                writes_during_backup.append(self.db.add_section("Too late", "header"))
+            self.assertLessEqual(copied, total)
+
+        backup_path = os.path.join(self.test_dir, "backup.db")
+        compact_path = os.path.join(self.test_dir, "compact.db")
+        with patch('manager_backup.BACKUP_PAGES_PER_STEP', 1):
+            self.assertEqual(self.db.backups.backup(backup_path, progress), backup_path)
+        self.assertEqual(len(writes_during_backup), 1)
+        self.assertEqual(self.db.backups.vacuum_into(compact_path), compact_path)
+        self.assertLess(os.path.getsize(compact_path), os.path.getsize(backup_path))
+
+        for path, sections in [(backup_path, count), (compact_path, count + 1)]:
+            # The live session's marker isn't copied, so the copy opens without the full check
+            conn = sqlite3.connect(path)
+            rows = conn.execute("SELECT key FROM settings WHERE key = 'session_open'").fetchall()
+            conn.close()
+            self.assertEqual(rows, [])
+            copy = DatabaseHandler(path, None)
+            try:
+                self.assertIsNotNone(copy.unlock(self.test_password))
+                copy.cursor.execute("SELECT COUNT(*) FROM sections")
+                self.assertEqual(copy.cursor.fetchone()[0], sections)
+                self.assertEqual(copy.get_section_content(cat1_id), ("Renamed", "pending note"))
+                self.assertEqual(copy.check_tree_integrity(), {})
+            finally:
+                copy.close()
+            self.assertEqual(verify_copy(path), [])
+            self.assertFalse(os.path.exists(path + ".part"))
+
+        with self.assertRaises(ValueError):
+            self.db.backups.backup(self.test_db_path)
+
+    def test_backup_rotation(self):
+        """Test timestamped backups run on a worker thread and only the newest are kept"""
+        self.create_test_hierarchy()
+        backup_dir = self.db.backups.backup_dir()
+        self.addCleanup(shutil.rmtree, backup_dir, True)
+        os.makedirs(backup_dir, exist_ok=True)
+        old_backups = [os.path.join(backup_dir, f"test.2020.01.0{day}_120000.db") for day in range(1, 4)]
+        for path in old_backups:
+            with open(path, "wb"):
+                pass
+        unrelated = os.path.join(backup_dir, "notes.2020.01.01_120000.db")
+        with open(unrelated, "wb"):
+            pass
+
+        job = self.db.backups.start_rotating_backup()
+        job.thread.join()
+        self.assertIsNone(job.error)
+        self.assertTrue(job.done())
+        self.assertEqual(verify_copy(job.result), [])
+        self.assertEqual(self.db.backups.list_backups(), old_backups + [job.result])
+
+        # Backups in the same second, one still running, get distinct names in order
+        with patch('manager_backup.time.strftime', return_value="2020.01.04_120000"):
+            jobs = [self.db.backups.start_rotating_backup() for _ in range(3)]
+        for same_second in jobs:
+            same_second.thread.join()
+            self.assertIsNone(same_second.error)
+        self.assertEqual(
+            [os.path.basename(same_second.result) for same_second in jobs],
+            ["test.2020.01.04_120000.db", "test.2020.01.04_120000-2.db", "test.2020.01.04_120000-3.db"]
+        )
+        self.assertEqual(
+            self.db.backups.list_backups(), old_backups + [same_second.result for same_second in jobs] + [job.result]
+        )
+
+        # A second copy onto a file still being written is refused
+        release = threading.Event()
+        running_path = os.path.join(self.test_dir, "running.db")
+        with patch('manager_backup.verify_copy', lambda path: release.wait(5) and []):
+            running = self.db.backups.start(running_path)
+            with self.assertRaises(ValueError):
+                self.db.backups.start(running_path, compact=True)
+            release.set()
+            running.thread.join()
+        self.assertEqual(running.result, running_path)
+        os.remove(running_path)
+
+        self.assertEqual(self.db.backups.rotate(keep=2), old_backups + [same_second.result for same_second in jobs[:2]])
+        self.assertEqual(self.db.backups.list_backups(), [jobs[2].result, job.result])
+        self.assertTrue(os.path.exists(unrelated))
+
 def generate_test_report():
     """Generate HTML test report with detailed results"""
     # Create test suite
@@ -271,7 +1320,11 @@ def generate_test_report():
     test_classes = [
         TestDatabaseOperations,
         TestTreeOperations,
+        TestNumbering,
         TestEncryption,
+        TestNotePayload,
+        TestChunkedNotes,
+        TestPlaintextCache,
         TestSearch,
         TestExport
     ]
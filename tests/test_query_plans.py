@@ -0,0 +1,385 @@
+"""
+Query plan regression tests.
+
+Every SQL statement in the app is run through EXPLAIN QUERY PLAN against a
+seeded outline of a couple of thousand sections:
+
+- the literal statements passed to execute()/executemany() in SOURCE_FILES,
+  found by parsing the source,
+- the statements inside the schema's triggers,
+- everything actually sent to SQLite while the hot paths run (tree loading,
+  edits, moves, deletes, numbering, search, exports), which also covers
+  statements built at run time.
+
+A statement fails if its plan scans a whole table or sorts through a temp
+B-tree, unless it is listed in ALLOWED_PLANS with the reason it has to.
+Tables that only ever hold a handful of rows (SMALL_TABLES) may be scanned.
+"""
+import ast
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from contextlib import contextmanager
+from pathlib import Path
+from unittest.mock import patch
+
+from database import DatabaseHandler
+from manager_encryption import EncryptionManager, DEFAULT_KDF_PARAMS
+from manager_docx import load_sections_for_export as load_docx_sections
+from manager_pdf import load_sections_for_export as load_pdf_sections
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+SOURCE_FILES = [
+    "database.py",
+    "outliner.py",
+    "manager_docx.py",
+    "manager_pdf.py",
+    "manager_json.py",
+    "manager_numbering.py",
+    "manager_settings.py",
+    "manager_writes.py",
+    "manager_backup.py",
+    "manager_migrations.py",
+]
+
+SMALL_TABLES = {"settings", "structure_version", "sqlite_master", "sqlite_schema", "sqlite_sequence"}
+
+# "name AS (" or "name(columns) AS (": a CTE; scanning it reads its own rows
+CTE_NAME = re.compile(r"(\w+)\s*(?:\([^()]*\))?\s+AS\s*(?:NOT\s+)?(?:MATERIALIZED\s*)?\(", re.IGNORECASE)
+
+# temp.<name>: a scratch table holding exactly the rows a statement works on
+TEMP_TABLE = re.compile(r"\btemp\.(\w+)", re.IGNORECASE)
+
+# "FROM table alias" / "JOIN table AS alias": plans name scans by alias
+TABLE_ALIAS = re.compile(r"\b(?:FROM|JOIN)\s+(?:temp\.)?(\w+)\s+(?:AS\s+)?(\w+)", re.IGNORECASE)
+
+# Statements with no plan worth checking
+SKIPPED_PREFIXES = (
+    "BEGIN", "COMMIT", "ROLLBACK", "PRAGMA", "CREATE", "DROP", "ALTER",
+    "VACUUM", "ANALYZE", "ATTACH", "DETACH", "--",
+)
+
+
+def normalize_sql(sql):
+    """One line, with literals and parameters as ?, so traced SQL matches its source."""
+    sql = re.sub(r"[xX]'[0-9a-fA-F]*'", "?", sql)
+    sql = re.sub(r"'(?:[^']|'')*'", "?", sql)
+    sql = re.sub(r"\b\d+(?:\.\d+)?\b", "?", sql)
+    sql = re.sub(r"\bNULL\b", "?", sql, flags=re.IGNORECASE)
+    return " ".join(sql.split()).rstrip(";").strip()
+
+
+# Whole-table plans that are intended, keyed by normalize_sql(statement)
+ALLOWED_PLANS = {normalize_sql(sql): reason for sql, reason in [
+    ("SELECT id, parent_id FROM sections ORDER BY parent_id, placement, id",
+     "numbering rebuild reads every section once, in idx_sections_parent order"),
+    ("""SELECT s.id, s.title, s.type, s.parent_id, c.questions
+        FROM sections s
+        LEFT JOIN section_content c ON c.section_id = s.id
+        ORDER BY s.parent_id, s.placement, s.id""",
+     "load_from_database loads every section, in idx_sections_parent order"),
+    ("""SELECT s.id, s.title, c.questions
+        FROM sections s
+        LEFT JOIN section_content c ON c.section_id = s.id""",
+     "global search and prefetching decrypt every section"),
+    ("SELECT COUNT(*) FROM sections",
+     "record count in the title bar; SQLite counts through the smallest index"),
+    ("SELECT EXISTS (SELECT 1 FROM sections)",
+     "stops at the first row"),
+    ("""SELECT EXISTS (
+            SELECT 1 FROM sections WHERE typeof(title) = 'text'
+        ) OR EXISTS (
+            SELECT 1 FROM section_content WHERE typeof(questions) = 'text'
+        )""",
+     "once per unlock, looking for rows still in the v1 format; stops at the first"),
+    ("""WITH ranked AS (
+            SELECT id,
+                   ROW_NUMBER() OVER (PARTITION BY parent_id ORDER BY placement, id) AS position
+            FROM sections
+        )
+        UPDATE sections
+        SET placement = ranked.position * ?
+        FROM ranked
+        WHERE sections.id = ranked.id""",
+     "fix_all_placements/repair_tree respace every sibling list"),
+    ("UPDATE sections SET placement = 1 WHERE placement IS NULL OR placement <= 0",
+     "repair_tree, only after an unclean exit"),
+    ("UPDATE sections SET path = NULL, depth = NULL",
+     "rebuild_tree_index recomputes every path"),
+    ("""SELECT
+            (SELECT COUNT(*) FROM sections s
+             WHERE s.parent_id IS NOT NULL
+             AND NOT EXISTS (SELECT 1 FROM sections p WHERE p.id = s.parent_id)),
+            (SELECT COUNT(*) FROM (
+                SELECT 1 FROM sections GROUP BY parent_id, placement HAVING COUNT(*) > 1
+            )),
+            (SELECT COUNT(*) FROM sections WHERE placement IS NULL OR placement <= 0),
+            (SELECT COUNT(*) FROM sections WHERE path IS NULL)""",
+     "check_tree_integrity, only after an unclean exit or a layout upgrade"),
+]}
+
+
+def statement_prefix(sql):
+    return sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ""
+
+
+def source_statements(path):
+    """(line, sql) for each literal statement passed to execute/executemany in a file."""
+    tree = ast.parse(path.read_text(encoding="utf-8"))
+    for node in ast.walk(tree):
+        if (
+            isinstance(node, ast.Call)
+            and isinstance(node.func, ast.Attribute)
+            and node.func.attr in ("execute", "executemany")
+            and node.args
+            and isinstance(node.args[0], ast.Constant)
+            and isinstance(node.args[0].value, str)
+        ):
+            yield node.lineno, node.args[0].value
+
+
+class TestQueryPlans(unittest.TestCase):
+    """Hot statements must use an index rather than scan or sort whole tables."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.test_dir = tempfile.mkdtemp()
+        cls.db_path = os.path.join(cls.test_dir, "plans.db")
+        password = "TestPassword123!"
+        cls.db = DatabaseHandler(cls.db_path, EncryptionManager(password))
+        cls.db.save_kdf_params(DEFAULT_KDF_PARAMS)
+        cls.db.set_password(password)
+        cls.seed(cls.db)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.db.close()
+        shutil.rmtree(cls.test_dir)
+
+    @staticmethod
+    def seed(db):
+        """6 headers x 8 categories x 8 subcategories x 4 subheaders, some with notes."""
+        rows = []
+        for h in range(6):
+            rows.append((f"Header {h}", "header", None, None))
+            header_row = len(rows)
+            for c in range(8):
+                rows.append((f"Category {h}.{c}", "category", -header_row, None))
+                category_row = len(rows)
+                for s in range(8):
+                    rows.append((f"Subcategory {h}.{c}.{s}", "subcategory", -category_row, None,
+                                 f"Notes for {h}.{c}.{s}\n" * 3))
+                    subcategory_row = len(rows)
+                    for n in range(4):
+                        rows.append((f"Subheader {h}.{c}.{s}.{n}", "subheader", -subcategory_row, None))
+        db.add_sections_bulk(rows)
+
+    def plan(self, sql, params=()):
+        return [row[3] for row in self.db.conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+
+    def plan_problems(self, sql, params=()):
+        """Plan steps that scan a whole table or sort through a temp B-tree."""
+        scratch = {name.lower() for name in CTE_NAME.findall(sql) + TEMP_TABLE.findall(sql)}
+        scratch |= {alias.lower() for table, alias in TABLE_ALIAS.findall(sql) if table.lower() in scratch}
+        problems = []
+        for detail in self.plan(sql, params):
+            if "TEMP B-TREE" in detail:
+                problems.append(detail)
+            elif detail.startswith("SCAN "):
+                name = detail.split()[1].split(".")[-1]
+                if name.startswith("(") or name == "CONSTANT":
+                    continue
+                if name.lower() in scratch or name.lower() in SMALL_TABLES:
+                    continue
+                problems.append(detail)
+        return problems
+
+    def check_statements(self, statements):
+        """Fail listing every (origin, sql, problems) not on the allowlist."""
+        failures = []
+        for origin, sql, params in statements:
+            problems = self.plan_problems(sql, params)
+            if problems and normalize_sql(sql) not in ALLOWED_PLANS:
+                failures.append(f"{origin}: {normalize_sql(sql)}\n    {problems}")
+        self.assertFalse(failures, "Unindexed plans:\n" + "\n".join(failures))
+
+    @contextmanager
+    def scratch_schema(self, statements):
+        """
+        Create the temp tables among statements for the block, and stand the
+        seeded database in for any database they ATTACH, so statements using
+        either can be planned.
+        """
+        attached = []
+        for sql in dict.fromkeys(statements):
+            if re.match(r"\s*CREATE TEMP TABLE", sql, re.IGNORECASE):
+                self.db.conn.execute(sql)
+            match = re.match(r"\s*ATTACH DATABASE \? AS (\w+)", sql, re.IGNORECASE)
+            if match:
+                self.db.conn.execute("ATTACH DATABASE ? AS " + match.group(1), (self.db._read_only_uri(),))
+                attached.append(match.group(1))
+        try:
+            yield
+        finally:
+            for (table,) in self.db.conn.execute(
+                "SELECT name FROM temp.sqlite_master WHERE type = 'table'"
+            ).fetchall():
+                self.db.conn.execute(f"DROP TABLE temp.{table}")
+            for name in attached:
+                self.db.conn.execute(f"DETACH DATABASE {name}")
+
+    def test_source_statements(self):
+        """Every literal statement in the app's source uses an index."""
+        found = [
+            (f"{name}:{line}", sql)
+            for name in SOURCE_FILES
+            for line, sql in source_statements(REPO_DIR / name)
+        ]
+        statements = []
+        unpreparable = []
+        with self.scratch_schema(sql for _, sql in found):
+            for origin, sql in found:
+                if statement_prefix(sql).startswith(SKIPPED_PREFIXES):
+                    continue
+                params = (1,) * sql.count("?")
+                try:
+                    self.plan(sql, params)
+                except sqlite3.OperationalError as e:
+                    # Only the migration off the inline questions column
+                    # refers to a column the current schema no longer has
+                    if str(e) != "no such column: questions":
+                        unpreparable.append(f"{origin}: {e}")
+                    continue
+                statements.append((origin, sql, params))
+            self.assertFalse(unpreparable, "\n".join(unpreparable))
+            self.assertGreater(len(statements), 50)
+            self.check_statements(statements)
+
+    def test_trigger_statements(self):
+        """Statements inside the schema's triggers use an index."""
+        statements = []
+        for name, sql in self.db.conn.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'trigger'"
+        ):
+            body = re.search(r"\bBEGIN\b(.*)\bEND\b", sql, re.IGNORECASE | re.DOTALL).group(1)
+            body = re.sub(r"\b(?:NEW|OLD)\.\w+", "?", body)
+            for statement in filter(str.strip, body.split(";")):
+                statements.append((f"trigger {name}", statement, (1,) * statement.count("?")))
+        self.assertTrue(statements)
+        self.check_statements(statements)
+
+    def test_traced_statements(self):
+        """Everything the hot paths send to SQLite, including SQL built at run time."""
+        traced = []
+
+        def trace(sql):
+            traced.append(sql)
+
+        db = self.db
+        open_reader = db._open_reader
+
+        def traced_reader():
+            conn = open_reader()
+            conn.set_trace_callback(trace)
+            return conn
+
+        db._close_readers()
+        db.conn.set_trace_callback(trace)
+        try:
+            with patch.object(db, "_open_reader", traced_reader):
+                self.run_hot_paths(db)
+        finally:
+            db.conn.set_trace_callback(None)
+            db._close_readers()
+
+        statements = [
+            ("traced", sql, ()) for sql in dict.fromkeys(traced)
+            if not statement_prefix(sql).startswith(SKIPPED_PREFIXES)
+        ]
+        self.assertGreater(len(statements), 20)
+        with self.scratch_schema(traced):
+            self.check_statements(statements)
+
+    def run_hot_paths(self, db):
+        roots = db.load_children(None)
+        header_id = roots[0][0]
+        categories = db.load_children(header_id)
+        category_id = categories[0][0]
+        db.batch_has_children([row[0] for row in categories])
+        db.has_children(category_id)
+
+        db.numbering.rebuild()
+        db.structure_version()
+
+        # Editing
+        section_id = db.add_section("New section", "category", header_id)
+        db.update_section(section_id, "Renamed", "Some notes")
+        db.update_section(section_id, "Renamed", "line of a large note\n" * 2000)
+        db.get_section_title(section_id)
+        db.get_section_content(section_id)
+        db.get_section_type(section_id)
+        db.get_section_level(section_id)
+        "".join(db.iter_note(section_id))
+        db.copy_note(section_id, category_id)
+        db.writes.save(section_id, "Queued", "Queued notes")
+        db.writes.flush()
+        db.numbering.inserted(section_id, header_id)
+
+        # Moving
+        db.move_section(section_id, category_id, 0)
+        db.numbering.reparented(section_id, header_id, category_id)
+        db.move_section(section_id, None, 1, "header")
+        db.shift_section(section_id, 1)
+        db.shift_section(section_id, -1)
+        db.swap_placement(categories[0][0], categories[1][0])
+        db.fix_placement(header_id)
+        db.numbering.reordered(header_id)
+        db.get_ancestors(category_id)
+
+        # Subtrees
+        db.count_descendants(header_id)
+        db.subtree_bounds(category_id)
+        db.search_sections("subheader 0.1", node_id=header_id)
+        db.search_sections("notes for 2.", global_search=True)
+        load_docx_sections(db, category_id)
+        load_pdf_sections(db)
+        db.refresh_search_cache(header_id)
+
+        # Cloning
+        db.clone_subtree(category_id, header_id)
+        db.clone_subtree(category_id, header_id, with_content=True)
+
+        # Export to a new database, copying ciphertext and re-encrypting
+        for password in (db.encryption_manager.password.decode(), "ExportPassword!"):
+            export_path = os.path.join(self.test_dir, "export.db")
+            db.export_subtree(header_id, export_path, password)
+            os.remove(export_path)
+
+        # Bulk adds and deletes
+        ids = db.add_sections_bulk([("Bulk", "category", header_id, None), ("Child", "subcategory", -1, None)])
+        db.delete_section(section_id)
+        db.numbering.deleted(section_id)
+        db.delete_section(ids[0])
+
+    def test_allowlist_is_current(self):
+        """Every allowlisted statement still exists and still needs to be listed."""
+        source = {}
+        for name in SOURCE_FILES:
+            for line, sql in source_statements(REPO_DIR / name):
+                source.setdefault(normalize_sql(sql), (f"{name}:{line}", sql))
+        stale = []
+        for key in ALLOWED_PLANS:
+            if key not in source:
+                stale.append(f"not found in the source: {key}")
+                continue
+            origin, sql = source[key]
+            if not self.plan_problems(sql, (1,) * sql.count("?")):
+                stale.append(f"{origin}: plan is indexed now: {key}")
+        self.assertFalse(stale, "Stale allowlist entries:\n" + "\n".join(stale))
+
+if __name__ == "__main__":
+    unittest.main()